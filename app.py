@@ -1,7 +1,25 @@
 import os
 import json
-from flask import Flask, render_template, request, redirect, url_for, flash, current_app
+import time
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, current_app, jsonify, abort, stream_with_context, send_file
 from modules.perf_analyzer.analyzer import PerfAnalyzer
+from modules.perf_analyzer.jobs import JobQueue
+from modules.perf_analyzer.continuous import ContinuousProfilerManager, parse_duration, parse_time
+from modules.perf_analyzer.ingest import IngestStore, FORMAT_PERF_SCRIPT
+from modules.perf_analyzer.uploads import UploadManager, parse_content_range
+from modules.perf_analyzer.modes import MODES, DEFAULT_MODE
+from modules.perf_analyzer.artifacts import ENCODINGS, FLAMEGRAPH_NAME, FOLDED_NAME, ANALYSIS_NAME
+from core.config import settings
+from core.metrics import Span, Timeline, registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+# Run artifacts served by the artifact endpoint, with their media types
+SERVED_ARTIFACTS = {
+    FLAMEGRAPH_NAME: 'image/svg+xml',
+    ANALYSIS_NAME: 'application/json',
+    FOLDED_NAME: 'text/plain; charset=utf-8',
+}
+# Seconds browsers may reuse an artifact before revalidating it with its ETag
+ARTIFACT_MAX_AGE = 3600
 
 def create_app():
     app = Flask(__name__)
@@ -15,7 +33,129 @@ def create_app():
     # The PerfAnalyzer is now configured via core.config, so we don't pass keys here.
     perf_output_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'perf_reports')
     app.perf_analyzer = PerfAnalyzer(output_dir=perf_output_dir)
+    app.perf_jobs = JobQueue(app.perf_analyzer)
+    app.perf_continuous = ContinuousProfilerManager(app.perf_analyzer)
+    app.perf_ingest = IngestStore(os.path.join(app.config['UPLOAD_FOLDER'], 'fleet'))
+    app.perf_uploads = UploadManager(os.path.join(app.config['UPLOAD_FOLDER'], 'incoming'))
+
+    def wants_json():
+        """True if the client asked for a JSON response rather than a page."""
+        return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+    def get_job_or_404(job_id):
+        job = current_app.perf_jobs.get(job_id)
+        if job is None:
+            abort(404)
+        return job
+
+    def job_urls(job):
+        return {
+            'job_url': url_for('perf_job', job_id=job.id),
+            'status_url': url_for('perf_job_status', job_id=job.id),
+            'result_url': url_for('perf_job_result', job_id=job.id),
+            'analysis_stream_url': url_for('perf_job_analysis_stream', job_id=job.id),
+        }
+
+    def get_session_or_404(session_id):
+        session = current_app.perf_continuous.get(session_id)
+        if session is None:
+            abort(404)
+        return session
+
+    def session_urls(session):
+        return {
+            'session_url': url_for('perf_continuous_session', session_id=session.id),
+            'stop_url': url_for('perf_continuous_stop', session_id=session.id),
+            'delete_url': url_for('perf_continuous_delete', session_id=session.id),
+            'profile_url': url_for('perf_continuous_profile', session_id=session.id),
+        }
+
+    def get_upload_or_404(upload_id):
+        upload = current_app.perf_uploads.get(upload_id)
+        if upload is None:
+            abort(404)
+        return upload
+
+    def upload_urls(upload):
+        return {
+            'upload_url': url_for('perf_upload', upload_id=upload.id),
+            'complete_url': url_for('perf_upload_complete', upload_id=upload.id),
+        }
 
+    def artifact_url(run_id, name):
+        return url_for('perf_run_artifact', run_id=run_id, name=name)
+
+    def requested_time_range():
+        """
+        Reads a time range from the query string: either `last` (e.g. "5m")
+        or `since`/`until` (epoch seconds or a time of day such as "10:02").
+
+        Returns:
+            tuple: (since, until) in epoch seconds; either may be None.
+        """
+        if request.args.get('last'):
+            last = parse_duration(request.args['last'])
+            return (time.time() - last if last else None), None
+        since = parse_time(request.args['since']) if request.args.get('since') else None
+        until = parse_time(request.args['until']) if request.args.get('until') else None
+        return since, until
+
+    def profile_report(profile, label, details):
+        """
+        Stores a merged profile as a new run and shows its report, or returns
+        it as JSON. With `analyze=1`, the AI analysis runs on the profile;
+        `analyze=local` only runs the local bottleneck detection.
+
+        Args:
+            profile (Profile): The merged call tree.
+            label (str): What the profile covers, shown as the report title.
+            details (dict): Extra fields for the JSON response.
+        """
+        analyzer = current_app.perf_analyzer
+        run_id = analyzer.new_run()
+        timeline = Timeline()
+        with timeline.activate():
+            try:
+                svg_path = analyzer.generate_flamegraph_from_profile(profile, run_id=run_id)
+                analysis = None
+                if request.args.get('analyze') in ('1', 'true', 'local'):
+                    folded_stacks_path = analyzer.folded_stacks_path(run_id)
+                    if request.args['analyze'] == 'local':
+                        analysis = analyzer.local_analysis(folded_stacks_path)
+                    else:
+                        analysis = analyzer.analyze_with_llm(folded_stacks_path)
+                    if analysis.get('fallback_reason'):
+                        flash(f"AI analysis unavailable ({analysis['fallback_reason']}); "
+                              f"showing the local analysis.", "warning")
+                    if 'error' in analysis:
+                        flash(f"AI analysis failed: {analysis['error']}", "danger")
+                        analysis = {}
+                    analyzer.save_analysis(run_id, analysis)
+            finally:
+                analyzer.finish_run(run_id)
+
+        if wants_json():
+            return jsonify(dict(details, run_id=run_id, total_samples=profile.total,
+                                top_functions=profile.top_functions(20), analysis=analysis,
+                                flamegraph_url=artifact_url(run_id, FLAMEGRAPH_NAME) if svg_path else None,
+                                timings=timeline.to_list()))
+
+        if not svg_path:
+            flash("Could not render the flame graph.", "danger")
+        return render_template(
+            'perf_report.html',
+            command=label,
+            run_id=run_id,
+            flamegraph_url=artifact_url(run_id, FLAMEGRAPH_NAME) if svg_path else None,
+            llm_analysis_json=json.dumps(analysis),
+            analysis_stream_url=None,
+            timings=timeline.to_list()
+        )
+
+    @app.route('/metrics')
+    def metrics():
+        """Exports stage timings, sizes, sample and token counts for Prometheus."""
+        return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
 
     @app.route('/')
     def index():
@@ -25,59 +165,512 @@ def create_app():
     @app.route('/perf')
     def perf_index():
         """Displays the main page for the performance analyzer."""
-        return render_template('perf.html')
+        return render_template('perf.html', modes=MODES.values(), default_mode=DEFAULT_MODE)
 
     @app.route('/perf/analyze', methods=['POST'])
     def perf_analyze():
         """
-        Triggers the performance analysis and displays the report.
+        Enqueues a performance analysis and returns its job ID straight away.
         """
-        command_to_run = request.form.get('command', 'sleep 10').strip()
-        duration = int(request.form.get('duration', 10))
+        form = request.get_json(silent=True) or request.form
+        command_to_run = str(form.get('command', 'sleep 10')).strip()
+        duration = int(form.get('duration', 10))
+        mode = form.get('mode') or DEFAULT_MODE
 
         if not command_to_run:
+            if wants_json():
+                return jsonify({"error": "Please provide a command to analyze."}), 400
             flash("Please provide a command to analyze.", "danger")
             return redirect(url_for('perf_index'))
+        if mode not in MODES:
+            if wants_json():
+                return jsonify({"error": f"Unknown profiling mode '{mode}'."}), 400
+            flash(f"Unknown profiling mode '{mode}'.", "danger")
+            return redirect(url_for('perf_index'))
 
-        command_list = command_to_run.split()
+        job = current_app.perf_jobs.submit(command_to_run, duration, mode=mode)
+        if job is None:
+            if wants_json():
+                return jsonify({"error": "Too many analyses are in progress. Please try again later."}), 503
+            flash("Too many analyses are in progress. Please try again later.", "danger")
+            return redirect(url_for('perf_index'))
 
-        perf_analyzer = current_app.perf_analyzer
+        if wants_json():
+            return jsonify(dict(job.to_dict(), **job_urls(job))), 202, {'Location': url_for('perf_job_status', job_id=job.id)}
+        return redirect(url_for('perf_job', job_id=job.id))
 
-        # 1. Collect data
-        perf_data_file = perf_analyzer.collect_data(command=command_list, duration=duration)
-        if not perf_data_file:
-            flash("Failed to collect perf data. Ensure 'perf' is installed and you have sudo privileges.", "danger")
-            return redirect(url_for('perf_index'))
+    @app.route('/perf/uploads', methods=['POST'])
+    def perf_upload_create():
+        """
+        Starts a chunked upload of an existing capture: a perf.data file,
+        `perf script` output or folded stacks, optionally gzip-compressed.
+        Send the chunks with PUT to `upload_url`, then POST to `complete_url`.
+        `mode` says how the capture was recorded, e.g. 'offcpu'; `perf script`
+        output is folded accordingly as it arrives.
+        """
+        form = request.get_json(silent=True) or request.form
+        try:
+            size = int(form['size']) if form.get('size') else None
+        except ValueError:
+            return jsonify({"error": "Invalid 'size'; expected a number of bytes."}), 400
+        upload = current_app.perf_uploads.create(form.get('filename', ''), size, form.get('format'), form.get('mode'))
+        if isinstance(upload, dict):
+            return jsonify(upload), 400
+        return jsonify(dict(upload.to_dict(), chunk_size=settings.PERF_UPLOAD_CHUNK_BYTES,
+                            **upload_urls(upload))), 201
 
-        # 2. Generate flame graph
-        flamegraph_svg_path = perf_analyzer.generate_flamegraph(perf_data_file)
-        if not flamegraph_svg_path:
-            flash("Failed to generate flame graph.", "danger")
-            return redirect(url_for('perf_index'))
+    @app.route('/perf/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+    def perf_upload(upload_id):
+        """
+        GET returns an upload's state; its `offset` is where a resumed upload
+        continues. PUT appends a chunk, located by its `Content-Range`
+        header (or an `offset` parameter), and is streamed to disk. DELETE
+        cancels the upload.
+        """
+        upload = get_upload_or_404(upload_id)
+        if request.method == 'GET':
+            return jsonify(dict(upload.to_dict(), **upload_urls(upload)))
+        if request.method == 'DELETE':
+            current_app.perf_uploads.remove(upload.id)
+            return '', 204
 
-        # 3. Analyze with LLM
-        folded_stacks_file = os.path.join(perf_analyzer.output_dir, 'out.perf-folded')
-        llm_analysis_json = perf_analyzer.analyze_with_llm(folded_stacks_file)
+        length = request.content_length
+        if request.headers.get('Content-Range'):
+            content_range = parse_content_range(request.headers['Content-Range'])
+            if content_range is None:
+                return jsonify({"error": "Invalid Content-Range header.", "offset": upload.received}), 400
+            start, end, _ = content_range
+            if length is not None and length != end - start + 1:
+                return jsonify({"error": "Content-Range does not match the body length.",
+                                "offset": upload.received}), 400
+        else:
+            start = request.args.get('offset', type=int, default=upload.received)
 
-        # Handle potential errors from the LLM analysis
-        if 'error' in llm_analysis_json:
-            flash(f"AI analysis failed: {llm_analysis_json['error']}", "danger")
-            # Proceed without AI analysis if it fails
-            llm_analysis_json = {}
+        result = upload.write_chunk(start, request.stream, length)
+        if result.get('error'):
+            # The client resumes from the returned offset.
+            return jsonify(result), 409
+        return jsonify(result)
 
-        try:
-            with open(flamegraph_svg_path, 'r') as f:
-                flamegraph_svg_content = f.read()
-        except IOError as e:
-            flash(f"Could not read flame graph file: {e}", "danger")
-            flamegraph_svg_content = "<p>Error loading flame graph.</p>"
+    @app.route('/perf/uploads/<upload_id>/complete', methods=['POST'])
+    def perf_upload_complete(upload_id):
+        """
+        Finishes an upload and queues its analysis, skipping the perf
+        capture. Text formats have mostly been parsed by now. `mode` says
+        how the capture was recorded, e.g. 'offcpu'; it defaults to the mode
+        the upload was created with. `perf script` output has already been
+        folded in that mode, so it cannot be changed here.
+        """
+        upload = get_upload_or_404(upload_id)
+        form = request.get_json(silent=True) or request.form
+        mode = form.get('mode') or upload.mode
+        if mode not in MODES:
+            return jsonify({"error": f"Unknown profiling mode '{mode}'."}), 400
+        if mode != upload.mode and upload.format == FORMAT_PERF_SCRIPT:
+            return jsonify({"error": f"The perf script output was folded as '{upload.mode}'; "
+                                     f"give the mode when creating the upload."}), 400
+        result = upload.finish()
+        if result.get('error'):
+            return jsonify(result), 400
+
+        job = current_app.perf_jobs.submit(f"upload: {upload.filename}", None, upload=upload, mode=mode)
+        if job is None:
+            return jsonify({"error": "Too many analyses are in progress. Please try again later."}), 503
+        if wants_json():
+            return jsonify(dict(job.to_dict(), **job_urls(job))), 202, {'Location': url_for('perf_job_status', job_id=job.id)}
+        return redirect(url_for('perf_job', job_id=job.id))
+
+    @app.route('/perf/jobs/<job_id>')
+    def perf_job(job_id):
+        """Displays the progress of an analysis job until its report is ready."""
+        job = get_job_or_404(job_id)
+        return render_template('perf_job.html', job=job.to_dict(), **job_urls(job))
+
+    @app.route('/perf/jobs/<job_id>/status')
+    def perf_job_status(job_id):
+        """Returns the state of an analysis job as JSON, for polling."""
+        job = get_job_or_404(job_id)
+        return jsonify(dict(job.to_dict(), **job_urls(job)))
+
+    @app.route('/perf/jobs/<job_id>/result')
+    def perf_job_result(job_id):
+        """
+        Displays the report of an analysis job once its flame graph is ready.
+        """
+        job = get_job_or_404(job_id)
+
+        # The report opens as soon as the flame graph is ready; the AI
+        # analysis then streams in through the analysis stream.
+        if not job.finished and (wants_json() or not job.flamegraph_svg_path):
+            if wants_json():
+                return jsonify(dict(job.to_dict(), **job_urls(job))), 202
+            return redirect(url_for('perf_job', job_id=job.id))
+
+        if job.status == 'failed':
+            if wants_json():
+                return jsonify(dict(job.to_dict(), **job_urls(job))), 500
+            flash(job.error, "danger")
+            return redirect(url_for('perf_index'))
+
+        if wants_json():
+            return jsonify(dict(job.to_dict(), analysis=job.analysis))
 
+        for warning in job.warnings:
+            flash(warning, "danger")
+
+        # The page loads the flame graph itself, from the artifact endpoint.
         # Pass the raw JSON to the template for the frontend to handle
         return render_template(
             'perf_report.html',
-            command=command_to_run,
-            flamegraph_svg=flamegraph_svg_content,
-            llm_analysis_json=json.dumps(llm_analysis_json) # Convert dict to JSON string
+            command=job.command,
+            run_id=job.run_id,
+            flamegraph_url=artifact_url(job.run_id, FLAMEGRAPH_NAME),
+            llm_analysis_json=json.dumps(job.analysis if job.finished else None), # Convert dict to JSON string
+            analysis_stream_url=None if job.finished else url_for('perf_job_analysis_stream', job_id=job.id),
+            timings=job.timeline.to_list()
+        )
+
+    @app.route('/perf/runs/<run_id>/artifacts/<name>')
+    def perf_run_artifact(run_id, name):
+        """
+        Serves a run's flame graph, analysis or folded stacks, pre-compressed
+        in the best encoding the client accepts. Responses carry an ETag and
+        Last-Modified, so repeat views are answered with 304 Not Modified,
+        and byte ranges of the (encoded) artifact can be requested.
+        """
+        mimetype = SERVED_ARTIFACTS.get(name)
+        store = current_app.perf_analyzer.store
+        if mimetype is None or not store.has_run(run_id):
+            abort(404)
+        path = store.artifact_path(run_id, name)
+        if not path or not os.path.isfile(path):
+            abort(404)
+
+        return send_artifact(path, name, mimetype)
+
+    @app.route('/perf/runs/<run_id>/diffs/<baseline_run_id>.svg')
+    def perf_run_diff_artifact(run_id, baseline_run_id):
+        """
+        Serves the differential flame graph of a run against a baseline, once
+        /perf/diff has rendered it, like the run's other artifacts.
+        """
+        store = current_app.perf_analyzer.store
+        if not store.has_run(run_id) or not store.has_run(baseline_run_id):
+            abort(404)
+        path = current_app.perf_analyzer.diff_svg_path(baseline_run_id, run_id)
+        if not path or not os.path.isfile(path):
+            abort(404)
+        return send_artifact(path, 'diff.svg', 'image/svg+xml')
+
+    def send_artifact(path, name, mimetype):
+        """
+        Sends an artifact pre-compressed in the best encoding the client
+        accepts, with an ETag and Last-Modified for conditional requests.
+        """
+        store = current_app.perf_analyzer.store
+        with Span('read_report', artifact=name) as span:
+            encoding = next((e for e in ENCODINGS if request.accept_encodings.quality(e) > 0), None)
+            served_path = store.encoded_path(path, encoding) if encoding else path
+            span.set(bytes_out=os.path.getsize(served_path), encoding=encoding)
+
+        # The ETag is derived from the served file, so each encoding has its own.
+        response = send_file(served_path, mimetype=mimetype, conditional=True, etag=True,
+                             last_modified=os.path.getmtime(path), max_age=ARTIFACT_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def get_tree_index_or_404(run_id):
+        analyzer = current_app.perf_analyzer
+        index = analyzer.tree_index(run_id) if analyzer.store.has_run(run_id) else None
+        if index is None:
+            abort(404)
+        return index
+
+    def int_arg(name, default, maximum):
+        """Reads a non-negative integer query parameter, capped at `maximum`."""
+        try:
+            value = int(request.args.get(name, default))
+        except ValueError:
+            abort(400)
+        if value < 0:
+            abort(400)
+        return min(value, maximum)
+
+    @app.route('/perf/runs/<run_id>/tree')
+    def perf_run_tree(run_id):
+        """
+        Returns part of a run's call tree as JSON: the node at `path` (frame
+        names joined by ';') or `node` (an ID from an earlier response), and
+        its hottest children down to `depth` levels, at most `limit` per
+        node. With `search`, matching frame names carry highlight ranges.
+        """
+        index = get_tree_index_or_404(run_id)
+        depth = int_arg('depth', 1, settings.PERF_TREE_MAX_DEPTH)
+        limit = int_arg('limit', 50, settings.PERF_TREE_MAX_CHILDREN)
+
+        with Span('tree') as span:
+            if request.args.get('node'):
+                node = int_arg('node', 0, len(index))
+            else:
+                path = request.args.get('path', '')
+                node = index.find(path.split(';') if path else [])
+                if node is None:
+                    return jsonify({"error": f"No call path '{path}' in run {run_id}."}), 404
+            tree = index.subtree(node, depth=depth, limit=limit, search=request.args.get('search'))
+            span.set(samples=index.total)
+
+        return jsonify({'run_id': run_id, 'total': index.total, 'path': index.path(node), 'tree': tree})
+
+    @app.route('/perf/runs/<run_id>/tree/search')
+    def perf_run_tree_search(run_id):
+        """
+        Finds the frames of a run whose name contains `q`, ignoring case,
+        with highlight ranges, their samples and their hottest call paths.
+        """
+        index = get_tree_index_or_404(run_id)
+        limit = int_arg('limit', 20, settings.PERF_TREE_MAX_CHILDREN)
+        with Span('tree_search') as span:
+            result = index.search(request.args.get('q', ''), limit=limit)
+            span.set(samples=index.total)
+        return jsonify(dict(result, run_id=run_id, total=index.total))
+
+    @app.route('/perf/diff')
+    def perf_diff():
+        """
+        Compares two runs: a differential flame graph of the candidate and the
+        functions that regressed or improved since the baseline. With
+        `analyze=1`, the AI also explains the regressions.
+        """
+        baseline = request.args.get('baseline', '').strip()
+        candidate = request.args.get('candidate', '').strip()
+        try:
+            threshold = float(request.args['threshold']) if request.args.get('threshold') else None
+        except ValueError:
+            threshold = None
+        if not baseline or not candidate:
+            if wants_json():
+                return jsonify({"error": "Please provide a baseline and a candidate run ID."}), 400
+            flash("Please provide a baseline and a candidate run ID.", "danger")
+            return redirect(url_for('perf_index'))
+
+        diff, result = current_app.perf_analyzer.diff_runs(baseline, candidate, threshold)
+        if diff is None:
+            if wants_json():
+                return jsonify(result), 404
+            flash(result['error'], "danger")
+            return redirect(url_for('perf_index'))
+
+        analysis = None
+        if request.args.get('analyze') in ('1', 'true'):
+            analysis = current_app.perf_analyzer.analyze_diff_with_llm(diff, threshold)
+            if 'error' in analysis:
+                if not wants_json():
+                    flash(f"AI analysis failed: {analysis['error']}", "danger")
+                analysis = analysis if wants_json() else None
+
+        if wants_json():
+            result = {key: value for key, value in result.items() if key != 'flamegraph_svg_path'}
+            return jsonify(dict(result, analysis=analysis))
+
+        return render_template(
+            'perf_diff.html',
+            diff=result,
+            flamegraph_url=url_for('perf_run_diff_artifact', run_id=candidate, baseline_run_id=baseline),
+            analysis=analysis,
+            analyze_url=url_for('perf_diff', baseline=baseline, candidate=candidate, analyze=1,
+                                **({'threshold': threshold} if threshold is not None else {}))
+        )
+
+    @app.route('/perf/continuous', methods=['POST'])
+    def perf_continuous_start():
+        """
+        Starts profiling a running process, by PID or name, in back-to-back
+        windows until it is stopped.
+        """
+        form = request.get_json(silent=True) or request.form
+        target = str(form.get('target', '')).strip()
+        try:
+            window = int(form['window']) if form.get('window') else None
+            freq = int(form['freq']) if form.get('freq') else None
+        except ValueError:
+            window = freq = None
+        if not target:
+            if wants_json():
+                return jsonify({"error": "Please provide a PID or process name to profile."}), 400
+            flash("Please provide a PID or process name to profile.", "danger")
+            return redirect(url_for('perf_index'))
+
+        session = current_app.perf_continuous.start(target, window, freq)
+        if session is None:
+            message = "Too many continuous profiling sessions are recording. Please stop one first."
+            if wants_json():
+                return jsonify({"error": message}), 503
+            flash(message, "danger")
+            return redirect(url_for('perf_index'))
+        if session.status == 'failed':
+            if wants_json():
+                return jsonify(session.to_dict()), 404
+            flash(session.error, "danger")
+            return redirect(url_for('perf_index'))
+
+        if wants_json():
+            return jsonify(dict(session.to_dict(), **session_urls(session))), 201
+        return redirect(url_for('perf_continuous_session', session_id=session.id))
+
+    @app.route('/perf/continuous/<session_id>')
+    def perf_continuous_session(session_id):
+        """Displays the state of a continuous profiling session."""
+        session = get_session_or_404(session_id)
+        if wants_json():
+            return jsonify(dict(session.to_dict(), **session_urls(session)))
+        return render_template('perf_continuous.html', session=session.to_dict(), **session_urls(session))
+
+    @app.route('/perf/continuous/<session_id>/stop', methods=['POST'])
+    def perf_continuous_stop(session_id):
+        """Stops a continuous profiling session; its windows are kept."""
+        session = get_session_or_404(session_id)
+        current_app.perf_continuous.stop(session.id)
+        if wants_json():
+            return jsonify(dict(session.to_dict(), **session_urls(session)))
+        return redirect(url_for('perf_continuous_session', session_id=session.id))
+
+    @app.route('/perf/continuous/<session_id>/delete', methods=['POST'])
+    def perf_continuous_delete(session_id):
+        """Deletes a continuous profiling session and its windows, stopping it first if needed."""
+        session = get_session_or_404(session_id)
+        current_app.perf_continuous.delete(session.id)
+        if wants_json():
+            return '', 204
+        flash(f"Deleted the continuous profiling session of {session.target}.", "success")
+        return redirect(url_for('perf_index'))
+
+    @app.route('/perf/continuous/<session_id>/profile')
+    def perf_continuous_profile(session_id):
+        """
+        Merges the windows of a time range into one profile and shows its
+        report. The range is either `last` (e.g. "5m") or `since`/`until`
+        (epoch seconds or a time of day such as "10:02"). With `analyze=1`,
+        the AI analysis runs on the merged profile.
+        """
+        session = get_session_or_404(session_id)
+        since, until = requested_time_range()
+        profile, ranges = session.store.merge(since, until)
+        if not profile.total:
+            message = "No profiled windows in the selected time range yet."
+            if wants_json():
+                return jsonify({"error": message}), 404
+            flash(message, "danger")
+            return redirect(url_for('perf_continuous_session', session_id=session.id))
+
+        time_range = {'since': ranges[0][0], 'until': ranges[-1][1], 'windows': len(ranges)}
+        window_text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time_range['since'])) + ' - ' + \
+            time.strftime('%H:%M:%S', time.localtime(time_range['until']))
+        return profile_report(profile, f"{session.target} ({window_text}, {len(ranges)} windows)", time_range)
+
+    @app.route('/perf/ingest', methods=['POST'])
+    def perf_ingest():
+        """
+        Accepts a profile pushed by a host: folded stacks, or raw `perf
+        script` output with `format=perf-script`, optionally gzip-compressed.
+        The request body is the profile; `host` and `service` tag it and
+        `time` (epoch seconds) says when it was captured.
+        """
+        timestamp = None
+        if request.args.get('time'):
+            timestamp = parse_time(request.args['time'])
+            if timestamp is None:
+                return jsonify({"error": "Invalid 'time'; expected epoch seconds."}), 400
+
+        result = current_app.perf_ingest.ingest(
+            request.stream,
+            host=request.args.get('host', ''),
+            service=request.args.get('service', ''),
+            timestamp=timestamp,
+            fmt=request.args.get('format', 'folded'),
+        )
+        if 'error' in result:
+            return jsonify(result), 400
+        result['profile_url'] = url_for('perf_fleet_profile', service=result['service'])
+        return jsonify(result), 201
+
+    @app.route('/perf/fleet')
+    def perf_fleet():
+        """Lists the services that hosts have pushed profiles for."""
+        services = current_app.perf_ingest.services()
+        if wants_json():
+            return jsonify(services)
+        return render_template('perf_fleet.html', services=services, service=None, hosts=None)
+
+    @app.route('/perf/fleet/<service>')
+    def perf_fleet_profile(service):
+        """
+        Shows the merged profile of a service across all of its hosts, or
+        only the hosts given by `host` (repeated or comma-separated), within
+        an optional time range (`last`, or `since`/`until`).
+        """
+        hosts = [host for value in request.args.getlist('host') for host in value.split(',') if host]
+        since, until = requested_time_range()
+        profile = current_app.perf_ingest.profile(service, hosts or None, since, until)
+        if profile is None:
+            abort(404)
+        if not profile.total:
+            message = "No profiles match the selected hosts and time range."
+            if wants_json():
+                return jsonify({"error": message}), 404
+            flash(message, "danger")
+            return redirect(url_for('perf_fleet_hosts', service=service))
+
+        label = f"{service} ({', '.join(hosts) if hosts else 'all hosts'})"
+        return profile_report(profile, label, {'service': service, 'hosts': hosts, 'since': since, 'until': until})
+
+    @app.route('/perf/fleet/<service>/hosts')
+    def perf_fleet_hosts(service):
+        """
+        Breaks a service's samples down by host. With `function`, shows how
+        much of each host's time is spent in that function.
+        """
+        function = request.args.get('function') or None
+        rows = current_app.perf_ingest.hosts(service, function)
+        if rows is None:
+            abort(404)
+        if wants_json():
+            return jsonify({'service': service, 'function': function, 'hosts': rows})
+        return render_template('perf_fleet.html', services=current_app.perf_ingest.services(),
+                               service=service, function=function, hosts=rows)
+
+    @app.route('/perf/jobs/<job_id>/analysis/stream')
+    def perf_job_analysis_stream(job_id):
+        """
+        Streams a job's AI analysis as Server-Sent Events: a `bottleneck`
+        event per bottleneck as the model completes it, then `analysis` with
+        the full result, and `end` when the job finishes. Reconnecting
+        clients resume after the `Last-Event-ID` they last received.
+        """
+        job = get_job_or_404(job_id)
+        try:
+            start = int(request.headers.get('Last-Event-ID', -1)) + 1
+        except ValueError:
+            start = 0
+
+        def generate(start):
+            while True:
+                events = job.wait_for_events(start, timeout=15)
+                if not events:
+                    # Comment line to keep proxies from closing an idle stream.
+                    yield ": keep-alive\n\n"
+                    continue
+                for name, data in events:
+                    yield f"id: {start}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+                    start += 1
+                    if name == 'end':
+                        return
+
+        return Response(
+            stream_with_context(generate(start)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
         )
 
     return app
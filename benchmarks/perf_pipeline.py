@@ -0,0 +1,286 @@
+"""
+Benchmarks each stage of the perf analysis pipeline on synthetic profiles.
+
+    python -m benchmarks.perf_pipeline --sizes small,medium --output results.json
+    python -m benchmarks.perf_pipeline --baseline old.json --output new.json
+
+Every stage is timed over several repetitions without memory tracing, then
+run once more under tracemalloc for its peak Python heap usage. Results are
+written as JSON; with --baseline, stages that got slower by more than
+--tolerance percent are listed and the exit status is 1.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from core import prompts
+from core.config import settings
+from modules.perf_analyzer.analyzer import PerfAnalyzer
+from modules.perf_analyzer.detect import detect_bottlenecks
+from modules.perf_analyzer.collapse import StackCollapser, PERF_SCRIPT_ENCODING, PERF_SCRIPT_ERRORS
+from modules.perf_analyzer.flamegraph import FlameGraphRenderer
+from modules.perf_analyzer.profile import Profile
+from modules.perf_analyzer.summarize import summarize_profile, prompt_token_budget
+from .synthetic import SyntheticProfile
+
+SCHEMA_VERSION = 1
+
+# Profile shapes: samples, distinct stacks, maximum depth, distinct frames.
+SIZES = {
+    'small': dict(samples=10000, stacks=500, depth=24, frames=300),
+    'medium': dict(samples=100000, stacks=5000, depth=48, frames=2000),
+    'large': dict(samples=1000000, stacks=50000, depth=96, frames=10000),
+}
+
+JOB_TIMEOUT = 300
+
+
+class ReplayPerfAnalyzer(PerfAnalyzer):
+    """
+    A PerfAnalyzer whose `perf record` and `perf script` are replayed from a
+    synthetic `perf script` file, so the rest of the /perf/analyze path runs
+    for real on machines without perf or sudo.
+    """
+
+    def __init__(self, output_dir, script_path):
+        super().__init__(output_dir=output_dir)
+        self.script_path = script_path
+
+    def collect_data(self, command, duration=10, freq=99, run_id=None, system_wide=False, mode='cpu'):
+        return self.script_path
+
+    def collapse_perf_data(self, perf_data_path, mode='cpu'):
+        with open(perf_data_path, 'r', encoding=PERF_SCRIPT_ENCODING, errors=PERF_SCRIPT_ERRORS) as f:
+            return StackCollapser().feed_lines(f)
+
+
+def measure(fn, repeat):
+    """
+    Times `fn` over `repeat` runs, then measures its peak traced memory in
+    one more run.
+
+    Returns:
+        dict: Timings in seconds and the peak in bytes.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': {
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.fmean(timings),
+            'max': max(timings),
+        },
+        'peak_bytes': peak,
+        'repeat': repeat,
+    }
+
+
+def bench_size(name, shape, repeat, workdir, seed, end_to_end):
+    """Runs every stage on one profile size; returns a list of results."""
+    synthetic = SyntheticProfile(seed=seed, **shape)
+    script_path = os.path.join(workdir, f"{name}.perf-script")
+    folded_path = os.path.join(workdir, f"{name}.folded")
+    synthetic.write_perf_script(script_path)
+    synthetic.write_folded(folded_path)
+    info = {
+        'size': name,
+        'shape': dict(shape, seed=seed, unique_stacks=len(synthetic.stacks)),
+        'input_bytes': {
+            'perf_script': os.path.getsize(script_path),
+            'folded': os.path.getsize(folded_path),
+        },
+    }
+
+    def collapse():
+        with open(script_path, 'r', encoding=PERF_SCRIPT_ENCODING, errors=PERF_SCRIPT_ERRORS) as f:
+            return StackCollapser().feed_lines(f)
+
+    def parse_folded():
+        with open(folded_path, 'r', encoding=PERF_SCRIPT_ENCODING, errors=PERF_SCRIPT_ERRORS) as f:
+            return Profile.from_folded(f)
+
+    profile = parse_folded()
+    analyzer = PerfAnalyzer(output_dir=os.path.join(workdir, f"{name}-store"))
+    run_id = analyzer.new_run()
+    analyzer.generate_flamegraph_from_profile(profile, run_id=run_id)
+    stored_folded = analyzer.folded_stacks_path(run_id)
+    budget = prompt_token_budget(prompts.PERF_ANALYSIS_JSON_PROMPT, prompts.PERF_ANALYSIS_SYSTEM_PROMPT)
+
+    stages = [
+        ('collapse_perf_script', collapse, info['input_bytes']['perf_script']),
+        ('parse_folded', parse_folded, info['input_bytes']['folded']),
+        ('build_profile', lambda: Profile.from_stacks(synthetic.stacks), None),
+        ('serialize_profile', lambda: Profile.from_bytes(profile.to_bytes()), None),
+        ('render_flamegraph', lambda: FlameGraphRenderer().render(profile), None),
+        ('summarize_profile', lambda: summarize_profile(profile, token_budget=budget), None),
+        ('detect_bottlenecks', lambda: detect_bottlenecks(profile), None),
+        ('build_prompt', lambda: analyzer._analysis_prompt(stored_folded), None),
+    ]
+
+    results = []
+    for stage, fn, input_bytes in stages:
+        print(f"[{name}] {stage}...", file=sys.stderr)
+        result = dict(info, stage=stage, **measure(fn, repeat))
+        if input_bytes:
+            result['mb_per_second'] = input_bytes / 1e6 / result['seconds']['median']
+        results.append(result)
+
+    if end_to_end:
+        print(f"[{name}] perf_analyze...", file=sys.stderr)
+        results.append(dict(info, stage='perf_analyze', **bench_end_to_end(script_path, workdir, repeat)))
+    return results
+
+
+def bench_end_to_end(script_path, workdir, repeat):
+    """
+    Times POST /perf/analyze until the job is done, through the Flask app
+    with a simulated LLM. Only `perf record` and `perf script` are replayed.
+    """
+    from app import create_app
+
+    settings.SIMULATE_LLM = True
+    settings.SIMULATE_LLM_DELAY = 0
+    # create_app() keeps its uploads under the working directory.
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        app = create_app()
+    finally:
+        os.chdir(cwd)
+    replay = ReplayPerfAnalyzer(os.path.join(workdir, 'app-store'), script_path)
+    app.perf_analyzer = app.perf_jobs.perf_analyzer = replay
+    client = app.test_client()
+
+    def analyze():
+        # Every run replays the same capture; drop the rendered objects so
+        # the flame graph is not reused from the previous run.
+        shutil.rmtree(replay.store.objects_dir)
+        os.makedirs(replay.store.objects_dir)
+        response = client.post('/perf/analyze', json={'command': 'benchmark', 'duration': 1},
+                               headers={'Accept': 'application/json'})
+        status_url = response.get_json()['status_url']
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            job = client.get(status_url).get_json()
+            if job['status'] in ('done', 'failed'):
+                if job['status'] == 'failed':
+                    raise RuntimeError(f"Benchmark job failed: {job['error']}")
+                return job
+            time.sleep(0.005)
+        raise RuntimeError("Benchmark job timed out.")
+
+    try:
+        return measure(analyze, repeat)
+    finally:
+        app.perf_jobs.shutdown()
+
+
+def compare(results, baseline, tolerance):
+    """
+    Lists the stages whose median time grew by more than `tolerance`
+    percent against a baseline result file.
+    """
+    before = {(r['size'], r['stage']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = before.get((result['size'], result['stage']))
+        if not old:
+            continue
+        old_median, new_median = old['seconds']['median'], result['seconds']['median']
+        change = 100 * (new_median - old_median) / old_median if old_median else 0.0
+        if change > tolerance:
+            regressions.append({
+                'size': result['size'],
+                'stage': result['stage'],
+                'baseline_seconds': old_median,
+                'seconds': new_median,
+                'change_percent': round(change, 1),
+            })
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='small,medium', help=f"Comma-separated sizes from: {', '.join(SIZES)}")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per stage")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic profiles")
+    parser.add_argument('--skip-end-to-end', action='store_true', help="Skip the /perf/analyze benchmark")
+    parser.add_argument('--output', help="Where to write the JSON results; stdout if omitted")
+    parser.add_argument('--baseline', help="Earlier results to compare against")
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help="Slowdown in percent above which a stage counts as a regression")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix='perf-bench-')
+    try:
+        results = []
+        # The pipeline logs with print(); keep stdout for the JSON results.
+        with contextlib.redirect_stdout(sys.stderr):
+            for size in sizes:
+                results += bench_size(size, SIZES[size], args.repeat, workdir, args.seed, not args.skip_end_to_end)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'schema_version': SCHEMA_VERSION,
+        'revision': git_revision(),
+        'created_at': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+        for regression in report['regressions']:
+            print(f"Regression: {regression['size']} {regression['stage']} "
+                  f"{regression['baseline_seconds']:.4f}s -> {regression['seconds']:.4f}s "
+                  f"(+{regression['change_percent']}%)", file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return status
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+"""
+Deterministic generators of synthetic profiles for benchmarks.
+
+The same parameters and seed always produce byte-identical output, so
+results from different versions of the analyzer are comparable.
+"""
+import random
+
+# Shape of the sample distribution: stack i gets weight 1 / (i + 1) ** SKEW,
+# so a few stacks are hot and most are cold, as in real profiles.
+SKEW = 1.1
+
+PROCESS_NAMES = ('python3', 'worker', 'loader', 'trainer')
+
+
+class SyntheticProfile:
+    """
+    A synthetic call tree with a realistic shape: stacks share long common
+    prefixes, frame names repeat across stacks, and samples follow a
+    power law.
+    """
+
+    def __init__(self, samples=10000, stacks=1000, depth=32, frames=500, seed=0):
+        """
+        Args:
+            samples (int): Total samples.
+            stacks (int): Number of distinct stacks (an upper bound; random
+                collisions make a few of them identical).
+            depth (int): Maximum stack depth.
+            frames (int): Number of distinct frame names.
+            seed (int): Random seed.
+        """
+        self.samples = samples
+        self.depth = depth
+        self.frames = frames
+        self.seed = seed
+        rng = random.Random(seed)
+        names = [f"fn_{i:05d}_{rng.choice(('read', 'parse', 'alloc', 'lock', 'compute', 'copy'))}"
+                 for i in range(frames)]
+
+        # Grow stacks as branches off earlier stacks, so they share prefixes.
+        paths = []
+        for i in range(stacks):
+            if paths and rng.random() < 0.9:
+                parent = paths[rng.randrange(len(paths))]
+                keep = rng.randint(1, len(parent))
+                path = parent[:keep]
+            else:
+                path = [rng.choice(PROCESS_NAMES)]
+            target = rng.randint(max(2, depth // 4), depth)
+            while len(path) < target:
+                path.append(names[int(rng.paretovariate(1.2)) % frames])
+            paths.append(path)
+
+        weights = [1 / (i + 1) ** SKEW for i in range(len(paths))]
+        scale = samples / sum(weights)
+        counts = [max(1, int(w * scale)) for w in weights]
+        counts[0] += samples - sum(counts)  # Make the total exact.
+        self.stacks = {}
+        for path, count in zip(paths, counts):
+            if count > 0:
+                key = ';'.join(path)
+                self.stacks[key] = self.stacks.get(key, 0) + count
+
+    def folded_lines(self):
+        """Yields folded stack lines, sorted like stackcollapse output."""
+        for stack in sorted(self.stacks):
+            yield f"{stack} {self.stacks[stack]}\n"
+
+    def perf_script_lines(self):
+        """
+        Yields `perf script` output with one record per sample, leaf frame
+        first, that folds back into exactly `self.stacks`.
+        """
+        rng = random.Random(self.seed)
+        timestamp = 1000.0
+        pid = 4242
+        for stack in sorted(self.stacks):
+            frames = stack.split(';')
+            comm, calls = frames[0], frames[1:]
+            body = [
+                f"\t    {0x400000 + 0x40 * (hash_frame(name) % 65536):x} {name}+0x{rng.randrange(16, 256):x} "
+                f"(/usr/lib/lib{name[-4:]}.so)\n"
+                for name in reversed(calls)
+            ]
+            for _ in range(self.stacks[stack]):
+                timestamp += 0.0001
+                yield f"{comm} {pid} [{rng.randrange(8):03d}] {timestamp:.6f}:   10101010 cpu-clock:\n"
+                yield from body
+                yield "\n"
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            f.writelines(self.folded_lines())
+
+    def write_perf_script(self, path):
+        with open(path, 'w') as f:
+            f.writelines(self.perf_script_lines())
+
+
+def hash_frame(name):
+    """A stable (unlike hash()) small hash of a frame name, for fake addresses."""
+    h = 0
+    for ch in name:
+        h = (h * 31 + ord(ch)) & 0xffffffff
+    return h
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import perf_pipeline
+from benchmarks.synthetic import SyntheticProfile
+from modules.perf_analyzer.collapse import StackCollapser
+
+
+class SyntheticProfileTestCase(unittest.TestCase):
+    def test_same_seed_gives_identical_output(self):
+        a = SyntheticProfile(samples=500, stacks=50, depth=12, frames=40, seed=7)
+        b = SyntheticProfile(samples=500, stacks=50, depth=12, frames=40, seed=7)
+        c = SyntheticProfile(samples=500, stacks=50, depth=12, frames=40, seed=8)
+        self.assertEqual(list(a.folded_lines()), list(b.folded_lines()))
+        self.assertEqual(list(a.perf_script_lines()), list(b.perf_script_lines()))
+        self.assertNotEqual(a.stacks, c.stacks)
+
+    def test_shape(self):
+        synthetic = SyntheticProfile(samples=2000, stacks=200, depth=16, frames=60)
+        self.assertEqual(sum(synthetic.stacks.values()), 2000)
+        self.assertLessEqual(len(synthetic.stacks), 200)
+        self.assertTrue(all(len(stack.split(';')) <= 16 for stack in synthetic.stacks))
+
+    def test_perf_script_folds_back_into_the_stacks(self):
+        synthetic = SyntheticProfile(samples=300, stacks=40, depth=10, frames=30)
+        collapser = StackCollapser().feed_lines(synthetic.perf_script_lines())
+        self.assertEqual(collapser.stacks, synthetic.stacks)
+
+
+class PerfPipelineBenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_results_and_regressions(self):
+        output = os.path.join(self.tmpdir, 'results.json')
+        shape = dict(samples=200, stacks=20, depth=8, frames=20)
+        original_sizes = perf_pipeline.SIZES
+        perf_pipeline.SIZES = {'tiny': shape}
+        try:
+            # The end-to-end stage needs the top-level `app` module, which the
+            # feature tracer's tests shadow in a combined pytest session.
+            status = perf_pipeline.main(['--sizes', 'tiny', '--repeat', '1', '--skip-end-to-end',
+                                         '--output', output])
+        finally:
+            perf_pipeline.SIZES = original_sizes
+        self.assertEqual(status, 0)
+
+        with open(output) as f:
+            report = json.load(f)
+        stages = [result['stage'] for result in report['results']]
+        self.assertIn('collapse_perf_script', stages)
+        self.assertIn('render_flamegraph', stages)
+        self.assertIn('build_prompt', stages)
+        self.assertNotIn('perf_analyze', stages)
+        for result in report['results']:
+            self.assertGreater(result['seconds']['median'], 0)
+            self.assertGreater(result['peak_bytes'], 0)
+
+        # A run twice as slow as the baseline is reported.
+        slower = json.loads(json.dumps(report['results']))
+        for result in slower:
+            result['seconds']['median'] *= 2
+        regressions = perf_pipeline.compare(slower, report, tolerance=10)
+        self.assertEqual(len(regressions), len(slower))
+        self.assertEqual(perf_pipeline.compare(report['results'], report, tolerance=10), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,8 @@ class Settings:
     LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gpt-3.5-turbo")
     # Max tokens for the completion
     LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 1500))
+    # Context window of the model, used to budget the prompt size
+    LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", 8192))
      # Temperature for sampling
     LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", 0.2))
 
@@ -25,6 +27,119 @@ class Settings:
     # Delay in seconds for simulated LLM responses
     SIMULATE_LLM_DELAY = int(os.getenv("SIMULATE_LLM_DELAY", 2))
 
+    # --- LLM Request Concurrency ---
+    # Maximum concurrent requests when analyzing a batch of documents
+    LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", 4))
+    # Prompt plus completion tokens sent per minute by a batch; 0 disables the limit
+    LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+
+    # --- LLM Endpoint Pool ---
+    # Comma-separated base URLs of replicas serving the model, each optionally followed by
+    # ";weight=N;max_in_flight=N"; defaults to LLM_BASE_URL alone
+    LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+    # How a request picks its endpoint: "least_loaded" or "round_robin" (weighted)
+    LLM_ENDPOINT_STRATEGY = os.getenv("LLM_ENDPOINT_STRATEGY", "least_loaded")
+    # Concurrent requests per endpoint unless given in LLM_ENDPOINTS; 0 disables the limit
+    LLM_ENDPOINT_MAX_IN_FLIGHT = int(os.getenv("LLM_ENDPOINT_MAX_IN_FLIGHT", 8))
+    # Seconds before a request to an endpoint times out
+    LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 300))
+    # Retries of a failed request, and seconds before the first one, doubled for each further one
+    LLM_RETRIES = int(os.getenv("LLM_RETRIES", 2))
+    LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", 0.5))
+    # Consecutive failures that take an endpoint out of rotation, and seconds until it is tried again
+    LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 3))
+    LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+    # Seconds between health checks of every endpoint; 0 disables them
+    LLM_HEALTH_CHECK_INTERVAL = float(os.getenv("LLM_HEALTH_CHECK_INTERVAL", 15))
+    # Seconds before a health check times out
+    LLM_HEALTH_CHECK_TIMEOUT = float(os.getenv("LLM_HEALTH_CHECK_TIMEOUT", 5))
+
+    # --- LLM Response Cache ---
+    # If True, identical LLM requests are answered from the cache.
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "False").lower() in ('true', '1', 't')
+    # SQLite database shared by every worker process
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.getcwd(), "uploads", "llm_cache.sqlite3"))
+    # Seconds a cached response stays valid; 0 keeps responses forever
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+    # Responses kept on disk and in each process's memory before the least recently used are evicted
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+    LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", 256))
+
+    # --- Flame Graph Rendering ---
+    # Width of the rendered SVG in pixels
+    FLAMEGRAPH_WIDTH = int(os.getenv("FLAMEGRAPH_WIDTH", 1200))
+    # Frames narrower than this many pixels are merged or pruned
+    FLAMEGRAPH_MIN_WIDTH = float(os.getenv("FLAMEGRAPH_MIN_WIDTH", 0.1))
+    # Frames with fewer samples than this are merged or pruned
+    FLAMEGRAPH_MIN_SAMPLES = int(os.getenv("FLAMEGRAPH_MIN_SAMPLES", 0))
+    # Target upper bound for the SVG size; 0 disables the budget
+    FLAMEGRAPH_MAX_BYTES = int(os.getenv("FLAMEGRAPH_MAX_BYTES", 2 * 1024 * 1024))
+
+    # --- Call Tree API ---
+    # Number of memory-mapped tree indexes kept open for the tree and search endpoints
+    PERF_TREE_CACHE_SIZE = int(os.getenv("PERF_TREE_CACHE_SIZE", 16))
+    # Most children listed per node and most levels returned by one tree request
+    PERF_TREE_MAX_CHILDREN = int(os.getenv("PERF_TREE_MAX_CHILDREN", 200))
+    PERF_TREE_MAX_DEPTH = int(os.getenv("PERF_TREE_MAX_DEPTH", 8))
+
+    # --- Profile Summaries for the LLM ---
+    # Hard cap on the tokens of profile data per prompt; 0 uses the whole context budget
+    PERF_PROMPT_MAX_TOKENS = int(os.getenv("PERF_PROMPT_MAX_TOKENS", 4000))
+    # Stacks below this percentage of samples are folded into "other" buckets
+    PERF_SUMMARY_MIN_PERCENT = float(os.getenv("PERF_SUMMARY_MIN_PERCENT", 0.1))
+    # Number of hottest functions listed in the summary
+    PERF_SUMMARY_MAX_FUNCTIONS = int(os.getenv("PERF_SUMMARY_MAX_FUNCTIONS", 15))
+
+    # --- Local Bottleneck Detection ---
+    # Patterns and hot functions below this percentage of the total are not reported
+    PERF_DETECT_MIN_PERCENT = float(os.getenv("PERF_DETECT_MIN_PERCENT", 5.0))
+    # Maximum number of locally detected bottlenecks
+    PERF_DETECT_MAX_FINDINGS = int(os.getenv("PERF_DETECT_MAX_FINDINGS", 8))
+    # Seconds to wait for the AI analysis before showing the local one instead; 0 waits indefinitely
+    PERF_LLM_TIMEOUT = int(os.getenv("PERF_LLM_TIMEOUT", 120))
+
+    # --- Profile Comparison ---
+    # Changes smaller than this many percentage points of samples are not reported as regressions
+    PERF_DIFF_THRESHOLD = float(os.getenv("PERF_DIFF_THRESHOLD", 0.5))
+
+    # --- Analysis Job Queue ---
+    # Number of background workers reading uploaded captures; the other stages have their own limits
+    PERF_JOB_WORKERS = int(os.getenv("PERF_JOB_WORKERS", 4))
+    # Maximum number of queued or running jobs before new ones are rejected
+    PERF_JOB_MAX_PENDING = int(os.getenv("PERF_JOB_MAX_PENDING", 32))
+    # Number of finished jobs kept for the status/result endpoints
+    PERF_JOB_HISTORY = int(os.getenv("PERF_JOB_HISTORY", 100))
+    # Per-stage concurrency limits, each the size of that stage's worker pool
+    PERF_COLLECT_CONCURRENCY = int(os.getenv("PERF_COLLECT_CONCURRENCY", 1))
+    PERF_RENDER_CONCURRENCY = int(os.getenv("PERF_RENDER_CONCURRENCY", 2))
+    PERF_LLM_CONCURRENCY = int(os.getenv("PERF_LLM_CONCURRENCY", 2))
+
+    # --- Continuous Profiling ---
+    # Length in seconds of each back-to-back recording window
+    PERF_CONTINUOUS_WINDOW = int(os.getenv("PERF_CONTINUOUS_WINDOW", 10))
+    # Sampling frequency; kept low to bound the overhead on the target
+    PERF_CONTINUOUS_FREQ = int(os.getenv("PERF_CONTINUOUS_FREQ", 19))
+    # Disk used by each session's window profiles before the oldest are deleted; 0 disables
+    PERF_CONTINUOUS_MAX_BYTES = int(os.getenv("PERF_CONTINUOUS_MAX_BYTES", 256 * 1024 ** 2))
+    # Age in seconds after which windows are deleted; 0 disables
+    PERF_CONTINUOUS_MAX_AGE = int(os.getenv("PERF_CONTINUOUS_MAX_AGE", 24 * 3600))
+    # Sessions recording at once, each running its own perf record; 0 disables the limit
+    PERF_CONTINUOUS_MAX_SESSIONS = int(os.getenv("PERF_CONTINUOUS_MAX_SESSIONS", 4))
+
+    # --- Uploads ---
+    # Largest perf.data, perf script or folded file accepted for upload
+    PERF_UPLOAD_MAX_BYTES = int(os.getenv("PERF_UPLOAD_MAX_BYTES", 32 * 1024 ** 3))
+    # Chunk size suggested to upload clients
+    PERF_UPLOAD_CHUNK_BYTES = int(os.getenv("PERF_UPLOAD_CHUNK_BYTES", 64 * 1024 ** 2))
+    # Seconds without a new chunk after which an upload is deleted; 0 disables
+    PERF_UPLOAD_TTL = int(os.getenv("PERF_UPLOAD_TTL", 3600))
+
+    # --- Artifact Retention ---
+    # Total size of stored runs and artifacts before the oldest are evicted; 0 disables
+    PERF_STORE_MAX_BYTES = int(os.getenv("PERF_STORE_MAX_BYTES", 5 * 1024 ** 3))
+    # Age in seconds after which unused runs and artifacts are evicted; 0 disables
+    PERF_STORE_MAX_AGE = int(os.getenv("PERF_STORE_MAX_AGE", 7 * 24 * 3600))
+
 # Instantiate settings
 settings = Settings()
 
@@ -41,3 +156,6 @@ if settings.LLM_PROVIDER == "deepseek" and settings.DEEPSEEK_API_KEY.startswith(
 
 if settings.LLM_BASE_URL:
     print(f"Info: Using custom LLM base URL: {settings.LLM_BASE_URL}")
+
+if settings.LLM_ENDPOINTS:
+    print(f"Info: Spreading LLM requests over endpoints: {settings.LLM_ENDPOINTS}")
@@ -0,0 +1,99 @@
+import json
+
+
+class JSONArrayStreamParser:
+    """
+    Picks complete items out of one array of a JSON object while the object
+    is still being streamed, e.g. the bottlenecks of an LLM analysis as the
+    model writes them.
+
+    Text before the first '{' (such as a Markdown code fence) is ignored.
+    """
+
+    def __init__(self, key):
+        """
+        Args:
+            key (str): The top-level key of the array whose items to emit.
+        """
+        self.key = key
+        self._text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None
+        self._array_depth = None
+        self._item_start = None
+
+    @property
+    def text(self):
+        """Everything fed so far."""
+        return self._text
+
+    def feed(self, chunk):
+        """
+        Adds streamed text.
+
+        Returns:
+            list: The array items completed by this chunk, in order.
+        """
+        self._text += chunk
+        text = self._text
+        items = []
+        for pos in range(self._pos, len(text)):
+            c = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        try:
+                            self._last_key = json.loads(text[self._string_start:pos + 1])
+                        except ValueError:
+                            self._last_key = None
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif c in '{[':
+                self._depth += 1
+                if self._array_depth is not None and self._depth == self._array_depth + 1 and c == '{':
+                    self._item_start = pos
+                elif c == '[' and self._depth == 2 and self._last_key == self.key:
+                    self._array_depth = self._depth
+            elif c in '}]' and self._depth:
+                if self._array_depth is not None:
+                    if c == '}' and self._depth == self._array_depth + 1 and self._item_start is not None:
+                        try:
+                            items.append(json.loads(text[self._item_start:pos + 1]))
+                        except ValueError:
+                            pass
+                        self._item_start = None
+                    elif c == ']' and self._depth == self._array_depth:
+                        self._array_depth = None
+                self._depth -= 1
+                if self._depth == 1:
+                    self._last_key = None
+        self._pos = len(text)
+        return items
+
+    def result(self):
+        """
+        Parses everything fed so far as one JSON object.
+
+        Returns:
+            dict: The parsed object, or None if the text is not valid JSON.
+        """
+        start, end = self._text.find('{'), self._text.rfind('}')
+        if start < 0 or end < start:
+            return None
+        try:
+            result = json.loads(self._text[start:end + 1])
+        except ValueError:
+            return None
+        return result if isinstance(result, dict) else None
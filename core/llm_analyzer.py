@@ -1,82 +1,306 @@
 import time
+import threading
 import openai
 import json
+from concurrent.futures import ThreadPoolExecutor
 from .config import settings
+from .llm_cache import LLMCache
+from .llm_pool import Endpoint, EndpointPool, parse_endpoints
+from .metrics import Span
+from .rate_limiter import TokenRateLimiter
 from . import prompts
 
+# Rough size of a token, used to charge requests against the rate limit
+CHARS_PER_TOKEN = 4
+
+# Completion budgets of the patent analysis calls
+INFRINGEMENT_MAX_TOKENS = 1500
+
 # Global LLM client
 llm_client = None
+_llm_client_lock = threading.Lock()
 
-def get_llm_client():
+# Global pool of LLM endpoints, created on first use
+llm_pool = None
+_llm_pool_lock = threading.Lock()
+
+# Global LLM response cache, created on first use
+llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+# Base URL of Ollama's OpenAI-compatible API on the local machine
+OLLAMA_BASE_URL = "http://localhost:11434/v1"
+
+def _make_client(base_url):
     """
-    Initializes and returns a thread-safe LLM client based on the provider.
+    Creates a client of the configured provider for one base URL. Retries are
+    left to the endpoint pool, which can send them to another replica.
     """
-    global llm_client
-    if llm_client:
-        return llm_client
-
     provider = settings.LLM_PROVIDER
 
     if provider == "openai":
-        llm_client = openai.OpenAI(
+        return openai.OpenAI(
             api_key=settings.OPENAI_API_KEY,
-            base_url=settings.LLM_BASE_URL
+            base_url=base_url,
+            timeout=settings.LLM_REQUEST_TIMEOUT,
+            max_retries=0
         )
     elif provider == "deepseek":
         try:
             from deepseek import DeepSeek  # Assuming a library name
-            llm_client = DeepSeek(
+            return DeepSeek(
                 api_key=settings.DEEPSEEK_API_KEY,
-                base_url=settings.LLM_BASE_URL
+                base_url=base_url
             )
         except ImportError:
             raise ImportError("DeepSeek library not found. Please install it via `pip install deepseek`.")
     elif provider == "ollama":
         # For Ollama, the client doesn't need an API key by default
         # The base_url is typically http://localhost:11434
-        llm_client = openai.OpenAI(
-            base_url=settings.LLM_BASE_URL or "http://localhost:11434/v1",
-            api_key="ollama" # Required by the library, but not used by Ollama
+        return openai.OpenAI(
+            base_url=base_url or OLLAMA_BASE_URL,
+            api_key="ollama", # Required by the library, but not used by Ollama
+            timeout=settings.LLM_REQUEST_TIMEOUT,
+            max_retries=0
         )
     elif provider == "none":
-        llm_client = None
+        return None
     else:
         raise ValueError(f"Unsupported LLM provider: {provider}")
 
-    return llm_client
+
+def get_llm_client():
+    """
+    Initializes and returns a thread-safe LLM client for `LLM_BASE_URL`.
+    Requests go through `get_llm_pool` instead, which also covers
+    `LLM_ENDPOINTS`.
+    """
+    global llm_client
+    if llm_client:
+        return llm_client
+    with _llm_client_lock:
+        # Another thread may have created it while this one waited.
+        if llm_client is None:
+            llm_client = _make_client(settings.LLM_BASE_URL)
+        return llm_client
 
 
-def get_llm_response(prompt, system_prompt=None, model_name=None, max_tokens=None, temperature=None, json_mode=False):
+def get_llm_pool():
+    """
+    Returns the shared pool of LLM endpoints, built from `LLM_ENDPOINTS`, or
+    from `LLM_BASE_URL` alone if it is not set; None if the provider is
+    "none". With several endpoints, health checks start with the pool; a
+    single endpoint is never ejected, only paused by its circuit breaker.
+    """
+    global llm_pool
+    if settings.LLM_PROVIDER == "none":
+        return None
+    if llm_pool:
+        return llm_pool
+    with _llm_pool_lock:
+        if llm_pool is None:
+            specs = parse_endpoints(settings.LLM_ENDPOINTS) or [(settings.LLM_BASE_URL, {})]
+            endpoints = [Endpoint(url or "default", _make_client(url), **options) for url, options in specs]
+            llm_pool = EndpointPool(endpoints)
+            if len(endpoints) > 1:
+                print(f"LLM Analyzer: Spreading requests over {len(endpoints)} endpoints ({llm_pool.strategy}).")
+                llm_pool.start_health_checks()
+        return llm_pool
+
+
+def get_llm_cache():
+    """
+    Returns the shared LLM response cache, or None if caching is disabled.
+    """
+    global llm_cache
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    with _llm_cache_lock:
+        if llm_cache is None:
+            try:
+                llm_cache = LLMCache()
+            except Exception as e:
+                print(f"LLM cache unavailable, continuing without it: {e}")
+                return None
+        return llm_cache
+
+
+def is_llm_enabled():
+    """Returns True if LLM requests are answered, by a provider or the simulation."""
+    return settings.SIMULATE_LLM or settings.LLM_PROVIDER != "none"
+
+
+def is_llm_error(response):
+    """Returns True if `response` is an error string from get_llm_response."""
+    return isinstance(response, str) and response.startswith("[LLM_ERROR")
+
+
+def get_llm_response(prompt, system_prompt=None, model_name=None, max_tokens=None, temperature=None, json_mode=False,
+                     use_cache=True, stream=False):
     """
     Generic function to get a response from the configured LLM.
     Handles different providers and simulation mode.
+
+    When `LLM_CACHE_ENABLED` is set, successful responses are cached by
+    provider, model, prompts and sampling parameters; pass `use_cache=False`
+    to always query the model.
+
+    With `stream=True`, returns a generator of text chunks as the model
+    produces them instead; JSON mode responses are streamed as raw JSON text.
+    A failure is reported as a final "[LLM_ERROR: ...]" chunk.
     """
-    if settings.SIMULATE_LLM:
-        return _simulate_llm_call(prompt, json_mode)
+    if stream:
+        return _stream_llm_response(prompt, system_prompt, model_name, max_tokens, temperature, json_mode, use_cache)
+
+    request_params = _request_params(prompt, system_prompt, model_name, max_tokens, temperature)
+    with Span('llm', model=request_params["model"], bytes_in=_prompt_size(prompt, system_prompt)) as span:
+        if settings.SIMULATE_LLM:
+            response = _simulate_llm_call(prompt, json_mode)
+            span.set(simulated=True)
+        else:
+            cache, cache_key, cached = _cache_lookup(request_params, system_prompt, prompt, json_mode, use_cache)
+            if cached is not None:
+                span.set(cached=True, bytes_out=_response_size(cached))
+                return cached
 
-    client = get_llm_client()
-    if not client:
-        return "[LLM_ERROR: LLM provider is set to 'none' or not configured.]"
+            response = _call_llm(request_params, json_mode, span)
+            if cache and not is_llm_error(response):
+                cache.set(cache_key, response)
 
-    model = model_name or settings.LLM_MODEL_NAME
+        if is_llm_error(response):
+            span.fail(response)
+        else:
+            _record_usage(span, prompt, system_prompt, response)
+        return response
+
+
+def _prompt_size(prompt, system_prompt):
+    return len(prompt) + len(system_prompt or "")
+
+
+def _response_size(response):
+    return len(json.dumps(response, ensure_ascii=False) if isinstance(response, dict) else response)
+
+
+def _record_usage(span, prompt, system_prompt, response):
+    """Sets the response size and, unless the provider reported them, estimated token counts."""
+    size = _response_size(response)
+    span.set(bytes_out=size)
+    if 'prompt_tokens' not in span.attributes:
+        span.set(prompt_tokens=_prompt_size(prompt, system_prompt) // CHARS_PER_TOKEN,
+                 completion_tokens=size // CHARS_PER_TOKEN, estimated_tokens=True)
+
+
+def _request_params(prompt, system_prompt, model_name, max_tokens, temperature):
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": prompt})
 
-    request_params = {
-        "model": model,
+    return {
+        "model": model_name or settings.LLM_MODEL_NAME,
         "messages": messages,
         "max_tokens": max_tokens or settings.LLM_MAX_TOKENS,
         "temperature": temperature if temperature is not None else settings.LLM_TEMPERATURE,
     }
 
+
+def _cache_lookup(request_params, system_prompt, prompt, json_mode, use_cache):
+    """Returns (cache, key, cached response or None); cache is None if disabled."""
+    cache = get_llm_cache() if use_cache else None
+    if not cache:
+        return None, None, None
+    model = request_params["model"]
+    params = {"max_tokens": request_params["max_tokens"], "temperature": request_params["temperature"]}
+    cache_key = LLMCache.make_key(settings.LLM_PROVIDER, model, system_prompt, prompt, params, json_mode)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        print(f"LLM cache hit for model: {model} (JSON Mode: {json_mode})")
+    return cache, cache_key, cached
+
+
+def _stream_llm_response(prompt, system_prompt, model_name, max_tokens, temperature, json_mode, use_cache):
+    """Yields the response text in chunks; see get_llm_response(stream=True)."""
+    request_params = _request_params(prompt, system_prompt, model_name, max_tokens, temperature)
+    with Span('llm', model=request_params["model"], bytes_in=_prompt_size(prompt, system_prompt),
+              streamed=True) as span:
+        parts = []
+        for chunk in _stream_chunks(request_params, prompt, system_prompt, json_mode, use_cache, span):
+            if is_llm_error(chunk):
+                span.fail(chunk)
+            else:
+                parts.append(chunk)
+            yield chunk
+        if not span.error and not span.attributes.get('cached'):
+            _record_usage(span, prompt, system_prompt, "".join(parts))
+
+
+def _stream_chunks(request_params, prompt, system_prompt, json_mode, use_cache, span):
+    if settings.SIMULATE_LLM:
+        span.set(simulated=True)
+        yield from _simulate_llm_stream(prompt, json_mode)
+        return
+
+    cache, cache_key, cached = _cache_lookup(request_params, system_prompt, prompt, json_mode, use_cache)
+    if cached is not None:
+        span.set(cached=True, bytes_out=_response_size(cached))
+        yield json.dumps(cached, ensure_ascii=False) if json_mode else cached
+        return
+
+    pool = get_llm_pool()
+    if not pool:
+        yield "[LLM_ERROR: LLM provider is set to 'none' or not configured.]"
+        return
+
     if json_mode and settings.LLM_PROVIDER in ["openai", "ollama"]:
         request_params["response_format"] = {"type": "json_object"}
 
+    model = request_params["model"]
+    parts = []
+    try:
+        print(f"Attempting streaming LLM call to model: {model} (JSON Mode: {json_mode})")
+        response = pool.stream(lambda client: client.chat.completions.create(stream=True, **request_params), span)
+        for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    except Exception as e:
+        print(f"LLM API call failed: {e}")
+        yield f"[LLM_ERROR: {e}]"
+        return
+
+    if cache:
+        content = "".join(parts).strip()
+        if json_mode:
+            try:
+                cache.set(cache_key, json.loads(content))
+            except json.JSONDecodeError:
+                pass
+        elif content:
+            cache.set(cache_key, content)
+
+
+def _call_llm(request_params, json_mode, span=None):
+    """
+    Sends one chat completion request through the endpoint pool; returns the
+    content or an error string. The token usage the provider reports, and
+    the endpoint that answered, are recorded on `span`.
+    """
+    pool = get_llm_pool()
+    if not pool:
+        return "[LLM_ERROR: LLM provider is set to 'none' or not configured.]"
+
+    if json_mode and settings.LLM_PROVIDER in ["openai", "ollama"]:
+        request_params = dict(request_params, response_format={"type": "json_object"})
+
+    model = request_params["model"]
     try:
         print(f"Attempting LLM call to model: {model} (JSON Mode: {json_mode})")
-        response = client.chat.completions.create(**request_params)
+        response = pool.call(lambda client: client.chat.completions.create(**request_params), span)
+        usage = getattr(response, "usage", None)
+        if span is not None and usage is not None:
+            span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
         content = response.choices[0].message.content.strip()
 
         if json_mode:
@@ -95,12 +319,22 @@ def get_llm_response(prompt, system_prompt=None, model_name=None, max_tokens=Non
         return f"[LLM_ERROR: {e}]"
 
 
-def _simulate_llm_call(prompt, json_mode=False):
+def _simulate_llm_stream(prompt, json_mode=False, chunk_size=40):
+    """Streams a simulated response in small chunks spread over the simulated delay."""
+    response = _simulate_llm_call(prompt, json_mode, delay=0)
+    text = json.dumps(response, indent=2, ensure_ascii=False) if json_mode else response
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    for chunk in chunks:
+        time.sleep(settings.SIMULATE_LLM_DELAY / len(chunks))
+        yield chunk
+
+
+def _simulate_llm_call(prompt, json_mode=False, delay=None):
     """Handles the simulation logic for LLM calls."""
     print(f"\n--- SIMULATING LLM CALL (JSON Mode: {json_mode}) ---")
     print(f"Model: {settings.LLM_MODEL_NAME}")
     print(f"Prompt (first 200 chars):\n{prompt[:200]}...\n")
-    time.sleep(settings.SIMULATE_LLM_DELAY)
+    time.sleep(settings.SIMULATE_LLM_DELAY if delay is None else delay)
 
     # Performance analysis simulation
     if "identify performance bottlenecks" in prompt:
@@ -135,6 +369,21 @@ def _simulate_llm_call(prompt, json_mode=False):
 *   **Suggestion:** Use a faster JSON library like `orjson`. If possible, stream the output instead of buffering it all in memory.
 """
 
+    # Profile comparison simulation
+    if "identify performance regressions" in prompt and json_mode:
+        return {
+            "identified_bottlenecks": [
+                {
+                    "function_stack": "main;read_file;process_data",
+                    "percentage": 45.5,
+                    "delta": 12.3,
+                    "analysis": "`process_data` takes a much larger share of the samples than in the baseline, which suggests a change to its algorithm or input size.",
+                    "optimization_suggestion": "Review the changes to `process_data` since the baseline and benchmark it in isolation with the same input."
+                }
+            ],
+            "overall_summary": "The candidate regressed mainly in data processing. Investigate `process_data` before releasing it."
+        }
+
     # Fallback for other prompts
     return "This is a simulated LLM response."
 
@@ -143,7 +392,7 @@ def analyze_patent_text(patent_full_text):
     """
     Uses LLM to extract summary, key claims, and features from patent text.
     """
-    prompt = prompt_templates.PATENT_SUMMARY_PROMPT.format(patent_text=patent_full_text)
+    prompt = prompts.PATENT_SUMMARY_PROMPT.format(patent_text=patent_full_text)
 
     print(f"LLM Analyzer: Requesting patent summary and feature extraction for patent (text length: {len(patent_full_text)}).")
     # In a real scenario, you might need to chunk the text if it's too long for the LLM context window.
@@ -188,12 +437,8 @@ def analyze_patent_text(patent_full_text):
     return parsed_data # Return dict with parsed fields or just raw_response
 
 
-def analyze_infringement_per_evidence(patent_info, evidence_text, evidence_filename):
-    """
-    Uses LLM to analyze one piece of evidence against the patent.
-    patent_info should be a dictionary from analyze_patent_text().
-    """
-    prompt = prompt_templates.INFRINGEMENT_ANALYSIS_PROMPT.format(
+def _infringement_prompt(patent_info, evidence_text):
+    return prompts.INFRINGEMENT_ANALYSIS_PROMPT.format(
         patent_name=patent_info.get("patent_name", "N/A"),
         technical_field=patent_info.get("technical_field", "N/A"),
         core_claims=patent_info.get("core_claims", "N/A"),
@@ -201,8 +446,16 @@ def analyze_infringement_per_evidence(patent_info, evidence_text, evidence_filen
         target_product_description=evidence_text
     )
 
+
+def analyze_infringement_per_evidence(patent_info, evidence_text, evidence_filename):
+    """
+    Uses LLM to analyze one piece of evidence against the patent.
+    patent_info should be a dictionary from analyze_patent_text().
+    """
+    prompt = _infringement_prompt(patent_info, evidence_text)
+
     print(f"LLM Analyzer: Requesting infringement analysis for evidence '{evidence_filename}' (text length: {len(evidence_text)}).")
-    response_text = get_llm_response(prompt, max_tokens=1500, temperature=0.3) # Slightly higher temp for analysis
+    response_text = get_llm_response(prompt, max_tokens=INFRINGEMENT_MAX_TOKENS, temperature=0.3) # Slightly higher temp for analysis
 
     # TODO: Parse the structured response (e.g., score, risk level, reasons)
     # For now, return the raw text.
@@ -224,6 +477,62 @@ def analyze_infringement_per_evidence(patent_info, evidence_text, evidence_filen
     return parsed_analysis
 
 
+def analyze_infringement_batch(patent_info, evidence_items, max_in_flight=None, tokens_per_minute=None):
+    """
+    Analyzes many pieces of evidence against the patent concurrently.
+
+    At most `max_in_flight` requests run at once, and each request is charged
+    its prompt plus completion budget against a shared tokens-per-minute
+    limit before it is sent, so a large case stays within the provider's
+    rate limits instead of failing part-way.
+
+    Args:
+        patent_info (dict): The result of analyze_patent_text().
+        evidence_items (list): (evidence_text, evidence_filename) pairs.
+        max_in_flight (int): Concurrent requests. Defaults to `LLM_MAX_IN_FLIGHT`.
+        tokens_per_minute (int): Token budget; 0 disables the limit.
+            Defaults to `LLM_TOKENS_PER_MINUTE`.
+
+    Returns:
+        list: One analysis dict per evidence item, in input order.
+    """
+    evidence_items = list(evidence_items)
+    if not evidence_items:
+        return []
+    max_in_flight = max_in_flight or settings.LLM_MAX_IN_FLIGHT
+    if tokens_per_minute is None:
+        tokens_per_minute = settings.LLM_TOKENS_PER_MINUTE
+    limiter = TokenRateLimiter(tokens_per_minute)
+
+    def analyze(item):
+        evidence_text, evidence_filename = item
+        prompt = _infringement_prompt(patent_info, evidence_text)
+        limiter.acquire(len(prompt) // CHARS_PER_TOKEN + INFRINGEMENT_MAX_TOKENS)
+        try:
+            return analyze_infringement_per_evidence(patent_info, evidence_text, evidence_filename)
+        except Exception as e:
+            print(f"LLM Analyzer: Infringement analysis failed for {evidence_filename}: {e}")
+            return {"raw_response": f"[LLM_ERROR: {e}]", "evidence_filename": evidence_filename}
+
+    print(f"LLM Analyzer: Analyzing {len(evidence_items)} evidence files, {max_in_flight} at a time.")
+    workers = min(max_in_flight, len(evidence_items))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-evidence') as executor:
+        # map() yields results in input order, whatever order they finish in.
+        return list(executor.map(analyze, evidence_items))
+
+
+def analyze_infringement_case(patent_info, evidence_items, max_in_flight=None, tokens_per_minute=None):
+    """
+    Analyzes every piece of evidence concurrently, then generates the final
+    report as soon as the last analysis is in.
+
+    Returns:
+        tuple: (list of per-evidence analyses, final report text)
+    """
+    analyses = analyze_infringement_batch(patent_info, evidence_items, max_in_flight, tokens_per_minute)
+    return analyses, generate_final_report_summary(patent_info, analyses)
+
+
 def generate_final_report_summary(patent_info, all_evidence_analyses):
     """
     Uses LLM to generate a final summary report based on all analyses.
@@ -243,7 +552,7 @@ def generate_final_report_summary(patent_info, all_evidence_analyses):
         summary_item += f"简要分析：{brief_analysis_placeholder}...\n---\n"
         individual_summaries_text.append(summary_item)
 
-    prompt = prompt_templates.FINAL_REPORT_GENERATION_PROMPT.format(
+    prompt = prompts.FINAL_REPORT_GENERATION_PROMPT.format(
         patent_name=patent_info.get("patent_name", "N/A"),
         technical_field=patent_info.get("technical_field", "N/A"),
         core_claims=patent_info.get("core_claims", "N/A"),
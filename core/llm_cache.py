@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .config import settings
+
+# Expired and surplus disk entries are pruned once every this many writes.
+PRUNE_INTERVAL = 64
+
+# Memory hits refresh the entry's recency on disk at most this often (seconds).
+TOUCH_INTERVAL = 60
+
+
+class LLMCache:
+    """
+    A two-tier cache for LLM responses.
+
+    The memory tier is a small per-process LRU. The disk tier is a SQLite
+    database in WAL mode, so several worker processes (e.g. gunicorn workers)
+    can share it and benefit from each other's results. Entries expire after
+    `ttl` seconds, and the least recently used entries are evicted once a
+    tier holds more than its maximum number of entries.
+
+    Values must be JSON-serializable; every `get` returns a fresh copy, so
+    callers may mutate what they receive.
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=None, memory_entries=None):
+        self.path = path or settings.LLM_CACHE_PATH
+        self.ttl = settings.LLM_CACHE_TTL if ttl is None else ttl
+        self.max_entries = settings.LLM_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.memory_entries = settings.LLM_CACHE_MEMORY_ENTRIES if memory_entries is None else memory_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    @staticmethod
+    def make_key(provider, model, system_prompt, prompt, params, json_mode):
+        """Returns the cache key for one LLM request."""
+        payload = json.dumps(
+            [provider, model, system_prompt, prompt, params, bool(json_mode)],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _expired(self, created_at, now):
+        return self.ttl and now - created_at > self.ttl
+
+    def get(self, key):
+        """
+        Returns the cached value for `key`, or None on a miss.
+        """
+        now = time.time()
+        value = touch = None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                serialized, created_at, touched_at = entry
+                if self._expired(created_at, now):
+                    del self._memory[key]
+                else:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    touch = now - touched_at > TOUCH_INTERVAL
+                    if touch:
+                        self._memory[key] = (serialized, created_at, now)
+                    value = json.loads(serialized)
+        if value is not None:
+            if touch:
+                self._touch(key, now)
+            return value
+
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and not self._expired(row[1], now):
+                self._touch(key, now)
+                self._remember(key, row[0], row[1], now)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"LLM cache read failed: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """Stores a JSON-serializable value under `key`."""
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        self._remember(key, serialized, now, now)
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, serialized, now, now)
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % PRUNE_INTERVAL == 0
+            if prune:
+                self.prune()
+        except sqlite3.Error as e:
+            print(f"LLM cache write failed: {e}")
+
+    def _touch(self, key, now):
+        try:
+            self._connection().execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"LLM cache update failed: {e}")
+
+    def _remember(self, key, serialized, created_at, touched_at):
+        with self._lock:
+            self._memory[key] = (serialized, created_at, touched_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def prune(self):
+        """Deletes expired disk entries, then the least recently used surplus."""
+        conn = self._connection()
+        if self.ttl:
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        if self.max_entries:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self._connection().execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'memory_entries': len(self._memory),
+            }
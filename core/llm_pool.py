@@ -0,0 +1,433 @@
+import itertools
+import random
+import threading
+import time
+
+import openai
+
+from .config import settings
+
+# Endpoint selection strategies
+LEAST_LOADED = "least_loaded"
+ROUND_ROBIN = "round_robin"
+STRATEGIES = (LEAST_LOADED, ROUND_ROBIN)
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# HTTP statuses worth retrying on another endpoint: timeouts, rate limits
+# and server errors. Anything else, e.g. a bad request, fails everywhere.
+RETRYABLE_STATUSES = (408, 409, 429)
+
+# Upper bound of the retry backoff, in seconds
+MAX_BACKOFF = 30.0
+# Longest a circuit breaker stays open, as a multiple of its cooldown
+MAX_COOLDOWN_FACTOR = 8
+# How long `acquire` sleeps at most between checks while every endpoint is busy
+ACQUIRE_POLL_INTERVAL = 1.0
+
+
+class NoEndpointAvailable(Exception):
+    """Raised when every endpoint is ejected by a health check or its circuit breaker."""
+
+
+def is_retryable(error):
+    """Returns True if a request that failed with `error` may succeed on a retry."""
+    if isinstance(error, (NoEndpointAvailable, openai.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in RETRYABLE_STATUSES or status >= 500)
+
+
+def parse_endpoints(spec):
+    """
+    Parses the `LLM_ENDPOINTS` setting.
+
+    Args:
+        spec (str): Comma-separated base URLs, each optionally followed by
+            options, e.g. "http://gpu1:8000/v1;weight=2;max_in_flight=16,
+            http://gpu2:8000/v1".
+
+    Returns:
+        list: (url, options) pairs, where options has `weight` and/or
+            `max_in_flight` as ints.
+
+    Raises:
+        ValueError: If an option is unknown or not an integer.
+    """
+    endpoints = []
+    for entry in spec.split(","):
+        parts = [part.strip() for part in entry.split(";")]
+        if not parts[0]:
+            continue
+        options = {}
+        for option in parts[1:]:
+            key, _, value = option.partition("=")
+            if key not in ("weight", "max_in_flight") or not value.isdigit():
+                raise ValueError(f"Invalid option '{option}' for LLM endpoint {parts[0]}")
+            options[key] = int(value)
+        endpoints.append((parts[0], options))
+    return endpoints
+
+
+class Endpoint:
+    """
+    One replica serving an OpenAI-compatible API, with its own client, and so
+    its own pool of keep-alive connections, and its own circuit breaker.
+
+    The breaker opens after `failure_threshold` consecutive failed requests
+    and keeps the endpoint out of rotation for `cooldown` seconds. Then a
+    single trial request is let through: success closes the breaker, failure
+    opens it again for twice as long, up to `MAX_COOLDOWN_FACTOR` times the
+    cooldown.
+
+    Independently, a failed health check ejects the endpoint until a later
+    check succeeds.
+    """
+
+    def __init__(self, url, client, weight=1, max_in_flight=None, failure_threshold=None, cooldown=None):
+        """
+        Args:
+            url (str): The base URL, used to identify the endpoint.
+            client: An OpenAI-compatible client for the endpoint.
+            weight (int): Relative share of the requests.
+            max_in_flight (int): Concurrent requests at most; 0 for no limit.
+                Defaults to `LLM_ENDPOINT_MAX_IN_FLIGHT`.
+            failure_threshold (int): Consecutive failures that open the
+                breaker. Defaults to `LLM_BREAKER_FAILURES`.
+            cooldown (float): Seconds the breaker stays open at first.
+                Defaults to `LLM_BREAKER_COOLDOWN`.
+        """
+        self.url = url
+        self.client = client
+        self.weight = max(1, weight)
+        self.max_in_flight = settings.LLM_ENDPOINT_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.failure_threshold = settings.LLM_BREAKER_FAILURES if failure_threshold is None else failure_threshold
+        self.cooldown = settings.LLM_BREAKER_COOLDOWN if cooldown is None else cooldown
+
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.breaker = CLOSED
+        self._opened_for = 0.0
+        self._open_until = 0.0
+        self._current_weight = 0
+        self._last_used = -1
+
+    # The methods below are called with the pool's lock held.
+
+    def breaker_state(self, now):
+        if self.breaker == OPEN and now >= self._open_until:
+            return HALF_OPEN
+        return self.breaker
+
+    def available(self, now):
+        """True if the endpoint may take a request now."""
+        if not self.healthy:
+            return False
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return False
+        state = self.breaker_state(now)
+        # A half-open breaker lets a single trial request through.
+        return state == CLOSED or (state == HALF_OPEN and self.in_flight == 0)
+
+    def usable(self, now):
+        """True if the endpoint could take requests once it is less busy."""
+        return self.healthy and (self.breaker == CLOSED or self.breaker_state(now) == HALF_OPEN)
+
+    def record_success(self):
+        self.failures = 0
+        self.breaker = CLOSED
+        self._opened_for = 0.0
+
+    def record_failure(self, now):
+        self.failures += 1
+        if self.breaker_state(now) == HALF_OPEN:
+            self._open(now, min(self._opened_for * 2, self.cooldown * MAX_COOLDOWN_FACTOR))
+        elif self.breaker == CLOSED and self.failures >= self.failure_threshold:
+            self._open(now, self.cooldown)
+
+    def _open(self, now, duration):
+        print(f"LLM pool: circuit breaker opened for {self.url} for {duration:.0f}s "
+              f"after {self.failures} consecutive failures")
+        self.breaker = OPEN
+        self._opened_for = duration
+        self._open_until = now + duration
+
+    def status(self, now):
+        """A summary of the endpoint's state, e.g. for diagnostics."""
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "healthy": self.healthy,
+            "breaker": self.breaker_state(now),
+        }
+
+
+class EndpointPool:
+    """
+    Spreads LLM requests over several replicas of an OpenAI-compatible API,
+    e.g. Ollama or vLLM servers.
+
+    Each request goes to an endpoint that is healthy, has a closed circuit
+    breaker and is below its concurrency limit: the least loaded one relative
+    to its weight, or the next one in weighted round-robin order. If every
+    such endpoint is busy, the request waits for a slot. Failed requests
+    that may succeed elsewhere are retried with exponential backoff, on
+    another endpoint if there is one.
+    """
+
+    def __init__(self, endpoints, strategy=None, retries=None, backoff=None, health_check=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            endpoints (list): The `Endpoint`s.
+            strategy (str): "least_loaded" or "round_robin". Defaults to
+                `LLM_ENDPOINT_STRATEGY`.
+            retries (int): Retries after a failed attempt. Defaults to
+                `LLM_RETRIES`.
+            backoff (float): Seconds before the first retry, doubled for
+                each further one. Defaults to `LLM_RETRY_BACKOFF`.
+            health_check (callable): Called with an endpoint; returns True
+                if it is healthy. Defaults to listing the endpoint's models.
+            clock (callable): Returns the current time in seconds.
+            sleep (callable): Waits for the given number of seconds.
+        """
+        if not endpoints:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy or settings.LLM_ENDPOINT_STRATEGY
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Unknown endpoint strategy '{self.strategy}'; use one of {', '.join(STRATEGIES)}")
+        self.retries = settings.LLM_RETRIES if retries is None else retries
+        self.backoff = settings.LLM_RETRY_BACKOFF if backoff is None else backoff
+        self.health_check = health_check or self._list_models
+        self._clock = clock
+        self._sleep = sleep
+        self._condition = threading.Condition()
+        self._order = itertools.count()
+        self._stop = threading.Event()
+        self._health_thread = None
+
+    # --- Endpoint selection ---
+
+    def acquire(self, avoid=(), timeout=None):
+        """
+        Reserves a slot on an endpoint, waiting while all of them are busy.
+
+        Args:
+            avoid (collection): Endpoints to pass over unless no other one
+                is available, e.g. the ones a request already failed on.
+            timeout (float): Seconds to wait for a slot; None waits as long
+                as some endpoint is usable.
+
+        Returns:
+            Endpoint: The endpoint; hand it back with `release`.
+
+        Raises:
+            NoEndpointAvailable: If every endpoint is ejected, or no slot
+                freed up within `timeout`.
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._condition:
+            while True:
+                now = self._clock()
+                candidates = [e for e in self.endpoints if e.available(now)]
+                preferred = [e for e in candidates if e not in avoid] or candidates
+                if preferred:
+                    endpoint = self._select(preferred)
+                    endpoint.in_flight += 1
+                    endpoint.requests += 1
+                    return endpoint
+                if not any(e.usable(now) for e in self.endpoints):
+                    raise NoEndpointAvailable("No healthy LLM endpoint available")
+                wait = ACQUIRE_POLL_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                    if wait <= 0:
+                        raise NoEndpointAvailable("Timed out waiting for a free LLM endpoint")
+                # Breakers may close without a release, so look again after a while.
+                self._condition.wait(wait)
+
+    def _select(self, candidates):
+        if self.strategy == LEAST_LOADED:
+            # Ties go to the endpoint that was used least recently.
+            return min(candidates, key=lambda e: (e.in_flight / e.weight, e._last_used))
+        # Smooth weighted round-robin, as in nginx: every candidate gains its
+        # weight, the one with the most is picked and pays the total back.
+        total = 0
+        best = None
+        for endpoint in candidates:
+            endpoint._current_weight += endpoint.weight
+            total += endpoint.weight
+            if best is None or endpoint._current_weight > best._current_weight:
+                best = endpoint
+        best._current_weight -= total
+        return best
+
+    def release(self, endpoint, error=None):
+        """
+        Frees an endpoint's slot and records the outcome on its breaker.
+        Errors that are not the endpoint's fault, like bad requests, do not
+        count as failures.
+        """
+        with self._condition:
+            endpoint.in_flight -= 1
+            endpoint._last_used = next(self._order)
+            if error is None:
+                endpoint.record_success()
+            elif is_retryable(error):
+                endpoint.record_failure(self._clock())
+            else:
+                endpoint.record_success()
+            self._condition.notify_all()
+
+    def _backoff(self, attempt):
+        """Sleeps before retry `attempt` (1-based), with jitter so retries do not arrive in lockstep."""
+        delay = min(MAX_BACKOFF, self.backoff * 2 ** (attempt - 1))
+        self._sleep(delay * random.uniform(0.5, 1.0))
+
+    # --- Requests ---
+
+    def call(self, request, span=None):
+        """
+        Sends a request, retrying it on failure.
+
+        Args:
+            request (callable): Called with an endpoint's client; sends the
+                request and returns the response.
+            span (Span): Gets the `endpoint` that answered and the number of
+                `attempts`.
+
+        Returns:
+            The response of the first successful attempt.
+
+        Raises:
+            Exception: The error of the last attempt, once retries are used
+                up or the error is not retryable.
+        """
+        tried = set()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._backoff(attempt)
+            try:
+                endpoint = self.acquire(avoid=tried)
+            except NoEndpointAvailable:
+                if attempt == self.retries:
+                    raise
+                continue
+            tried.add(endpoint)
+            if span is not None:
+                span.set(endpoint=endpoint.url, attempts=attempt + 1)
+            try:
+                response = request(endpoint.client)
+            except Exception as e:
+                self.release(endpoint, e)
+                print(f"LLM pool: request to {endpoint.url} failed (attempt {attempt + 1}): {e}")
+                if not is_retryable(e) or attempt == self.retries:
+                    raise
+                continue
+            self.release(endpoint)
+            return response
+
+    def stream(self, request, span=None):
+        """
+        Like `call`, for streamed responses: yields the items of the first
+        stream that starts. A stream that fails part-way is not retried,
+        since its first items are already out.
+        """
+        tried = set()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._backoff(attempt)
+            try:
+                endpoint = self.acquire(avoid=tried)
+            except NoEndpointAvailable:
+                if attempt == self.retries:
+                    raise
+                continue
+            tried.add(endpoint)
+            if span is not None:
+                span.set(endpoint=endpoint.url, attempts=attempt + 1)
+            started = False
+            error = None
+            try:
+                for item in request(endpoint.client):
+                    started = True
+                    yield item
+            except Exception as e:
+                error = e
+                print(f"LLM pool: stream from {endpoint.url} failed (attempt {attempt + 1}): {e}")
+                if started or not is_retryable(e) or attempt == self.retries:
+                    raise
+                continue
+            finally:
+                self.release(endpoint, error)
+            return
+
+    # --- Health checks ---
+
+    @staticmethod
+    def _list_models(endpoint):
+        endpoint.client.with_options(timeout=settings.LLM_HEALTH_CHECK_TIMEOUT).models.list()
+        return True
+
+    def check_health(self):
+        """
+        Checks every endpoint once, ejecting the ones that fail and taking
+        back the ones that pass.
+
+        Returns:
+            int: The number of healthy endpoints.
+        """
+        for endpoint in self.endpoints:
+            try:
+                healthy = bool(self.health_check(endpoint))
+            except Exception as e:
+                print(f"LLM pool: health check of {endpoint.url} failed: {e}")
+                healthy = False
+            with self._condition:
+                if healthy != endpoint.healthy:
+                    print(f"LLM pool: {endpoint.url} is {'back' if healthy else 'ejected'}")
+                endpoint.healthy = healthy
+                self._condition.notify_all()
+        return sum(1 for endpoint in self.endpoints if endpoint.healthy)
+
+    def start_health_checks(self, interval=None):
+        """
+        Checks the endpoints' health every `interval` seconds in a daemon
+        thread. Defaults to `LLM_HEALTH_CHECK_INTERVAL`; 0 disables checks.
+        """
+        interval = settings.LLM_HEALTH_CHECK_INTERVAL if interval is None else interval
+        if not interval or self._health_thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=run, name='llm-health', daemon=True)
+        self._health_thread.start()
+
+    def status(self):
+        """Returns the state of every endpoint."""
+        with self._condition:
+            now = self._clock()
+            return [endpoint.status(now) for endpoint in self.endpoints]
+
+    def close(self):
+        """Stops the health checks and closes the endpoints' connections."""
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+        for endpoint in self.endpoints:
+            close = getattr(endpoint.client, "close", None)
+            if close:
+                close()
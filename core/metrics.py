@@ -0,0 +1,265 @@
+import math
+import threading
+import time
+
+# Histogram buckets, in seconds and in bytes (1 KiB to 4 GiB in steps of 4x)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(12))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count, one per combination of label values."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Yields (metric name, labels, value) for the exposition format."""
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, key, value
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, like a Prometheus histogram."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[-1] if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in values:
+            for bound, count in zip(self.buckets + (math.inf,), state[:-2] + [state[-1]]):
+                yield f"{self.name}_bucket", key + (('le', _format_value(bound)),), count
+            yield f"{self.name}_sum", key, state[-2]
+            yield f"{self.name}_count", key, state[-1]
+
+
+class MetricsRegistry:
+    """
+    The metrics of this process, rendered in the Prometheus text format.
+
+    Each worker process keeps its own registry; run a single process, or
+    scrape every worker, to see all of them.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    'dfx_stage_duration_seconds', 'Time spent in each pipeline stage.', ('stage',)
+)
+STAGE_RUNS = registry.counter(
+    'dfx_stage_runs_total', 'Pipeline stage executions, by outcome.', ('stage', 'outcome')
+)
+STAGE_BYTES = registry.histogram(
+    'dfx_stage_bytes', 'Size of the data read (in) or written (out) by each pipeline stage.',
+    ('stage', 'direction'), buckets=BYTES_BUCKETS
+)
+STAGE_SAMPLES = registry.counter(
+    'dfx_stage_samples_total', 'Profile samples processed by each pipeline stage.', ('stage',)
+)
+LLM_TOKENS = registry.counter(
+    'dfx_llm_tokens_total', 'LLM tokens sent (prompt) and received (completion).', ('model', 'kind')
+)
+
+# Thread-local state: the timeline that spans on this thread are added to
+_local = threading.local()
+
+
+class Timeline:
+    """
+    The spans recorded while it is active on a thread: the timing breakdown
+    of one run, shown with its report.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def activate(self):
+        """Returns a context manager that records this thread's spans here."""
+        return _ActiveTimeline(self)
+
+    def add(self, span_dict):
+        with self._lock:
+            self.spans.append(span_dict)
+
+    def to_list(self):
+        with self._lock:
+            return [dict(span) for span in self.spans]
+
+
+def current_timeline():
+    """Returns the timeline active on this thread, to hand to helper threads, or None."""
+    return getattr(_local, 'timeline', None)
+
+
+class _ActiveTimeline:
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = current_timeline()
+        _local.timeline = self.timeline
+        return self.timeline
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.timeline = self.previous
+        return False
+
+
+class Span:
+    """
+    Times one pipeline stage and records it in the metrics and in the
+    thread's active timeline, if any.
+
+        with Span('render') as span:
+            svg = renderer.render(profile)
+            span.set(samples=profile.total, bytes_out=len(svg))
+
+    Known attributes are exported as metrics: `bytes_in`, `bytes_out`,
+    `samples`, and `prompt_tokens`/`completion_tokens` with a `model`.
+    Stages that report failures by return value call `fail()`; exceptions
+    raised inside the block are recorded as errors too.
+    """
+
+    def __init__(self, stage, **attributes):
+        self.stage = stage
+        self.attributes = attributes
+        self.error = None
+        self.started_at = None
+        self.duration = None
+        self._start = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        self.error = str(error)
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        # A generator closed early by its consumer has not failed.
+        if exc_type is not None and exc_type is not GeneratorExit and self.error is None:
+            self.error = str(exc) or exc_type.__name__
+        self._record()
+        return False
+
+    def _record(self):
+        STAGE_DURATION.observe(self.duration, stage=self.stage)
+        STAGE_RUNS.inc(stage=self.stage, outcome='error' if self.error else 'ok')
+        for direction in ('in', 'out'):
+            size = self.attributes.get(f'bytes_{direction}')
+            if size is not None:
+                STAGE_BYTES.observe(size, stage=self.stage, direction=direction)
+        if self.attributes.get('samples'):
+            STAGE_SAMPLES.inc(self.attributes['samples'], stage=self.stage)
+        for kind in ('prompt', 'completion'):
+            tokens = self.attributes.get(f'{kind}_tokens')
+            if tokens:
+                LLM_TOKENS.inc(tokens, model=self.attributes.get('model', ''), kind=kind)
+
+        timeline = current_timeline()
+        if timeline is not None:
+            timeline.add(self.to_dict())
+
+    def to_dict(self):
+        return dict(self.attributes, stage=self.stage, started_at=self.started_at,
+                    duration=self.duration, error=self.error)
@@ -1,21 +1,34 @@
 # prompts.py
 
+# System prompt for the performance analysis
+PERF_ANALYSIS_SYSTEM_PROMPT = "You are an expert performance engineer. Your task is to analyze the provided `perf` profile summary and identify performance bottlenecks. Return your analysis in the specified JSON format."
+
 # Prompt for analyzing performance data and identifying bottlenecks in JSON format
 PERF_ANALYSIS_JSON_PROMPT = """
-Analyze the following performance data, which is in the `perf` folded stack format.
-Each line represents a call stack, and the number at the end is the number of samples for that stack.
+Analyze the following performance profile and identify performance bottlenecks.
+The profile was summarized from `perf` folded stacks. Stacks are root-first and semicolon-separated, listed hottest first,
+with their exact percentage of the total and their weight. Cold stacks are aggregated into "[other]" buckets.
+
+**Profile Type:** {profile_type}
 
-**Folded Stack Data:**
+**Profile Summary:**
 ```
 {data}
 ```
 
+**Pre-computed Findings:**
+These were computed exactly from the full profile. Use their percentages as given; confirm, explain or refine them
+rather than recomputing them.
+```
+{findings}
+```
+
 **Your Task:**
 Return a JSON object with two keys: "identified_bottlenecks" and "overall_summary".
 
 1.  **"identified_bottlenecks"**: A list of JSON objects, where each object represents a significant performance bottleneck. Each object must have the following keys:
-    -   `function_stack` (string): The full semicolon-separated call stack of the bottleneck.
-    -   `percentage` (float): The estimated percentage of total CPU time this stack represents. You can calculate this by `(samples_for_stack / total_samples) * 100`.
+    -   `function_stack` (string): The semicolon-separated call stack of the bottleneck, exactly as listed in the summary.
+    -   `percentage` (float): The percentage of the total this stack represents. Use the exact percentage given in the summary; do not estimate it.
     -   `analysis` (string): A concise, expert analysis of why this function is a bottleneck (e.g., "High sample count suggests expensive computation or I/O wait," "This function is called frequently," "Deep recursion observed").
     -   `optimization_suggestion` (string): A concrete, actionable optimization strategy (e.g., "Consider caching the result," "Rewrite the loop to be more efficient," "Use a faster library for this operation").
 
@@ -45,6 +58,35 @@ Return a JSON object with two keys: "identified_bottlenecks" and "overall_summar
 Ensure your output is a single, valid JSON object and nothing else.
 """
 
+# System prompt for comparing two performance profiles
+PERF_DIFF_SYSTEM_PROMPT = "You are an expert performance engineer. Your task is to explain the changes between two `perf` profiles and identify performance regressions. Return your analysis in the specified JSON format."
+
+# Prompt for explaining the regressions between a baseline and a candidate profile in JSON format
+PERF_DIFF_JSON_PROMPT = """
+Compare a baseline and a candidate performance profile and identify performance regressions.
+Only the changes are listed below. Percentages are shares of all samples in each profile, so the two profiles are
+comparable even if their lengths differ; changes are in percentage points. Stacks are root-first and semicolon-separated.
+
+**Profile Changes:**
+```
+{data}
+```
+
+**Your Task:**
+Return a JSON object with two keys: "identified_bottlenecks" and "overall_summary".
+
+1.  **"identified_bottlenecks"**: A list of JSON objects, one per significant regression, largest first. Each object must have the following keys:
+    -   `function_stack` (string): The regressed function or stack, exactly as listed above.
+    -   `percentage` (float): Its share of samples in the candidate profile, exactly as listed.
+    -   `delta` (float): The change in percentage points, exactly as listed.
+    -   `analysis` (string): A concise, expert explanation of what likely changed to cause the regression.
+    -   `optimization_suggestion` (string): A concrete, actionable way to confirm or fix the regression.
+
+2.  **"overall_summary"**: A string summarizing how the candidate's performance changed and whether it should be released as is.
+
+Ensure your output is a single, valid JSON object and nothing else.
+"""
+
 # You can add other prompts for different analysis types below,
 # such as the patent-related ones if they are still needed.
 
@@ -0,0 +1,53 @@
+import threading
+import time
+
+
+class TokenRateLimiter:
+    """
+    A token bucket limiting how many LLM tokens are sent per minute.
+
+    The bucket holds up to one minute's worth of tokens and refills
+    continuously. `acquire` blocks until the requested tokens are available,
+    so callers on several threads share one budget.
+    """
+
+    def __init__(self, tokens_per_minute, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            tokens_per_minute (int): The budget; 0 or None disables limiting.
+            clock (callable): Returns the current time in seconds.
+            sleep (callable): Waits for the given number of seconds.
+        """
+        self.tokens_per_minute = tokens_per_minute or 0
+        self._rate = self.tokens_per_minute / 60.0
+        self._clock = clock
+        self._sleep = sleep
+        self._available = float(self.tokens_per_minute)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """
+        Takes `tokens` from the bucket, waiting for it to refill if needed.
+        Requests larger than the whole bucket wait for a full bucket.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        if not self.tokens_per_minute:
+            return 0.0
+        tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._available = min(
+                    self.tokens_per_minute, self._available + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._available >= tokens:
+                    self._available -= tokens
+                    return waited
+                delay = (tokens - self._available) / self._rate
+            self._sleep(delay)
+            waited += delay
@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from core import llm_analyzer
+from core.json_stream import JSONArrayStreamParser
+from core.rate_limiter import TokenRateLimiter
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenRateLimiterTestCase(unittest.TestCase):
+
+    def test_waits_for_the_bucket_to_refill(self):
+        clock = FakeClock()
+        limiter = TokenRateLimiter(600, clock=clock, sleep=clock.sleep)
+        self.assertEqual(limiter.acquire(600), 0.0)
+        # 600 tokens per minute refill at 10 per second.
+        self.assertAlmostEqual(limiter.acquire(100), 10.0)
+        self.assertAlmostEqual(clock.now, 10.0)
+        # Oversized requests wait for a full bucket instead of forever.
+        self.assertAlmostEqual(limiter.acquire(10000), 60.0)
+
+    def test_disabled(self):
+        self.assertEqual(TokenRateLimiter(0).acquire(10 ** 9), 0.0)
+
+
+class AnalyzeInfringementBatchTestCase(unittest.TestCase):
+
+    def test_runs_concurrently_and_keeps_order(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def fake_response(prompt, **kwargs):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            # Later documents finish first.
+            time.sleep(0.05 if 'doc-0' in prompt else 0.01)
+            with lock:
+                state['running'] -= 1
+            return f"初步匹配度得分：{prompt.count('doc')}/100"
+
+        evidence = [(f"doc-{i}", f"evidence-{i}.pdf") for i in range(8)]
+        with mock.patch.object(llm_analyzer, 'get_llm_response', side_effect=fake_response):
+            results = llm_analyzer.analyze_infringement_batch({}, evidence, max_in_flight=3, tokens_per_minute=0)
+
+        self.assertEqual([r['evidence_filename'] for r in results], [name for _, name in evidence])
+        self.assertEqual(state['peak'], 3)
+
+    def test_case_summarizes_after_all_analyses(self):
+        with mock.patch.object(llm_analyzer, 'get_llm_response', return_value="分析") as response:
+            analyses, report = llm_analyzer.analyze_infringement_case({}, [("a", "a.pdf"), ("b", "b.pdf")])
+        self.assertEqual(len(analyses), 2)
+        self.assertEqual(report, "分析")
+        self.assertEqual(response.call_count, 3)
+
+
+class JSONArrayStreamParserTestCase(unittest.TestCase):
+
+    def test_emits_items_as_they_complete(self):
+        text = ('```json\n{"note": "identified_bottlenecks [{", "identified_bottlenecks": ['
+                '{"function_stack": "a;b", "analysis": "uses \\"}\\" and [x]"},'
+                '{"function_stack": "c", "nested": {"k": [1, {"x": 2}]}}'
+                '], "overall_summary": "done"}\n```')
+        parser = JSONArrayStreamParser('identified_bottlenecks')
+        # The first item is out before the second one has started.
+        split = text.index('{"function_stack": "c"')
+        emitted = []
+        for i in range(0, split, 7):
+            emitted.extend(parser.feed(text[i:min(i + 7, split)]))
+        self.assertEqual(len(emitted), 1)
+        emitted.extend(parser.feed(text[split:]))
+        self.assertEqual([item['function_stack'] for item in emitted], ['a;b', 'c'])
+        self.assertEqual(emitted[0]['analysis'], 'uses "}" and [x]')
+        self.assertEqual(parser.result()['overall_summary'], 'done')
+
+    def test_invalid_json_has_no_result(self):
+        parser = JSONArrayStreamParser('identified_bottlenecks')
+        parser.feed('{"identified_bottlenecks": [{"a": 1}')
+        self.assertIsNone(parser.result())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from core import llm_analyzer
+from core.config import settings
+from core.llm_cache import LLMCache
+
+
+class LLMCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key_covers_every_request_field(self):
+        base = ('openai', 'gpt', 'sys', 'prompt', {'temperature': 0.2}, True)
+        key = LLMCache.make_key(*base)
+        self.assertEqual(key, LLMCache.make_key(*base))
+        for i, changed in enumerate(('ollama', 'llama', 'other', 'prompt2', {'temperature': 0.3}, False)):
+            args = list(base)
+            args[i] = changed
+            self.assertNotEqual(key, LLMCache.make_key(*args))
+
+    def test_hits_come_from_memory_then_disk(self):
+        cache = LLMCache(self.path, ttl=0, max_entries=10, memory_entries=10)
+        self.assertIsNone(cache.get('k'))
+        cache.set('k', {'a': [1, 2]})
+        value = cache.get('k')
+        self.assertEqual(value, {'a': [1, 2]})
+        value['a'].append(3)
+        self.assertEqual(cache.get('k'), {'a': [1, 2]})
+
+        # A second process sees the entry through the database.
+        other = LLMCache(self.path, ttl=0, max_entries=10, memory_entries=10)
+        self.assertEqual(other.get('k'), {'a': [1, 2]})
+        self.assertEqual(cache.stats()['memory_hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(other.stats()['disk_hits'], 1)
+
+    def test_ttl_expires_entries(self):
+        cache = LLMCache(self.path, ttl=60, max_entries=10, memory_entries=10)
+        cache.set('k', 'v')
+        with mock.patch('core.llm_cache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(cache.get('k'))
+
+    def test_lru_eviction(self):
+        cache = LLMCache(self.path, ttl=0, max_entries=2, memory_entries=2)
+        for key in ('a', 'b'):
+            cache.set(key, key)
+            time.sleep(0.01)
+        cache.get('a')
+        # Another process reading 'a' refreshes it on disk.
+        other = LLMCache(self.path, ttl=0, max_entries=2, memory_entries=2)
+        other.get('a')
+        cache.set('c', 'c')
+        cache.prune()
+        # 'b' was least recently used in both tiers.
+        self.assertNotIn('b', cache._memory)
+        other = LLMCache(self.path, ttl=0, max_entries=2, memory_entries=2)
+        self.assertIsNone(other.get('b'))
+        self.assertEqual(other.get('a'), 'a')
+        self.assertEqual(other.get('c'), 'c')
+
+    def test_get_llm_response_caches_successes_only(self):
+        cache = LLMCache(self.path, ttl=0, max_entries=10, memory_entries=10)
+        responses = ['[LLM_ERROR: timeout]', 'answer']
+        with mock.patch.object(settings, 'SIMULATE_LLM', False), \
+                mock.patch.object(llm_analyzer, 'get_llm_cache', return_value=cache), \
+                mock.patch.object(llm_analyzer, '_call_llm', side_effect=responses) as call:
+            self.assertEqual(llm_analyzer.get_llm_response('p'), '[LLM_ERROR: timeout]')
+            self.assertEqual(llm_analyzer.get_llm_response('p'), 'answer')
+            self.assertEqual(llm_analyzer.get_llm_response('p'), 'answer')
+            self.assertEqual(call.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import openai
+
+from core import llm_analyzer
+from core.config import settings
+from core.llm_pool import Endpoint, EndpointPool, NoEndpointAvailable, parse_endpoints
+
+
+class StandInServer:
+    """A local stand-in for an OpenAI-compatible replica, e.g. vLLM."""
+
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.status = 200
+        self.requests = 0
+        self.running = 0
+        self.peak = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if stand_in.status != 200:
+                    self._send(stand_in.status, {'error': {'message': 'unavailable'}})
+                else:
+                    self._send(200, {'object': 'list', 'data': []})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stand_in._lock:
+                    stand_in.requests += 1
+                    stand_in.running += 1
+                    stand_in.peak = max(stand_in.peak, stand_in.running)
+                    stand_in.connections.add(self.client_address)
+                try:
+                    time.sleep(stand_in.delay)
+                    if stand_in.status != 200:
+                        self._send(stand_in.status, {'error': {'message': 'unavailable'}})
+                    elif body.get('stream'):
+                        self._stream()
+                    else:
+                        self._send(200, {
+                            'id': 'c', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                            'choices': [{'index': 0, 'finish_reason': 'stop',
+                                         'message': {'role': 'assistant', 'content': stand_in.name}}],
+                            'usage': {'prompt_tokens': 3, 'completion_tokens': 1, 'total_tokens': 4},
+                        })
+                finally:
+                    with stand_in._lock:
+                        stand_in.running -= 1
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for text in (stand_in.name, '!'):
+                    chunk = {'id': 'c', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'm',
+                             'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+    def client(self):
+        return openai.OpenAI(base_url=self.url, api_key='test', timeout=5, max_retries=0)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def chat(client):
+    return client.chat.completions.create(model='m', messages=[{'role': 'user', 'content': 'hi'}])
+
+
+class EndpointPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [StandInServer('a'), StandInServer('b')]
+        for server in self.servers:
+            self.addCleanup(server.close)
+
+    def make_pool(self, weights=(1, 1), max_in_flight=0, **kwargs):
+        endpoints = [Endpoint(server.url, server.client(), weight=weight, max_in_flight=max_in_flight,
+                              failure_threshold=2, cooldown=10)
+                     for server, weight in zip(self.servers, weights)]
+        pool = EndpointPool(endpoints, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_least_loaded_spreads_requests_within_limits(self):
+        for server in self.servers:
+            server.delay = 0.05
+        pool = self.make_pool(max_in_flight=2, strategy='least_loaded', retries=0)
+        threads = [threading.Thread(target=pool.call, args=(chat,)) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([server.requests for server in self.servers], [6, 6])
+        self.assertEqual([server.peak for server in self.servers], [2, 2])
+        # Requests reuse the pooled keep-alive connections.
+        for server in self.servers:
+            self.assertLess(len(server.connections), server.requests)
+
+    def test_weighted_round_robin(self):
+        pool = self.make_pool(weights=(2, 1), strategy='round_robin', retries=0)
+        answers = [pool.call(chat).choices[0].message.content for _ in range(6)]
+        self.assertEqual(answers, ['a', 'b', 'a', 'a', 'b', 'a'])
+
+    def test_failures_are_retried_and_open_the_breaker(self):
+        clock = FakeClock()
+        self.servers[0].status = 503
+        pool = self.make_pool(strategy='round_robin', retries=2, backoff=0.1, clock=clock, sleep=clock.sleep)
+        span = mock.Mock()
+        for _ in range(4):
+            self.assertEqual(pool.call(chat, span).choices[0].message.content, 'b')
+        span.set.assert_called_with(endpoint=self.servers[1].url, attempts=1)
+        # Two failures opened the breaker; later requests went straight to 'b'.
+        self.assertEqual(self.servers[0].requests, 2)
+        self.assertEqual(pool.status()[0]['breaker'], 'open')
+
+        # After the cooldown a trial request closes the breaker again.
+        self.servers[0].status = 200
+        clock.now += 10
+        self.assertEqual(pool.status()[0]['breaker'], 'half_open')
+        answers = {pool.call(chat).choices[0].message.content for _ in range(2)}
+        self.assertEqual(answers, {'a', 'b'})
+        self.assertEqual(pool.status()[0]['breaker'], 'closed')
+
+    def test_bad_requests_are_not_retried(self):
+        self.servers[0].status = 400
+        self.servers[1].status = 400
+        pool = self.make_pool(retries=2, backoff=0)
+        with self.assertRaises(openai.BadRequestError):
+            pool.call(chat)
+        self.assertEqual(sum(server.requests for server in self.servers), 1)
+        self.assertEqual({s['breaker'] for s in pool.status()}, {'closed'})
+
+    def test_health_checks_eject_and_readmit(self):
+        pool = self.make_pool(retries=0)
+        self.servers[1].status = 500
+        self.assertEqual(pool.check_health(), 1)
+        self.assertEqual({pool.call(chat).choices[0].message.content for _ in range(3)}, {'a'})
+
+        self.servers[0].status = 500
+        pool.check_health()
+        with self.assertRaises(NoEndpointAvailable):
+            pool.call(chat)
+
+        self.servers[1].status = 200
+        self.assertEqual(pool.check_health(), 1)
+        self.assertEqual(pool.call(chat).choices[0].message.content, 'b')
+
+    def test_streams_retry_until_one_starts(self):
+        self.servers[0].status = 502
+        pool = self.make_pool(strategy='round_robin', retries=1, backoff=0)
+        chunks = pool.stream(lambda client: client.chat.completions.create(
+            model='m', messages=[{'role': 'user', 'content': 'hi'}], stream=True))
+        self.assertEqual(''.join(chunk.choices[0].delta.content for chunk in chunks), 'b!')
+        self.assertEqual([s['in_flight'] for s in pool.status()], [0, 0])
+
+    def test_parse_endpoints(self):
+        self.assertEqual(parse_endpoints(' http://a/v1;weight=2;max_in_flight=16, http://b/v1 ,'),
+                         [('http://a/v1', {'weight': 2, 'max_in_flight': 16}), ('http://b/v1', {})])
+        with self.assertRaises(ValueError):
+            parse_endpoints('http://a/v1;weight=high')
+
+
+class LLMAnalyzerPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [StandInServer('a', delay=0.02), StandInServer('b', delay=0.02)]
+        for server in self.servers:
+            self.addCleanup(server.close)
+        endpoints = ','.join(server.url for server in self.servers)
+        patches = [
+            mock.patch.object(settings, 'LLM_PROVIDER', 'ollama'),
+            mock.patch.object(settings, 'SIMULATE_LLM', False),
+            mock.patch.object(settings, 'LLM_ENDPOINTS', endpoints),
+            mock.patch.object(settings, 'LLM_HEALTH_CHECK_INTERVAL', 0),
+            mock.patch.object(llm_analyzer, 'llm_pool', None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_requests_use_every_endpoint(self):
+        pools = []
+        threads = [threading.Thread(target=lambda: pools.append(llm_analyzer.get_llm_pool())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(pool) for pool in pools}), 1)
+        self.addCleanup(pools[0].close)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(llm_analyzer.get_llm_response('p', use_cache=False)))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), ['a', 'a', 'a', 'b', 'b', 'b'])
+
+        streamed = ''.join(llm_analyzer.get_llm_response('p', use_cache=False, stream=True))
+        self.assertIn(streamed, ('a!', 'b!'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+
+from core import llm_analyzer
+from core.metrics import MetricsRegistry, Span, Timeline, STAGE_DURATION, STAGE_RUNS, LLM_TOKENS
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+
+    def test_renders_prometheus_text_format(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('jobs_total', 'Jobs run.', ('outcome',))
+        histogram = registry.histogram('job_seconds', 'Job duration.', buckets=(1, 5))
+        counter.inc(outcome='ok')
+        counter.inc(2, outcome='error')
+        histogram.observe(0.5)
+        histogram.observe(3)
+        histogram.observe(10)
+
+        text = registry.render()
+        self.assertIn('# TYPE jobs_total counter', text)
+        self.assertIn('jobs_total{outcome="ok"} 1', text)
+        self.assertIn('jobs_total{outcome="error"} 2', text)
+        self.assertIn('# TYPE job_seconds histogram', text)
+        # Buckets are cumulative.
+        self.assertIn('job_seconds_bucket{le="1"} 1', text)
+        self.assertIn('job_seconds_bucket{le="5"} 2', text)
+        self.assertIn('job_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('job_seconds_sum 13.5', text)
+        self.assertIn('job_seconds_count 3', text)
+
+    def test_escapes_label_values(self):
+        registry = MetricsRegistry()
+        registry.counter('c', 'help', ('name',)).inc(name='a"b\\c\nd')
+        self.assertIn('c{name="a\\"b\\\\c\\nd"} 1', registry.render())
+
+
+class SpanTestCase(unittest.TestCase):
+
+    def test_records_into_the_active_timeline(self):
+        timeline = Timeline()
+        before = STAGE_DURATION.count(stage='test-stage')
+        with timeline.activate():
+            with Span('test-stage', bytes_in=10) as span:
+                span.set(samples=5)
+        with Span('test-stage'):
+            pass  # No active timeline: only the metrics record it.
+
+        [recorded] = timeline.to_list()
+        self.assertEqual(recorded['stage'], 'test-stage')
+        self.assertEqual(recorded['bytes_in'], 10)
+        self.assertEqual(recorded['samples'], 5)
+        self.assertIsNone(recorded['error'])
+        self.assertGreaterEqual(recorded['duration'], 0)
+        self.assertEqual(STAGE_DURATION.count(stage='test-stage'), before + 2)
+
+    def test_records_errors(self):
+        timeline = Timeline()
+        errors = STAGE_RUNS.value(stage='failing-stage', outcome='error')
+        with timeline.activate():
+            with Span('failing-stage') as span:
+                span.fail('no data')
+            with self.assertRaises(ValueError):
+                with Span('failing-stage'):
+                    raise ValueError('bad input')
+        self.assertEqual([span['error'] for span in timeline.to_list()], ['no data', 'bad input'])
+        self.assertEqual(STAGE_RUNS.value(stage='failing-stage', outcome='error'), errors + 2)
+
+    def test_llm_responses_record_tokens(self):
+        timeline = Timeline()
+        tokens = LLM_TOKENS.value(model='test-model', kind='prompt')
+        with mock.patch.object(llm_analyzer.settings, 'SIMULATE_LLM', True), \
+                mock.patch.object(llm_analyzer.settings, 'SIMULATE_LLM_DELAY', 0), \
+                timeline.activate():
+            llm_analyzer.get_llm_response('x' * 400, model_name='test-model')
+            chunks = list(llm_analyzer.get_llm_response('y' * 400, model_name='test-model', stream=True))
+
+        spans = timeline.to_list()
+        self.assertEqual([span['stage'] for span in spans], ['llm', 'llm'])
+        self.assertEqual(spans[0]['prompt_tokens'], 100)
+        self.assertEqual(spans[1]['bytes_out'], len(''.join(chunks)))
+        self.assertTrue(spans[1]['streamed'])
+        self.assertEqual(LLM_TOKENS.value(model='test-model', kind='prompt'), tokens + 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,115 @@
 
-from flask import Flask, jsonify, request
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-from data import get_all_data, get_domain_by_id, update_feature_status
+from data import store, get_domain_by_id, query_features, update_feature_status, update_feature_statuses
+from store import FIELDS, STATUS_COUNTERS
+
+# Serialized /api/features responses kept per (data version, query)
+RESPONSE_CACHE_SIZE = 256
+MAX_PER_PAGE = 100
+# Largest batch accepted by the bulk update endpoint
+MAX_BULK_UPDATES = 10000
+# Seconds between keep-alive comments on an idle change feed
+CHANGE_FEED_KEEPALIVE = 15
 
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag'])
+
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+class QueryError(ValueError):
+    pass
+
+
+def parse_features_query(args):
+    """
+    Reads the /api/features query parameters into a normalized, hashable
+    query: (domain IDs, status, fields, page, per page).
+
+    Raises:
+        QueryError: If a parameter is invalid.
+    """
+    domain_ids = tuple(sorted(d for d in args.get('domain', '').split(',') if d)) or None
+    status = args.get('status') or None
+    if status is not None and status not in STATUS_COUNTERS:
+        raise QueryError(f"Unknown status '{status}'")
+
+    requested = [f for f in args.get('fields', '').split(',') if f] or FIELDS
+    if set(requested) - set(FIELDS):
+        raise QueryError(f"fields must be a comma-separated list of: {', '.join(FIELDS)}")
+    fields = tuple(f for f in FIELDS if f in requested)
+
+    page = per_page = None
+    if 'page' in args or 'per_page' in args:
+        try:
+            page = int(args.get('page', 1))
+            per_page = int(args.get('per_page', 20))
+        except ValueError:
+            raise QueryError("page and per_page must be integers") from None
+        if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+            raise QueryError(f"page must be at least 1 and per_page between 1 and {MAX_PER_PAGE}")
+    return domain_ids, status, fields, page, per_page
+
+
+def cached_features_response(query):
+    """
+    Returns (ETag, JSON body) for a query, serializing it only once per
+    version of the data.
+    """
+    version = store.version
+    key = (version, query)
+    with _response_cache_lock:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            _response_cache.move_to_end(key)
+            return cached
+
+    version, result = query_features(*query)
+    # Every query has its own representation, so the ETag covers it too.
+    etag = f"{store.epoch}-{version}-{zlib.crc32(repr(query).encode('utf-8')):08x}"
+    cached = (etag, app.json.dumps(result))
+    with _response_cache_lock:
+        _response_cache[(version, query)] = cached
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+    return cached
+
 
 @app.route('/api/features', methods=['GET'])
 def get_features():
     """
-    API endpoint to get all feature data.
+    API endpoint to get feature data, all of it by default.
+
+    Query parameters:
+        domain: comma-separated domain IDs to include.
+        status: only include features with this status.
+        fields: comma-separated parts to include: summary, domains, features.
+            `fields=summary` returns only the summary counters.
+        page, per_page: paginate the domains.
+
+    Responses carry an ETag; a request with a matching If-None-Match gets
+    304 Not Modified until the data changes.
     """
-    return jsonify(get_all_data())
+    try:
+        query = parse_features_query(request.args)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+
+    etag, body = cached_features_response(query)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route('/api/features/<string:domain_id>', methods=['GET'])
@@ -35,9 +132,88 @@ def update_feature(domain_id, feature_id):
     if not new_status:
         return jsonify({"error": "New status not provided"}), 400
 
-    if update_feature_status(domain_id, feature_id, new_status):
+    try:
+        updated = update_feature_status(domain_id, feature_id, new_status)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if updated:
         return jsonify({"message": "Feature status updated successfully"})
     return jsonify({"error": "Feature or domain not found"}), 404
 
+@app.route('/api/features/bulk', methods=['POST'])
+def bulk_update_features():
+    """
+    API endpoint to update the status of many features at once.
+
+    The body is {"updates": [{"domain_id", "feature_id", "status"}, ...]}.
+    Every update is checked before any is applied; if one is invalid, none
+    is applied and the response lists the error of each failing update.
+    """
+    data = request.get_json(silent=True)
+    updates = data.get('updates') if isinstance(data, dict) else None
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"error": "Expected a non-empty list of updates"}), 400
+    if len(updates) > MAX_BULK_UPDATES:
+        return jsonify({"error": f"At most {MAX_BULK_UPDATES} updates per request"}), 413
+
+    ok, results = update_feature_statuses(updates)
+    if not ok:
+        failed = sum(1 for result in results if 'error' in result)
+        return jsonify({"error": f"{failed} of {len(results)} updates are invalid; nothing was updated",
+                        "results": results}), 400
+    return jsonify({"message": "Feature statuses updated successfully",
+                    "updated": sum(1 for result in results if result['changed']),
+                    "results": results})
+
+def parse_feed_position(position):
+    """
+    Reads a change feed event ID, "<epoch>-<seq>", into the sequence number
+    to resume after. Returns None if there is nothing to resume, including
+    IDs from before the backend restarted.
+    """
+    epoch, _, seq = (position or '').rpartition('-')
+    if epoch != store.epoch or not seq.isdigit():
+        return None
+    return int(seq)
+
+@app.route('/api/features/changes', methods=['GET'])
+def feature_changes():
+    """
+    API endpoint streaming status changes as Server-Sent Events.
+
+    A new client first gets a `snapshot` event with the whole dataset, then
+    a `change` event per status change: the feature's `domain_id`,
+    `feature_id`, `old_status` and `new_status`, and its domain's and the
+    summary's counters after the change. Clients resume after the
+    `Last-Event-ID` header, or the `since` query parameter, with the changes
+    they missed; if those are no longer kept, they get a new snapshot.
+    """
+    seq = parse_feed_position(request.headers.get('Last-Event-ID') or request.args.get('since'))
+
+    def event(seq, name, data):
+        return f"id: {store.epoch}-{seq}\nevent: {name}\ndata: {app.json.dumps(data)}\n\n"
+
+    def generate(seq):
+        while True:
+            if seq is None:
+                seq, snapshot = store.snapshot_with_seq()
+                yield event(seq, 'snapshot', snapshot)
+            events, complete = store.feed.wait(seq, timeout=CHANGE_FEED_KEEPALIVE)
+            if not complete:
+                seq = None
+                continue
+            if not events:
+                # Comment line to keep proxies from closing an idle stream.
+                yield ": keep-alive\n\n"
+                continue
+            for seq, change in events:
+                yield event(seq, 'change', change)
+
+    return Response(
+        stream_with_context(generate(seq)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
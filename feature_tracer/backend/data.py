@@ -1,5 +1,7 @@
 
-import json
+import os
+
+from store import FeatureStore, FIELDS
 
 data = {
     "summary": {
@@ -74,30 +76,37 @@ data = {
     ]
 }
 
+# Set FEATURE_TRACER_DB to a SQLite file to keep status changes across restarts.
+store = FeatureStore(data, db_path=os.getenv("FEATURE_TRACER_DB") or None)
+
 def get_all_data():
     """
     Returns all the data for the feature tracer.
     """
-    return data
+    return store.snapshot()
 
 def get_domain_by_id(domain_id):
     """
     Returns a single domain by its ID.
     """
-    for domain in data['domains']:
-        if domain['id'] == domain_id:
-            return domain
-    return None
+    return store.get_domain(domain_id)
+
+def query_features(domain_ids=None, status=None, fields=None, page=None, per_page=None):
+    """
+    Returns part of the data and the data's version. See FeatureStore.query.
+    """
+    return store.query(domain_ids, status, fields or FIELDS, page, per_page)
 
 def update_feature_status(domain_id, feature_id, new_status):
     """
-    Updates the status of a feature.
+    Updates the status of a feature, and the counters of its domain and of
+    the summary. Raises ValueError for an unknown status.
     """
-    domain = get_domain_by_id(domain_id)
-    if domain and 'features' in domain:
-        for feature in domain['features']:
-            if feature['id'] == feature_id:
-                feature['status'] = new_status
-                return True
-    return False
+    return store.update_status(domain_id, feature_id, new_status)
 
+def update_feature_statuses(updates):
+    """
+    Applies a list of status updates as one atomic batch. Returns (ok,
+    per-update results); nothing is applied unless every update is valid.
+    """
+    return store.update_statuses(updates)
@@ -0,0 +1,415 @@
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+# Top-level parts of the dataset that a query can select
+FIELDS = ("summary", "domains", "features")
+
+# Feature statuses, and the domain and summary counters that count them
+STATUS_COUNTERS = {
+    "已完成": ("completed", "completed_features"),
+    "进行中": ("in_progress", "in_progress_features"),
+    "未开始": ("not_started", "not_started_features"),
+}
+
+# Change events kept for clients that resume the change feed
+CHANGE_FEED_BACKLOG = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summary (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    total_features INTEGER NOT NULL,
+    completed_features INTEGER NOT NULL,
+    in_progress_features INTEGER NOT NULL,
+    not_started_features INTEGER NOT NULL,
+    last_updated TEXT
+);
+CREATE TABLE IF NOT EXISTS domains (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    icon TEXT,
+    total_features INTEGER NOT NULL,
+    completed INTEGER NOT NULL,
+    in_progress INTEGER NOT NULL,
+    not_started INTEGER NOT NULL,
+    has_features INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS features (
+    domain_id TEXT NOT NULL REFERENCES domains (id),
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT,
+    status TEXT NOT NULL,
+    PRIMARY KEY (domain_id, id)
+);
+"""
+
+
+def _copy_domain(domain):
+    domain = dict(domain)
+    if "features" in domain:
+        domain["features"] = [dict(feature) for feature in domain["features"]]
+    return domain
+
+
+def format_timestamp(timestamp=None):
+    """
+    Formats a time like the dataset's `last_updated`, e.g. "2025年7月18日 14:30".
+    """
+    t = time.localtime(timestamp)
+    return f"{t.tm_year}年{t.tm_mon}月{t.tm_mday}日 {t.tm_hour:02d}:{t.tm_min:02d}"
+
+
+class ChangeFeed:
+    """
+    A numbered log of the last `max_events` status changes, for clients that
+    keep in sync by applying changes to a snapshot instead of re-fetching it.
+
+    Sequence numbers start at 1 and are never reused. A client that has seen
+    everything up to `seq` can continue if the changes after it are still in
+    the log; otherwise it needs a new snapshot.
+    """
+
+    def __init__(self, max_events=CHANGE_FEED_BACKLOG):
+        self._events = deque(maxlen=max_events)
+        self._condition = threading.Condition()
+        self.last_seq = 0
+
+    def publish(self, changes):
+        """Appends changes to the log and wakes up waiting readers."""
+        with self._condition:
+            for change in changes:
+                self.last_seq += 1
+                self._events.append((self.last_seq, change))
+            self._condition.notify_all()
+
+    def since(self, seq):
+        """
+        Returns the changes after `seq`.
+
+        Returns:
+            tuple: (events, complete) where `events` is a list of (seq,
+                change) and `complete` is False if changes after `seq` have
+                already left the log, or `seq` was never issued.
+        """
+        with self._condition:
+            if seq < 0 or seq > self.last_seq:
+                return [], False
+            first = self._events[0][0] if self._events else self.last_seq + 1
+            if seq + 1 < first:
+                return [], False
+            return [event for event in self._events if event[0] > seq], True
+
+    def wait(self, seq, timeout=None):
+        """Like `since`, but first waits up to `timeout` seconds for a change after `seq`."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.last_seq != seq, timeout)
+        return self.since(seq)
+
+
+class FeatureStore:
+    """
+    The feature tracer's data, indexed by ID.
+
+    Domains and features are kept in dicts keyed by their IDs, so lookups
+    and updates do not scan the dataset. The per-domain and summary counters
+    are adjusted on every status change rather than recomputed. Domains
+    whose individual features are not listed keep their counters as given.
+
+    With a `db_path`, everything is also stored in SQLite: the database is
+    seeded on first use, loaded on later starts, and every change is
+    committed before it becomes visible.
+
+    `version` goes up with every change. Together with `epoch`, which is new
+    for every store, it identifies a state of the data, e.g. for ETags.
+
+    Every status change is also published to `feed`, in the order the
+    changes are applied.
+    """
+
+    def __init__(self, seed, db_path=None, backlog=CHANGE_FEED_BACKLOG):
+        """
+        Args:
+            seed (dict): The initial dataset, with `summary` and `domains`.
+            db_path (str): SQLite database to persist to; in memory only if
+                not given.
+            backlog (int): How many changes the change feed keeps.
+        """
+        self._lock = threading.RLock()
+        self._db = None
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.feed = ChangeFeed(backlog)
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+            if self._db.execute("SELECT COUNT(*) FROM summary").fetchone()[0]:
+                seed = self._read_db()
+            else:
+                self._write_db(seed)
+        self._load(seed)
+
+    def _load(self, dataset):
+        self._summary = dict(dataset["summary"])
+        self._domains = {}
+        self._features = {}
+        for domain in dataset["domains"]:
+            domain = _copy_domain(domain)
+            for feature in domain.get("features", []):
+                self._features[(domain["id"], feature["id"])] = feature
+            self._domains[domain["id"]] = domain
+
+    # --- SQLite persistence ---
+
+    def _read_db(self):
+        db = self._db
+        columns = ("total_features", "completed_features", "in_progress_features", "not_started_features",
+                   "last_updated")
+        summary = dict(zip(columns, db.execute(f"SELECT {', '.join(columns)} FROM summary").fetchone()))
+
+        features = {}
+        for domain_id, feature_id, name, description, status in db.execute(
+                "SELECT domain_id, id, name, description, status FROM features ORDER BY domain_id, position"):
+            features.setdefault(domain_id, []).append(
+                {"id": feature_id, "name": name, "description": description, "status": status})
+
+        domains = []
+        for row in db.execute("SELECT id, name, total_features, completed, in_progress, not_started, icon, "
+                              "has_features FROM domains ORDER BY position"):
+            domain = dict(zip(("id", "name", "total_features", "completed", "in_progress", "not_started", "icon"),
+                              row[:7]))
+            if row[7]:
+                domain["features"] = features.get(domain["id"], [])
+            domains.append(domain)
+        return {"summary": summary, "domains": domains}
+
+    def _write_db(self, dataset):
+        with self._db:
+            summary = dataset["summary"]
+            self._db.execute(
+                "INSERT INTO summary VALUES (0, ?, ?, ?, ?, ?)",
+                (summary["total_features"], summary["completed_features"], summary["in_progress_features"],
+                 summary["not_started_features"], summary.get("last_updated")))
+            for position, domain in enumerate(dataset["domains"]):
+                self._db.execute(
+                    "INSERT INTO domains VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (domain["id"], position, domain["name"], domain.get("icon"), domain["total_features"],
+                     domain["completed"], domain["in_progress"], domain["not_started"], "features" in domain))
+                self._db.executemany(
+                    "INSERT INTO features VALUES (?, ?, ?, ?, ?, ?)",
+                    [(domain["id"], feature["id"], i, feature["name"], feature.get("description"),
+                      feature["status"]) for i, feature in enumerate(domain.get("features", []))])
+
+    def _persist(self, changes):
+        """Writes changed features and the counters they moved, in one transaction."""
+        domains = {domain_id for domain_id, _, _, _ in changes}
+        with self._db:
+            self._db.executemany(
+                "UPDATE features SET status = ? WHERE domain_id = ? AND id = ?",
+                [(new, domain_id, feature_id) for domain_id, feature_id, _, new in changes])
+            self._db.executemany(
+                "UPDATE domains SET completed = ?, in_progress = ?, not_started = ? WHERE id = ?",
+                [(self._domains[d]["completed"], self._domains[d]["in_progress"], self._domains[d]["not_started"], d)
+                 for d in domains])
+            summary = self._summary
+            self._db.execute(
+                "UPDATE summary SET completed_features = ?, in_progress_features = ?, not_started_features = ?, "
+                "last_updated = ? WHERE id = 0",
+                (summary["completed_features"], summary["in_progress_features"], summary["not_started_features"],
+                 summary["last_updated"]))
+
+    # --- Queries ---
+
+    def snapshot(self):
+        """
+        Returns a copy of the whole dataset, in the shape of the seed.
+        """
+        with self._lock:
+            return {"summary": dict(self._summary),
+                    "domains": [_copy_domain(domain) for domain in self._domains.values()]}
+
+    def snapshot_with_seq(self):
+        """
+        Returns (seq, snapshot): a copy of the dataset and the sequence
+        number of the last change feed event it includes.
+        """
+        with self._lock:
+            return self.feed.last_seq, self.snapshot()
+
+    def get_domain(self, domain_id):
+        """
+        Returns a copy of a domain, or None if there is no such domain.
+        """
+        with self._lock:
+            domain = self._domains.get(domain_id)
+            return _copy_domain(domain) if domain is not None else None
+
+    def get_feature(self, domain_id, feature_id):
+        """
+        Returns a copy of a feature, or None if there is no such feature.
+        """
+        with self._lock:
+            feature = self._features.get((domain_id, feature_id))
+            return dict(feature) if feature is not None else None
+
+    def query(self, domain_ids=None, status=None, fields=FIELDS, page=None, per_page=None):
+        """
+        Returns part of the dataset, in the shape of the seed.
+
+        Args:
+            domain_ids (list): Only these domains, in dataset order.
+            status (str): Only features with this status. Counters are not
+                filtered.
+            fields (tuple): Which of "summary", "domains" (with counters) and
+                "features" (the domains' feature lists) to include.
+            page (int): The 1-based page of domains to return, if paginated.
+            per_page (int): Domains per page.
+
+        Returns:
+            tuple: (version, result); paginated results also have a
+                `pagination` entry.
+        """
+        with self._lock:
+            result = {}
+            if "summary" in fields:
+                result["summary"] = dict(self._summary)
+            if "domains" in fields or "features" in fields:
+                if domain_ids is None:
+                    domains = list(self._domains.values())
+                else:
+                    wanted = set(domain_ids)
+                    domains = [domain for domain in self._domains.values() if domain["id"] in wanted]
+                if per_page:
+                    total = len(domains)
+                    page = page or 1
+                    domains = domains[(page - 1) * per_page:page * per_page]
+                    result["pagination"] = {"page": page, "per_page": per_page, "total_domains": total,
+                                            "total_pages": (total + per_page - 1) // per_page}
+                result["domains"] = [self._project(domain, status, "features" in fields) for domain in domains]
+            return self.version, result
+
+    @staticmethod
+    def _project(domain, status, with_features):
+        projected = {key: value for key, value in domain.items() if key != "features"}
+        if with_features and "features" in domain:
+            projected["features"] = [dict(feature) for feature in domain["features"]
+                                     if status is None or feature["status"] == status]
+        return projected
+
+    # --- Updates ---
+
+    def update_status(self, domain_id, feature_id, new_status):
+        """
+        Sets the status of a feature and moves it between the counters.
+
+        Returns:
+            bool: True if the feature exists, False otherwise.
+
+        Raises:
+            ValueError: If `new_status` is not a known status.
+        """
+        if new_status not in STATUS_COUNTERS:
+            raise ValueError(f"Unknown status '{new_status}'")
+        ok, _ = self.update_statuses([{"domain_id": domain_id, "feature_id": feature_id,
+                                             "status": new_status}])
+        return ok
+
+    def update_statuses(self, updates):
+        """
+        Applies a batch of status updates atomically: every update is
+        validated first, and either all of them are applied, under one lock
+        and one SQLite transaction, or none is.
+
+        Args:
+            updates (list): Dicts with `domain_id`, `feature_id` and `status`.
+                Later updates of the same feature win.
+
+        Returns:
+            tuple: (ok, results) with one result per update, in order: the
+                feature's `old_status` and `new_status` and whether it
+                `changed`, or an `error` if the batch was rejected because of
+                that update.
+        """
+        with self._lock:
+            results = [self._validate(update) for update in updates]
+            if any("error" in result for result in results):
+                return False, results
+
+            changes = []
+            events = []
+            for result in results:
+                feature = self._features[(result["domain_id"], result["feature_id"])]
+                result["old_status"] = feature["status"]
+                result["changed"] = result["old_status"] != result["new_status"]
+                if result["changed"]:
+                    self._apply(result["domain_id"], feature, result["new_status"])
+                    changes.append((result["domain_id"], result["feature_id"], result["old_status"],
+                                    result["new_status"]))
+                    events.append(self._change_event(result))
+            if not changes:
+                return True, results
+
+            last_updated = self._summary.get("last_updated")
+            self._summary["last_updated"] = format_timestamp()
+            if self._db is not None:
+                try:
+                    self._persist(changes)
+                except sqlite3.Error:
+                    for domain_id, feature_id, old_status, _ in reversed(changes):
+                        self._apply(domain_id, self._features[(domain_id, feature_id)], old_status)
+                    self._summary["last_updated"] = last_updated
+                    raise
+            self.version += 1
+            for event in events:
+                event["summary"]["last_updated"] = self._summary["last_updated"]
+                event["version"] = self.version
+            self.feed.publish(events)
+            return True, results
+
+    def _change_event(self, result):
+        """Describes an applied change, with the counters right after it."""
+        domain = self._domains[result["domain_id"]]
+        return {
+            "domain_id": result["domain_id"],
+            "feature_id": result["feature_id"],
+            "old_status": result["old_status"],
+            "new_status": result["new_status"],
+            "domain": {key: domain[key] for key, _ in STATUS_COUNTERS.values()},
+            "summary": {key: self._summary[key] for _, key in STATUS_COUNTERS.values()},
+        }
+
+    def _validate(self, update):
+        """Returns the result entry of one update: its key, or an error."""
+        if not isinstance(update, dict):
+            return {"error": "Each update must be an object with domain_id, feature_id and status"}
+        result = {"domain_id": update.get("domain_id"), "feature_id": update.get("feature_id"),
+                  "new_status": update.get("status")}
+        if not result["domain_id"] or not result["feature_id"] or not result["new_status"]:
+            result["error"] = "domain_id, feature_id and status are required"
+        elif result["new_status"] not in STATUS_COUNTERS:
+            result["error"] = f"Unknown status '{result['new_status']}'"
+        elif (result["domain_id"], result["feature_id"]) not in self._features:
+            result["error"] = "Feature or domain not found"
+        return result
+
+    def _apply(self, domain_id, feature, new_status):
+        """Changes a feature's status and adjusts the counters; call with the lock held."""
+        domain = self._domains[domain_id]
+        old_counters = STATUS_COUNTERS.get(feature["status"])
+        if old_counters:
+            domain[old_counters[0]] -= 1
+            self._summary[old_counters[1]] -= 1
+        new_counters = STATUS_COUNTERS.get(new_status)
+        if new_counters:
+            domain[new_counters[0]] += 1
+            self._summary[new_counters[1]] += 1
+        feature["status"] = new_status
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
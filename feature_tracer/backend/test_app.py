@@ -14,6 +14,46 @@ class FeatureTracerTestCase(unittest.TestCase):
         self.assertIn('summary', data)
         self.assertIn('domains', data)
 
+    def test_get_features_summary_only(self):
+        response = self.app.get('/api/features?fields=summary')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(list(data), ['summary'])
+
+    def test_get_features_filters_and_pages(self):
+        response = self.app.get('/api/features?fields=domains,features&status=进行中&domain=memory-management')
+        data = json.loads(response.data)
+        self.assertEqual([d['id'] for d in data['domains']], ['memory-management'])
+        self.assertTrue(data['domains'][0]['features'])
+        self.assertTrue(all(f['status'] == '进行中' for f in data['domains'][0]['features']))
+
+        response = self.app.get('/api/features?fields=domains&page=2&per_page=4')
+        data = json.loads(response.data)
+        self.assertEqual(data['pagination'], {'page': 2, 'per_page': 4, 'total_domains': 6, 'total_pages': 2})
+        self.assertEqual(len(data['domains']), 2)
+        self.assertNotIn('features', data['domains'][0])
+
+    def test_get_features_bad_query(self):
+        for query in ('fields=everything', 'status=done', 'page=0&per_page=10', 'per_page=x'):
+            response = self.app.get(f'/api/features?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_get_features_not_modified_until_data_changes(self):
+        response = self.app.get('/api/features?fields=summary')
+        etag = response.headers['ETag']
+        response = self.app.get('/api/features?fields=summary', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        other = self.app.get('/api/features?fields=domains').headers['ETag']
+        self.assertNotEqual(other, etag)
+
+        for status in ('未开始', '进行中'):
+            self.app.put('/api/features/memory-management/memory-compression',
+                         data=json.dumps({'status': status}), content_type='application/json')
+        response = self.app.get('/api/features?fields=summary', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
     def test_get_domain_by_id(self):
         response = self.app.get('/api/features/memory-management')
         self.assertEqual(response.status_code, 200)
@@ -60,5 +100,95 @@ class FeatureTracerTestCase(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data['error'], 'New status not provided')
 
+    def test_update_feature_unknown_status(self):
+        payload = {'status': 'done'}
+        response = self.app.put('/api/features/memory-management/virtual-memory',
+                                data=json.dumps(payload),
+                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertIn('Unknown status', data['error'])
+
+    def test_bulk_update(self):
+        updates = [
+            {'domain_id': 'memory-management', 'feature_id': 'memory-hotplug', 'status': '进行中'},
+            {'domain_id': 'memory-management', 'feature_id': 'memory-hotplug', 'status': '未开始'},
+            {'domain_id': 'memory-management', 'feature_id': 'virtual-memory', 'status': '已完成'},
+        ]
+        before = json.loads(self.app.get('/api/features?fields=summary').data)['summary']
+        response = self.app.post('/api/features/bulk', data=json.dumps({'updates': updates}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([r['changed'] for r in data['results']], [True, True, False])
+        self.assertEqual(data['results'][1]['old_status'], '进行中')
+        after = json.loads(self.app.get('/api/features?fields=summary').data)['summary']
+        self.assertEqual(after['not_started_features'], before['not_started_features'])
+
+    def test_bulk_update_is_all_or_nothing(self):
+        updates = [
+            {'domain_id': 'memory-management', 'feature_id': 'memory-protection', 'status': '已完成'},
+            {'domain_id': 'memory-management', 'feature_id': 'missing', 'status': '已完成'},
+            {'domain_id': 'memory-management', 'feature_id': 'memory-protection', 'status': 'done'},
+        ]
+        response = self.app.post('/api/features/bulk', data=json.dumps({'updates': updates}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        results = json.loads(response.data)['results']
+        self.assertNotIn('error', results[0])
+        self.assertEqual(results[1]['error'], 'Feature or domain not found')
+        self.assertIn('Unknown status', results[2]['error'])
+
+        domain = json.loads(self.app.get('/api/features/memory-management').data)
+        feature = next(f for f in domain['features'] if f['id'] == 'memory-protection')
+        self.assertEqual(feature['status'], '进行中')
+
+        response = self.app.post('/api/features/bulk', data=json.dumps({'updates': []}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+    def read_events(self, response, count):
+        """Reads `count` Server-Sent Events from a streaming response."""
+        events = []
+        chunks = iter(response.response)
+        while len(events) < count:
+            chunk = next(chunks)
+            chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+            if chunk.startswith(':'):
+                continue
+            fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+            events.append((fields['id'], fields['event'], json.loads(fields['data'])))
+        return events
+
+    def test_change_feed_sends_snapshot_then_changes(self):
+        response = self.app.get('/api/features/changes', buffered=False)
+        self.addCleanup(response.close)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        [(snapshot_id, name, snapshot)] = self.read_events(response, 1)
+        self.assertEqual(name, 'snapshot')
+        self.assertIn('domains', snapshot)
+
+        current = next(f for f in snapshot['domains'][0]['features'] if f['id'] == 'memory-compression')
+        status = '已完成' if current['status'] == '进行中' else '进行中'
+        updates = [{'domain_id': 'memory-management', 'feature_id': 'memory-compression', 'status': status}]
+        self.app.post('/api/features/bulk', data=json.dumps({'updates': updates}),
+                      content_type='application/json')
+        [(change_id, name, change)] = self.read_events(response, 1)
+        self.assertEqual(name, 'change')
+        self.assertEqual((change['domain_id'], change['feature_id'], change['new_status']),
+                         ('memory-management', 'memory-compression', status))
+        self.assertIn('completed_features', change['summary'])
+
+        # Resuming from the snapshot replays the change instead of a new snapshot.
+        resumed = self.app.get('/api/features/changes', headers={'Last-Event-ID': snapshot_id},
+                               buffered=False)
+        self.addCleanup(resumed.close)
+        self.assertEqual(self.read_events(resumed, 1), [(change_id, 'change', change)])
+
+    def test_change_feed_unknown_position_gets_snapshot(self):
+        response = self.app.get('/api/features/changes?since=stale-42', buffered=False)
+        self.addCleanup(response.close)
+        [(_, name, _)] = self.read_events(response, 1)
+        self.assertEqual(name, 'snapshot')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from data import data
+from store import FeatureStore
+
+
+class FeatureStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = FeatureStore(data)
+
+    def test_status_changes_move_counters(self):
+        self.assertTrue(self.store.update_status('memory-management', 'memory-hotplug', '进行中'))
+        domain = self.store.get_domain('memory-management')
+        self.assertEqual((domain['in_progress'], domain['not_started']), (66, 26))
+        summary = self.store.snapshot()['summary']
+        self.assertEqual((summary['in_progress_features'], summary['not_started_features']), (751, 299))
+        self.assertEqual(self.store.get_feature('memory-management', 'memory-hotplug')['status'], '进行中')
+
+        # Setting the same status again changes nothing.
+        self.store.update_status('memory-management', 'memory-hotplug', '进行中')
+        self.assertEqual(self.store.get_domain('memory-management')['in_progress'], 66)
+
+    def test_unknown_features_and_statuses(self):
+        self.assertFalse(self.store.update_status('memory-management', 'missing', '已完成'))
+        self.assertFalse(self.store.update_status('file-system', 'anything', '已完成'))
+        with self.assertRaises(ValueError):
+            self.store.update_status('memory-management', 'virtual-memory', 'done')
+        self.assertIsNone(self.store.get_domain('missing'))
+
+    def test_concurrent_batches_keep_counters_consistent(self):
+        features = [('memory-management', f['id']) for f in data['domains'][0]['features']]
+
+        def flip(status):
+            for _ in range(200):
+                self.store.update_statuses([{'domain_id': d, 'feature_id': f, 'status': status}
+                                            for d, f in features])
+
+        threads = [threading.Thread(target=flip, args=(status,)) for status in ('已完成', '未开始', '进行中')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        domain = self.store.get_domain('memory-management')
+        self.assertEqual(domain['completed'] + domain['in_progress'] + domain['not_started'], 420)
+        listed = {}
+        for feature in domain['features']:
+            listed[feature['status']] = listed.get(feature['status'], 0) + 1
+        self.assertEqual(len(listed), 1, 'each batch must be applied as a whole')
+
+    def test_copies_do_not_leak_into_the_store(self):
+        domain = self.store.get_domain('memory-management')
+        domain['features'][0]['status'] = '未开始'
+        self.assertEqual(self.store.get_feature('memory-management', 'virtual-memory')['status'], '已完成')
+
+    def test_changes_are_published_with_counters(self):
+        seq, snapshot = self.store.snapshot_with_seq()
+        self.store.update_statuses([
+            {'domain_id': 'memory-management', 'feature_id': 'memory-hotplug', 'status': '进行中'},
+            {'domain_id': 'memory-management', 'feature_id': 'virtual-memory', 'status': '已完成'},
+            {'domain_id': 'memory-management', 'feature_id': 'memory-hotplug', 'status': '已完成'},
+        ])
+        events, complete = self.store.feed.since(seq)
+        self.assertTrue(complete)
+        self.assertEqual([s for s, _ in events], [seq + 1, seq + 2])
+        first, second = (change for _, change in events)
+        self.assertEqual((first['old_status'], first['new_status']), ('未开始', '进行中'))
+        self.assertEqual(first['domain'], {'completed': 328, 'in_progress': 66, 'not_started': 26})
+        self.assertEqual(second['domain'], {'completed': 329, 'in_progress': 65, 'not_started': 26})
+        self.assertEqual(second['summary']['completed_features'], snapshot['summary']['completed_features'] + 1)
+        self.assertEqual(second['version'], self.store.version)
+
+    def test_feed_keeps_a_bounded_backlog(self):
+        store = FeatureStore(data, backlog=2)
+        for status in ('进行中', '已完成', '未开始'):
+            store.update_status('memory-management', 'memory-hotplug', status)
+        self.assertEqual(store.feed.last_seq, 3)
+        self.assertEqual(store.feed.since(0), ([], False))
+        self.assertEqual([s for s, _ in store.feed.since(1)[0]], [2, 3])
+        self.assertEqual(store.feed.since(3), ([], True))
+        self.assertEqual(store.feed.since(4), ([], False))
+        self.assertEqual(store.feed.wait(3, timeout=0), ([], True))
+
+    def test_sqlite_persists_changes(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'features.sqlite3')
+        store = FeatureStore(data, db_path=path)
+        store.update_status('memory-management', 'virtual-memory', '进行中')
+        store.close()
+
+        reopened = FeatureStore({'summary': {}, 'domains': []}, db_path=path)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.snapshot(), store.snapshot())
+        self.assertEqual(reopened.get_feature('memory-management', 'virtual-memory')['status'], '进行中')
+        self.assertEqual(reopened.get_domain('memory-management')['completed'], 327)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Profiles this host and pushes the folded stacks to a central analyzer.
+
+    python -m modules.perf_analyzer.agent --server http://analyzer:5001 --service checkout
+    python -m modules.perf_analyzer.agent --server http://analyzer:5001 --service batch -- ./job --fast
+
+Without a command, every CPU is sampled for `--duration` seconds. With
+`--interval`, the agent keeps profiling and pushing until interrupted.
+"""
+import argparse
+import gzip
+import io
+import json
+import socket
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from .analyzer import PerfAnalyzer
+from .collapse import PERF_SCRIPT_ENCODING, PERF_SCRIPT_ERRORS
+
+PUSH_TIMEOUT = 60
+
+
+def push_profile(server, service, host, collapser, timestamp):
+    """
+    Uploads folded stacks to an analyzer's ingestion endpoint, gzip-compressed.
+
+    Args:
+        server (str): The analyzer's base URL.
+        collapser (StackCollapser): The folded stacks to push.
+        timestamp (float): When the profile was captured.
+
+    Returns:
+        dict: The server's response, or an error dictionary.
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as compressed:
+        text = io.TextIOWrapper(compressed, encoding=PERF_SCRIPT_ENCODING, errors=PERF_SCRIPT_ERRORS)
+        collapser.write(text)
+        text.flush()
+        text.detach()
+
+    query = urllib.parse.urlencode({'service': service, 'host': host, 'time': f"{timestamp:.3f}"})
+    request = urllib.request.Request(
+        f"{server.rstrip('/')}/perf/ingest?{query}",
+        data=buffer.getvalue(),
+        headers={'Content-Type': 'text/plain', 'Content-Encoding': 'gzip', 'Accept': 'application/json'},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=PUSH_TIMEOUT) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return {"error": f"Server rejected the profile ({e.code}): {e.read().decode('utf-8', 'replace')}"}
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        return {"error": f"Could not push the profile: {e}"}
+
+
+def profile_once(perf_analyzer, args):
+    """Records one profile with `collect_data`, folds it and pushes it."""
+    run_id = perf_analyzer.new_run()
+    try:
+        timestamp = time.time()
+        perf_data_path = perf_analyzer.collect_data(
+            args.command, duration=args.duration, freq=args.freq, run_id=run_id, system_wide=not args.command
+        )
+        if not perf_data_path:
+            return {"error": "Failed to collect performance data."}
+        collapser = perf_analyzer.collapse_perf_data(perf_data_path)
+        if not collapser.samples:
+            return {"error": "The profile has no samples."}
+        return push_profile(args.server, args.service, args.host, collapser, timestamp)
+    finally:
+        perf_analyzer.finish_run(run_id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--server', required=True, help="Base URL of the analyzer, e.g. http://analyzer:5001")
+    parser.add_argument('--service', required=True, help="Service the profiles belong to")
+    parser.add_argument('--host', default=socket.gethostname(), help="Host name to tag profiles with")
+    parser.add_argument('--duration', type=int, default=10, help="Seconds to profile each time")
+    parser.add_argument('--freq', type=int, default=99, help="Sampling frequency in Hz")
+    parser.add_argument('--interval', type=int, default=0,
+                        help="Seconds between the starts of profiles; 0 profiles once")
+    parser.add_argument('--output-dir', default='perf_data', help="Scratch directory for perf.data files")
+    parser.add_argument('command', nargs=argparse.REMAINDER, help="Command to profile instead of the whole host")
+    args = parser.parse_args(argv)
+    if args.command[:1] == ['--']:
+        args.command = args.command[1:]
+
+    perf_analyzer = PerfAnalyzer(output_dir=args.output_dir)
+    while True:
+        started = time.time()
+        result = profile_once(perf_analyzer, args)
+        failed = 'error' in result
+        if failed:
+            print(f"Error: {result['error']}")
+        else:
+            print(f"Pushed {result['samples']} samples for {args.service} from {args.host}.")
+        if not args.interval:
+            return 1 if failed else 0
+        try:
+            time.sleep(max(0, args.interval - (time.time() - started)))
+        except KeyboardInterrupt:
+            return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,7 +1,78 @@
+import collections
+import contextlib
+import shutil
 import subprocess
 import os
+import io
+import json
+import queue
+import threading
+import time
 from core import llm_analyzer
 from core import prompts
+from core.json_stream import JSONArrayStreamParser
+from core.config import settings
+from core.metrics import Span, current_timeline
+from .collapse import PERF_SCRIPT_ENCODING, PERF_SCRIPT_ERRORS, PERF_MAP_DIR
+from .flamegraph import FlameGraphRenderer
+from .artifacts import ArtifactStore, PERF_DATA_NAME, FOLDED_NAME, FLAMEGRAPH_NAME, PROFILE_NAME, PERF_MAPS_NAME, \
+    ANALYSIS_NAME, TREE_INDEX_NAME, COUNTERS_NAME
+from .profile import Profile
+from .tree_index import TreeIndex
+from .summarize import summarize_profile, prompt_token_budget
+from .diff import ProfileDiff, DiffFlameGraphRenderer, summarize_diff
+from .modes import DEFAULT_MODE, get_mode
+from .detect import detect_bottlenecks
+
+
+def _timeout_reason():
+    return f"The AI analysis did not finish within {settings.PERF_LLM_TIMEOUT} seconds."
+
+
+def _iter_with_timeout(iterable, timeout, call=False):
+    """
+    Yields the items of `iterable`, produced on a helper thread, and raises
+    TimeoutError once `timeout` seconds have passed in total. The helper
+    thread is abandoned then and finishes in the background.
+
+    Args:
+        iterable: The items, e.g. LLM response chunks.
+        timeout (float): Seconds to wait for all of them; 0 waits indefinitely.
+        call (bool): The items are functions; yield their results instead.
+    """
+    if not timeout:
+        for item in iterable:
+            yield item() if call else item
+        return
+
+    items = queue.Queue()
+    timeline = current_timeline()
+
+    def produce():
+        # Spans recorded on this thread still belong to the caller's run.
+        with timeline.activate() if timeline else contextlib.nullcontext():
+            try:
+                for item in iterable:
+                    items.put((True, item() if call else item))
+            except BaseException as e:
+                items.put((False, e))
+                return
+            items.put((False, None))
+
+    threading.Thread(target=produce, name='perf-llm', daemon=True).start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            ok, item = items.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            raise TimeoutError from None
+        if ok:
+            yield item
+        elif item is None:
+            return
+        else:
+            raise item
+
 
 class PerfAnalyzer:
     def __init__(self, output_dir='perf_data'):
@@ -9,13 +80,108 @@ class PerfAnalyzer:
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-        # Store the path to the FlameGraph scripts
-        self.flamegraph_dir = os.path.expanduser('~/FlameGraph')
+        # Every run gets its own directory; derived artifacts are shared
+        # between runs with identical folded stacks.
+        self.store = ArtifactStore(self.output_dir)
+
+        # Open tree indexes by digest, least recently used first
+        self._tree_indexes = collections.OrderedDict()
+        self._tree_lock = threading.Lock()
 
         # LLM client is now managed by core.llm_analyzer
         # No need to manage API keys here.
 
-    def collect_data(self, command, duration=10, freq=99):
+    def new_run(self):
+        """Creates an isolated artifact directory for one analysis run."""
+        return self.store.create_run()
+
+    def finish_run(self, run_id):
+        """Marks a run as finished and enforces the store's retention budget."""
+        self.store.release(run_id)
+        self.store.evict()
+
+    def folded_stacks_path(self, run_id):
+        """Returns the path of a run's folded stacks file, or None."""
+        return self.store.artifact_path(run_id, FOLDED_NAME)
+
+    def save_analysis(self, run_id, analysis):
+        """Stores a run's final analysis, for the artifact endpoint."""
+        try:
+            self.store.write_run_json(run_id, ANALYSIS_NAME, analysis)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            print(f"Warning: could not save the analysis of run {run_id}: {e}")
+
+    @staticmethod
+    def load_counters(folded_stacks_path):
+        """
+        Returns the cycles and instructions per function stored next to a
+        folded stacks file by an IPC capture, or None for other profiles.
+        """
+        counters_path = os.path.join(os.path.dirname(folded_stacks_path), COUNTERS_NAME)
+        try:
+            with open(counters_path, encoding='utf-8', errors='surrogateescape') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def load_profile(self, folded_stacks_path):
+        """
+        Loads the call tree for a folded stacks file, preferring the compact
+        profile stored next to it over re-parsing the text.
+
+        Args:
+            folded_stacks_path (str): The path to the folded stacks file.
+
+        Returns:
+            Profile: The call tree.
+        """
+        profile_path = os.path.join(os.path.dirname(folded_stacks_path), PROFILE_NAME)
+        if os.path.exists(profile_path):
+            return Profile.load(profile_path)
+        with open(folded_stacks_path, 'r', encoding=PERF_SCRIPT_ENCODING, errors=PERF_SCRIPT_ERRORS) as f:
+            return Profile.from_folded(f)
+
+    def tree_index(self, run_id):
+        """
+        Returns the call tree index of a run, for serving its tree piece by
+        piece. Indexes are memory-mapped once and kept open; runs rendered
+        before indexes existed get theirs built on first use.
+
+        Args:
+            run_id (str): The run.
+
+        Returns:
+            TreeIndex: The index, or None if the run has no profile.
+        """
+        digest = self.store.get_digest(run_id)
+        if not digest:
+            return None
+        with self._tree_lock:
+            index = self._tree_indexes.get(digest)
+            if index is not None:
+                self._tree_indexes.move_to_end(digest)
+                return index
+
+        path = self.store.artifact_path(run_id, TREE_INDEX_NAME)
+        try:
+            if not os.path.exists(path):
+                with Span('index') as span:
+                    profile = self.load_profile(self.store.object_path(digest, FOLDED_NAME))
+                    self.store.write_object(digest, TREE_INDEX_NAME, lambda f: f.write(TreeIndex.build(profile)),
+                                            mode='wb')
+                    span.set(samples=profile.total, bytes_out=os.path.getsize(path))
+            index = TreeIndex.open(path)
+        except (IOError, OSError, ValueError) as e:
+            print(f"Error opening the tree index of run {run_id}: {e}")
+            return None
+
+        with self._tree_lock:
+            self._tree_indexes[digest] = index
+            while len(self._tree_indexes) > settings.PERF_TREE_CACHE_SIZE:
+                self._tree_indexes.popitem(last=False)
+        return index
+
+    def collect_data(self, command, duration=10, freq=99, run_id=None, system_wide=False, mode=DEFAULT_MODE):
         """
         Collects performance data using 'perf record'.
 
@@ -23,109 +189,123 @@ class PerfAnalyzer:
             command (list): The command to profile, as a list of strings.
             duration (int): The duration of the profiling in seconds.
             freq (int): The sampling frequency.
+            run_id (str): The run to record into. A new run is created if
+                not given.
+            system_wide (bool): Sample every CPU (`perf record -a`) instead
+                of only the command.
+            mode (str): What to record: 'cpu', 'python', 'offcpu',
+                'sched-latency', a hardware counter such as 'cache-misses', or
+                'ipc' for cycles with instructions per cycle. See `modes.MODES`.
 
         Returns:
             str: The path to the generated perf.data file, or None on error.
         """
-        output_file = os.path.join(self.output_dir, 'perf.data')
-        perf_command = [
-            'sudo', 'perf', 'record',
-            '-F', str(freq),
+        profiling_mode = get_mode(mode)
+        if profiling_mode is None:
+            print(f"Error: unknown profiling mode '{mode}'.")
+            return None
+
+        run_id = run_id or self.new_run()
+        output_file = self.store.artifact_path(run_id, PERF_DATA_NAME)
+        record_args = profiling_mode.record_args(freq)
+        if system_wide and '-a' not in record_args:
+            record_args.insert(0, '-a')
+        perf_command = ['sudo', 'perf', 'record'] + record_args + [
             '-o', output_file,
-            '-g', '--',
+            '--',
             'sleep', str(duration) # Default to sleeping if no command
         ]
 
         # If a real command is provided, profile it instead of sleep
         if command:
-            perf_command = [
-                'sudo', 'perf', 'record',
-                '-F', str(freq),
-                '-o', output_file,
-                '-g', '--'
-            ] + command
+            perf_command = perf_command[:-2] + profiling_mode.wrap_command(command)
+        elif profiling_mode.python:
+            print("Note: only Python processes started with PYTHONPERFSUPPORT=1 or `-X perf` show Python function names.")
 
-        try:
-            print(f"Running perf command: {' '.join(perf_command)}")
-            # Note: This requires the user to have sudo privileges without a password prompt
-            # for the 'perf' command, or the password must be entered manually.
-            # In a web app, this is a significant security consideration.
-            subprocess.run(perf_command, check=True, timeout=duration + 5)
-
-            if os.path.exists(output_file):
-                print(f"Perf data collected successfully: {output_file}")
-                return output_file
-            else:
-                print("Error: perf.data file was not created.")
+        with Span('collect', mode=mode) as span:
+            try:
+                print(f"Running perf command: {' '.join(perf_command)}")
+                # Note: This requires the user to have sudo privileges without a password prompt
+                # for the 'perf' command, or the password must be entered manually.
+                # In a web app, this is a significant security consideration.
+                subprocess.run(perf_command, check=True, timeout=duration + 5)
+
+                if os.path.exists(output_file):
+                    print(f"Perf data collected successfully: {output_file}")
+                    span.set(bytes_out=os.path.getsize(output_file))
+                    return output_file
+                else:
+                    print("Error: perf.data file was not created.")
+                    span.fail("perf.data file was not created")
+                    return None
+            except FileNotFoundError:
+                print("Error: 'perf' command not found. Please ensure it is installed and in your PATH.")
+                span.fail("perf command not found")
                 return None
-        except FileNotFoundError:
-            print("Error: 'perf' command not found. Please ensure it is installed and in your PATH.")
-            return None
-        except subprocess.CalledProcessError as e:
-            print(f"Error executing perf command: {e}")
-            return None
-        except subprocess.TimeoutExpired:
-            print("Error: perf command timed out.")
-            return None
+            except subprocess.CalledProcessError as e:
+                print(f"Error executing perf command: {e}")
+                span.fail(e)
+                return None
+            except subprocess.TimeoutExpired:
+                print("Error: perf command timed out.")
+                span.fail("perf command timed out")
+                return None
+
 
-    def _check_flamegraph_scripts(self):
-        """Checks if the required FlameGraph scripts exist."""
-        required_scripts = ['stackcollapse-perf.pl', 'flamegraph.pl']
-        for script in required_scripts:
-            if not os.path.exists(os.path.join(self.flamegraph_dir, script)):
-                print(f"Error: FlameGraph script not found: {script}")
-                print(f"Please clone Brendan Gregg's FlameGraph repository into {self.flamegraph_dir}")
-                print("git clone https://github.com/brendangregg/FlameGraph.git ~/FlameGraph")
-                return False
-        return True
+    def _keep_perf_maps(self, run_id, pids):
+        """
+        Copies the perf map files of the processes in a capture into its run,
+        so their Python frames can still be symbolized once /tmp has been
+        cleaned up or a pid has been reused. Maps of other processes are left
+        alone.
+
+        Args:
+            run_id (str): The run the capture belongs to.
+            pids (collection): The pids whose JIT frames appear in the capture.
+        """
+        maps_dir = self.store.artifact_path(run_id, PERF_MAPS_NAME)
+        for pid in sorted(pids):
+            name = f'perf-{pid}.map'
+            path = os.path.join(PERF_MAP_DIR, name)
+            if os.path.exists(os.path.join(maps_dir, name)) or not os.path.exists(path):
+                continue
+            try:
+                os.makedirs(maps_dir, exist_ok=True)
+                shutil.copy(path, maps_dir)
+            except (IOError, OSError) as e:
+                print(f"Warning: could not keep perf map {path}: {e}")
 
-    def generate_flamegraph(self, perf_data_path):
+    def generate_flamegraph(self, perf_data_path, run_id=None, mode=DEFAULT_MODE):
         """
         Generates a flame graph from a perf.data file.
 
+        The folded stacks and the SVG are stored under the digest of the
+        folded stacks, so a capture identical to an earlier one reuses the
+        flame graph that was already rendered for it.
+
         Args:
             perf_data_path (str): The path to the perf.data file.
+            run_id (str): The run the capture belongs to. Defaults to the run
+                that owns `perf_data_path`, or a new run for outside files.
+            mode (str): The profiling mode the capture was recorded in.
 
         Returns:
             str: The path to the generated SVG file, or None on error.
         """
-        if not self._check_flamegraph_scripts():
-            return None
-
         if not os.path.exists(perf_data_path):
             print(f"Error: perf data file not found at {perf_data_path}")
             return None
 
-        # Define file paths for intermediate and final outputs
-        folded_stacks_path = os.path.join(self.output_dir, 'out.perf-folded')
-        flamegraph_svg_path = os.path.join(self.output_dir, 'flamegraph.svg')
+        run_id = run_id or self.store.run_for_path(perf_data_path) or self.new_run()
 
         try:
-            # 1. perf script
-            perf_script_cmd = ['sudo', 'perf', 'script', '-i', perf_data_path]
-            with open(os.path.join(self.output_dir, 'out.perfscript'), 'w') as f:
-                subprocess.run(perf_script_cmd, stdout=f, check=True)
-
-            # 2. Stack collapse
-            stackcollapse_cmd = [
-                os.path.join(self.flamegraph_dir, 'stackcollapse-perf.pl'),
-                os.path.join(self.output_dir, 'out.perfscript')
-            ]
-            with open(folded_stacks_path, 'w') as f:
-                subprocess.run(stackcollapse_cmd, stdout=f, check=True, text=True)
-
-            # 3. Flamegraph generation
-            flamegraph_cmd = [
-                os.path.join(self.flamegraph_dir, 'flamegraph.pl'),
-                '--color=hot',
-                '--title="CPU Flame Graph"',
-                folded_stacks_path
-            ]
-            with open(flamegraph_svg_path, 'w') as f:
-                subprocess.run(flamegraph_cmd, stdout=f, check=True, text=True)
-
-            print(f"Flame graph generated successfully: {flamegraph_svg_path}")
-            return flamegraph_svg_path
+            # 1. perf script, folded in-process as it streams out of the pipe
+            collapser = self.collapse_perf_data(perf_data_path, mode)
+            print(f"Collapsed {collapser.samples} samples into {len(collapser.stacks)} unique stacks.")
+
+            # 2. Store the folded stacks and render them, unless this profile was rendered before
+            return self._store_and_render(run_id, collapser.write, lambda: Profile.from_stacks(collapser.stacks), mode,
+                                          counters=getattr(collapser, 'functions', None))
 
         except subprocess.CalledProcessError as e:
             print(f"Error during flame graph generation step: {e}")
@@ -135,45 +315,244 @@ class PerfAnalyzer:
             print(f"An unexpected error occurred: {e}")
             return None
 
-    def analyze_with_llm(self, folded_stacks_path):
+    def generate_flamegraph_from_profile(self, profile, run_id=None, mode=DEFAULT_MODE, counters=None):
+        """
+        Stores an already built profile in a run, e.g. one merged from many
+        captures, and renders its flame graph.
+
+        Args:
+            profile (Profile): The call tree.
+            run_id (str): The run to store it in. A new run is created if not given.
+            mode (str): The profiling mode the profile was recorded in.
+            counters (dict): Cycles and instructions per function, for 'ipc'.
+
+        Returns:
+            str: The path to the generated SVG file, or None on error.
+        """
+        run_id = run_id or self.new_run()
+        try:
+            return self._store_and_render(run_id, profile.write_folded, lambda: profile, mode, counters=counters)
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+            return None
+
+    def _store_and_render(self, run_id, write_folded, build_profile, mode=DEFAULT_MODE, counters=None):
+        """
+        Stores a run's folded stacks under their content digest, then writes
+        the compact profile and the SVG next to them.
+
+        Args:
+            write_folded (callable): Writes the folded stacks to a text file object.
+            build_profile (callable): Returns the Profile; only called if the
+                digest has not been rendered before.
+            mode (str): The profiling mode, which sets the graph's title,
+                palette and unit.
+            counters (dict): Cycles and instructions per function, from an
+                IPC capture, stored next to the folded stacks.
+
+        Returns:
+            str: The path to the SVG file.
+        """
+        with Span('store') as span:
+            digest, reused = self.store.store_folded(
+                run_id, write_folded, encoding=PERF_SCRIPT_ENCODING, errors=PERF_SCRIPT_ERRORS
+            )
+            span.set(bytes_out=os.path.getsize(self.store.object_path(digest, FOLDED_NAME)), reused=reused)
+            if counters:
+                self.store.write_object(digest, COUNTERS_NAME, lambda f: json.dump(counters, f),
+                                        encoding='utf-8', errors='surrogateescape')
+
+        flamegraph_svg_path = self.store.object_path(digest, FLAMEGRAPH_NAME)
+        profile_path = self.store.object_path(digest, PROFILE_NAME)
+        tree_index_path = self.store.object_path(digest, TREE_INDEX_NAME)
+        if reused and all(os.path.exists(p) for p in (flamegraph_svg_path, profile_path, tree_index_path)):
+            print(f"Reusing flame graph of identical profile {digest[:12]}.")
+            return flamegraph_svg_path
+
+        with Span('render', mode=mode) as span:
+            # Build the call tree once; every later consumer queries it.
+            profile = build_profile()
+            self.store.write_object(digest, PROFILE_NAME, lambda f: f.write(profile.to_bytes()), mode='wb')
+            self.store.write_object(digest, TREE_INDEX_NAME, lambda f: f.write(TreeIndex.build(profile)), mode='wb')
+
+            profiling_mode = get_mode(mode)
+            renderer = FlameGraphRenderer(title=profiling_mode.title, color=profiling_mode.color,
+                                          unit=profiling_mode.unit)
+            svg = renderer.render(profile)
+            self.store.write_object(digest, FLAMEGRAPH_NAME, lambda f: f.write(svg),
+                                    encoding='utf-8', errors='surrogateescape')
+            # Compressed once here, instead of on every report view
+            self.store.precompress(flamegraph_svg_path)
+            span.set(samples=profile.total, frames=renderer.stats['frames'], bytes_out=renderer.stats['bytes'])
+        print(f"Rendered {renderer.stats['frames']} frames "
+              f"({renderer.stats['pruned_frames']} pruned, {renderer.stats['bytes']} bytes).")
+
+        print(f"Flame graph generated successfully: {flamegraph_svg_path}")
+        return flamegraph_svg_path
+
+    def collapse_perf_data(self, perf_data_path, mode=DEFAULT_MODE):
+        """
+        Runs 'perf script' and folds its output on the fly, without writing
+        the (potentially multi-GB) text output to disk.
+
+        Args:
+            perf_data_path (str): The path to the perf.data file.
+            mode (str): The profiling mode, which decides how samples are
+                weighted, e.g. by blocked time for off-CPU captures.
+
+        Returns:
+            StackCollapser: The collapser holding the aggregated stacks.
+        """
+        perf_script_cmd = ['sudo', 'perf', 'script', '-i', perf_data_path]
+        # Python frames: the run's copies of the perf maps first, then /tmp
+        perf_map_dirs = [PERF_MAP_DIR]
+        run_id = self.store.run_for_path(perf_data_path)
+        if run_id:
+            perf_map_dirs.insert(0, self.store.artifact_path(run_id, PERF_MAPS_NAME))
+        collapser = get_mode(mode).collapser(perf_map_dirs)
+        with Span('collapse', mode=mode, bytes_in=os.path.getsize(perf_data_path)) as span:
+            process = subprocess.Popen(perf_script_cmd, stdout=subprocess.PIPE)
+            try:
+                stream = io.TextIOWrapper(process.stdout, encoding=PERF_SCRIPT_ENCODING,
+                                          errors=PERF_SCRIPT_ERRORS, newline='\n')
+                collapser.feed_lines(stream)
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, perf_script_cmd)
+            span.set(samples=collapser.samples, stacks=len(collapser.stacks))
+        if run_id and getattr(collapser, 'perf_map_pids', None):
+            self._keep_perf_maps(run_id, collapser.perf_map_pids)
+        return collapser
+
+    def _analysis_prompt(self, folded_stacks_path, mode=DEFAULT_MODE):
+        """
+        Builds the bottleneck analysis prompt for a profile, stating what its
+        weights measure in the given profiling mode. The locally detected
+        bottlenecks are included as pre-computed facts.
+
+        Returns:
+            tuple: (prompt, ProfileSummary, Detection), or (None, summary,
+                detection) if the profile is empty.
+        """
+        profile = self.load_profile(folded_stacks_path)
+        profiling_mode = get_mode(mode)
+        detection = self._detect(profile, mode)
+
+        with Span('prompt', mode=mode) as span:
+            # Rank stacks by samples and fit them into the prompt's token budget
+            budget = prompt_token_budget(prompts.PERF_ANALYSIS_JSON_PROMPT, prompts.PERF_ANALYSIS_SYSTEM_PROMPT,
+                                         detection.facts())
+            summary = summarize_profile(profile, token_budget=budget, unit=profiling_mode.unit,
+                                        counters=self.load_counters(folded_stacks_path))
+            span.set(samples=profile.total, bytes_in=os.path.getsize(folded_stacks_path))
+            if not summary.text:
+                return None, summary, detection
+
+            # Use the centralized prompt from core.prompts
+            prompt = prompts.PERF_ANALYSIS_JSON_PROMPT.format(
+                profile_type=f"{profiling_mode.label}. {profiling_mode.description}", data=summary.text,
+                findings=detection.facts(summary.common_prefix)
+            )
+            span.set(bytes_out=len(prompt))
+            return prompt, summary, detection
+
+    @staticmethod
+    def _detect(profile, mode=DEFAULT_MODE):
+        with Span('detect', mode=mode, samples=profile.total) as span:
+            detection = detect_bottlenecks(profile, unit=get_mode(mode).unit)
+            span.set(findings=len(detection.findings))
+        return detection
+
+    def local_analysis(self, folded_stacks_path, mode=DEFAULT_MODE):
+        """
+        Analyzes the folded stacks without the LLM, by detecting common
+        bottleneck patterns with exact percentages.
+
+        Args:
+            folded_stacks_path (str): The path to the folded stacks file.
+            mode (str): The profiling mode the stacks were recorded in.
+
+        Returns:
+            dict: The analysis in the same schema as analyze_with_llm's, or
+                an error dictionary.
+        """
+        try:
+            profile = self.load_profile(folded_stacks_path)
+            if not profile.total:
+                return {"error": "The folded stacks file is empty."}
+            return self._detect(profile, mode).to_analysis()
+        except FileNotFoundError:
+            return {"error": f"Folded stacks file not found at {folded_stacks_path}"}
+        except Exception as e:
+            print(f"An error occurred during local analysis: {e}")
+            return {"error": f"An unexpected error occurred during local analysis: {e}"}
+
+    @staticmethod
+    def _restore_bottleneck(bottleneck, summary):
+        # Stacks are quoted without the common prefix; restore it so the
+        # report can match them against the flame graph.
+        if isinstance(bottleneck, dict) and isinstance(bottleneck.get("function_stack"), str):
+            bottleneck["function_stack"] = summary.restore_stack(bottleneck["function_stack"])
+        return bottleneck
+
+    @staticmethod
+    def _request_analysis(prompt, system_prompt):
+        """Requests a JSON analysis; returns the parsed dict or an error dictionary."""
+        # Use the new centralized LLM function
+        # Request JSON mode by setting json_mode=True
+        analysis_result = llm_analyzer.get_llm_response(prompt, system_prompt=system_prompt, json_mode=True)
+
+        # Handle different types of responses (error string vs. success dict)
+        if llm_analyzer.is_llm_error(analysis_result):
+            print(f"LLM analysis failed: {analysis_result}")
+            return {"error": analysis_result}
+
+        if not isinstance(analysis_result, dict):
+             print(f"LLM analysis returned an unexpected type: {type(analysis_result)}")
+             return {"error": "LLM did not return a valid JSON object."}
+        return analysis_result
+
+    def analyze_with_llm(self, folded_stacks_path, mode=DEFAULT_MODE):
         """
         Analyzes the folded stack data with an LLM to identify bottlenecks
         and suggest optimizations, requesting a structured JSON output.
 
+        When the LLM is disabled, fails, or takes longer than
+        `PERF_LLM_TIMEOUT`, the local analysis is returned instead, with
+        `"source": "local"` and the reason in `"fallback_reason"`.
+
         Args:
             folded_stacks_path (str): The path to the folded stacks file.
+            mode (str): The profiling mode the stacks were recorded in.
 
         Returns:
             dict: A dictionary containing the AI's analysis, or an error dictionary.
         """
         try:
-            with open(folded_stacks_path, 'r') as f:
-                # Read a sample of the data to avoid exceeding token limits
-                # Reading the first 1000 lines is a heuristic.
-                folded_data = "".join(f.readlines()[:1000])
-
-            if not folded_data:
+            prompt, summary, detection = self._analysis_prompt(folded_stacks_path, mode)
+            if prompt is None:
                 return {"error": "The folded stacks file is empty."}
+            if not llm_analyzer.is_llm_enabled():
+                return detection.to_analysis()
 
-            # Use the centralized prompt from core.prompts
-            prompt = prompts.PERF_ANALYSIS_JSON_PROMPT.format(data=folded_data)
+            try:
+                analysis_result = next(_iter_with_timeout(
+                    [lambda: self._request_analysis(prompt, prompts.PERF_ANALYSIS_SYSTEM_PROMPT)],
+                    settings.PERF_LLM_TIMEOUT, call=True
+                ))
+            except TimeoutError:
+                return detection.to_analysis(_timeout_reason())
+            if 'error' in analysis_result:
+                return detection.to_analysis(analysis_result['error'])
 
-            # Use the new centralized LLM function
-            # Request JSON mode by setting json_mode=True
-            analysis_result = llm_analyzer.get_llm_response(
-                prompt,
-                system_prompt="You are an expert performance engineer. Your task is to analyze the provided `perf` data (in folded stack format) and identify performance bottlenecks. Return your analysis in the specified JSON format.",
-                json_mode=True
-            )
-
-            # Handle different types of responses (error string vs. success dict)
-            if isinstance(analysis_result, str) and analysis_result.startswith("[LLM_ERROR"):
-                print(f"LLM analysis failed: {analysis_result}")
-                return {"error": analysis_result}
-
-            if not isinstance(analysis_result, dict):
-                 print(f"LLM analysis returned an unexpected type: {type(analysis_result)}")
-                 return {"error": "LLM did not return a valid JSON object."}
+            for bottleneck in analysis_result.get("identified_bottlenecks") or []:
+                self._restore_bottleneck(bottleneck, summary)
 
             print("LLM JSON analysis received successfully.")
             return analysis_result
@@ -183,3 +562,151 @@ class PerfAnalyzer:
         except Exception as e:
             print(f"An error occurred during LLM analysis: {e}")
             return {"error": f"An unexpected error occurred during LLM analysis: {e}"}
+
+    def stream_analysis(self, folded_stacks_path, mode=DEFAULT_MODE):
+        """
+        Like analyze_with_llm, but streams the model's answer and yields each
+        bottleneck as soon as the model has finished writing it. Falls back
+        to the local analysis like analyze_with_llm.
+
+        Args:
+            folded_stacks_path (str): The path to the folded stacks file.
+            mode (str): The profiling mode the stacks were recorded in.
+
+        Yields:
+            tuple: ('bottleneck', dict) for each identified bottleneck, then
+                ('analysis', dict) with the complete analysis or an error dictionary.
+        """
+        try:
+            prompt, summary, detection = self._analysis_prompt(folded_stacks_path, mode)
+            if prompt is None:
+                yield 'analysis', {"error": "The folded stacks file is empty."}
+                return
+            if not llm_analyzer.is_llm_enabled():
+                yield from self._yield_analysis(detection.to_analysis())
+                return
+
+            parser = JSONArrayStreamParser("identified_bottlenecks")
+            chunks = llm_analyzer.get_llm_response(
+                prompt,
+                system_prompt=prompts.PERF_ANALYSIS_SYSTEM_PROMPT,
+                json_mode=True,
+                stream=True
+            )
+            try:
+                for chunk in _iter_with_timeout(chunks, settings.PERF_LLM_TIMEOUT):
+                    if llm_analyzer.is_llm_error(chunk):
+                        print(f"LLM analysis failed: {chunk}")
+                        yield 'analysis', detection.to_analysis(chunk)
+                        return
+                    for bottleneck in parser.feed(chunk):
+                        yield 'bottleneck', self._restore_bottleneck(bottleneck, summary)
+            except TimeoutError:
+                print("LLM analysis timed out; using the local analysis.")
+                yield 'analysis', detection.to_analysis(_timeout_reason())
+                return
+
+            analysis_result = parser.result()
+            if analysis_result is None:
+                print("LLM analysis did not return a valid JSON object.")
+                yield 'analysis', detection.to_analysis("LLM did not return a valid JSON object.")
+                return
+
+            for bottleneck in analysis_result.get("identified_bottlenecks") or []:
+                self._restore_bottleneck(bottleneck, summary)
+
+            print("LLM JSON analysis streamed successfully.")
+            yield 'analysis', analysis_result
+
+        except FileNotFoundError:
+            yield 'analysis', {"error": f"Folded stacks file not found at {folded_stacks_path}"}
+        except Exception as e:
+            print(f"An error occurred during LLM analysis: {e}")
+            yield 'analysis', {"error": f"An unexpected error occurred during LLM analysis: {e}"}
+
+    @staticmethod
+    def _yield_analysis(analysis):
+        for bottleneck in analysis["identified_bottlenecks"]:
+            yield 'bottleneck', bottleneck
+        yield 'analysis', analysis
+
+    def diff_svg_path(self, baseline_run_id, candidate_run_id):
+        """
+        Returns where the differential flame graph of two runs is stored, or
+        None if either run has no profile yet. Diffs are content-addressed
+        too: stored with the candidate, named after the baseline's digest.
+        """
+        baseline_digest = self.store.get_digest(baseline_run_id)
+        candidate_digest = self.store.get_digest(candidate_run_id)
+        if not baseline_digest or not candidate_digest:
+            return None
+        return self.store.object_path(candidate_digest, f"diff-{baseline_digest}.svg")
+
+    def diff_runs(self, baseline_run_id, candidate_run_id, threshold=None):
+        """
+        Compares the profiles of two runs and renders a differential flame
+        graph of the candidate, red where it grew and blue where it shrank.
+
+        Args:
+            baseline_run_id (str): The reference run, e.g. the last release.
+            candidate_run_id (str): The run to check for regressions.
+            threshold (float): Minimum change, in percentage points of all
+                samples, reported as a regression or improvement.
+
+        Returns:
+            tuple: (ProfileDiff, dict) with the ranked regressions, improvements,
+                grown stacks and the SVG path, or (None, error dictionary).
+        """
+        paths = [self.folded_stacks_path(run_id) for run_id in (baseline_run_id, candidate_run_id)]
+        if not all(path and os.path.exists(path) for path in paths):
+            return None, {"error": "Both runs must have finished collecting their profiles."}
+
+        try:
+            diff = ProfileDiff(self.load_profile(paths[0]), self.load_profile(paths[1]))
+
+            svg_path = self.diff_svg_path(baseline_run_id, candidate_run_id)
+            if not os.path.exists(svg_path):
+                svg = DiffFlameGraphRenderer(diff).render()
+                self.store.write_object(self.store.get_digest(candidate_run_id), os.path.basename(svg_path),
+                                        lambda f: f.write(svg), encoding='utf-8', errors='surrogateescape')
+                self.store.precompress(svg_path)
+
+            return diff, {
+                "baseline_run_id": baseline_run_id,
+                "candidate_run_id": candidate_run_id,
+                "flamegraph_svg_path": svg_path,
+                "regressions": diff.regressions(threshold),
+                "improvements": diff.improvements(threshold),
+                "stack_regressions": diff.stack_changes(threshold),
+            }
+        except Exception as e:
+            print(f"An error occurred while comparing runs: {e}")
+            return None, {"error": f"An unexpected error occurred while comparing runs: {e}"}
+
+    def analyze_diff_with_llm(self, diff, threshold=None):
+        """
+        Asks the LLM to explain the regressions between two profiles. Only
+        the changes are sent, not either profile as a whole.
+
+        Args:
+            diff (ProfileDiff): The comparison from diff_runs.
+            threshold (float): Minimum change to include, in percentage points.
+
+        Returns:
+            dict: A dictionary containing the AI's analysis, or an error dictionary.
+        """
+        try:
+            budget = prompt_token_budget(prompts.PERF_DIFF_JSON_PROMPT, prompts.PERF_DIFF_SYSTEM_PROMPT)
+            changes = summarize_diff(diff, token_budget=budget, threshold=threshold)
+            if not changes:
+                return {"identified_bottlenecks": [],
+                        "overall_summary": "No changes above the regression threshold."}
+
+            prompt = prompts.PERF_DIFF_JSON_PROMPT.format(data=changes)
+            analysis_result = self._request_analysis(prompt, prompts.PERF_DIFF_SYSTEM_PROMPT)
+            if 'error' not in analysis_result:
+                print("LLM JSON diff analysis received successfully.")
+            return analysis_result
+        except Exception as e:
+            print(f"An error occurred during LLM diff analysis: {e}")
+            return {"error": f"An unexpected error occurred during LLM diff analysis: {e}"}
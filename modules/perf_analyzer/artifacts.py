@@ -0,0 +1,438 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from core.config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Artifact file names
+PERF_DATA_NAME = 'perf.data'
+FOLDED_NAME = 'out.perf-folded'
+FLAMEGRAPH_NAME = 'flamegraph.svg'
+PROFILE_NAME = 'profile.bin'
+TREE_INDEX_NAME = 'tree.idx'
+RUN_META_NAME = 'run.json'
+PERF_MAPS_NAME = 'perf-maps'
+ANALYSIS_NAME = 'analysis.json'
+COUNTERS_NAME = 'counters.json'
+
+# Artifacts that live with the run; everything else is content-addressed.
+RUN_ARTIFACTS = (PERF_DATA_NAME, RUN_META_NAME, PERF_MAPS_NAME, ANALYSIS_NAME)
+
+# Content encodings that artifacts are pre-compressed in, most compact first;
+# brotli is only used if the optional `brotli` package is installed.
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+COMPRESS_BUFFER_SIZE = 1024 * 1024
+
+
+class _HashingWriter:
+    """A minimal text file wrapper that hashes everything written through it."""
+
+    def __init__(self, f, encoding, errors):
+        self._f = f
+        self._encoding = encoding
+        self._errors = errors
+        self.hash = hashlib.sha256()
+        self.bytes_written = 0
+
+    def write(self, text):
+        data = text.encode(self._encoding, self._errors)
+        self.hash.update(data)
+        self.bytes_written += len(data)
+        return self._f.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+class ArtifactStore:
+    """
+    Keeps the artifacts of every analysis run apart, so concurrent runs never
+    clobber each other and identical captures share their derived artifacts.
+
+    Layout under `root`:
+        runs/<run_id>/perf.data, run.json   - per-run capture and metadata
+        runs/<run_id>/analysis.json          - the run's bottleneck analysis
+        runs/<run_id>/perf-maps/             - Python perf map files of the
+                                               capture's processes
+        objects/<ab>/<digest>/...            - folded stacks and everything
+                                               rendered from them, keyed by
+                                               the SHA-256 of the folded stacks,
+                                               and the per-function counter
+                                               totals of IPC captures
+
+    Runs and objects are evicted oldest-first once they exceed `max_age`
+    seconds or the store grows beyond `max_bytes`. Runs that are still in
+    progress, and the objects they reference, are never evicted. Objects
+    are kept as long as a run references them, and go together with the
+    last run that does, so a listed run always has its artifacts. The size of
+    every entry is measured once and then kept up to date as the store
+    writes to it, so eviction does not walk the whole store each time.
+    """
+
+    def __init__(self, root, max_bytes=None, max_age=None):
+        self.root = root
+        self.runs_dir = os.path.join(root, 'runs')
+        self.objects_dir = os.path.join(root, 'objects')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.max_bytes = settings.PERF_STORE_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_age = settings.PERF_STORE_MAX_AGE if max_age is None else max_age
+        for path in (self.runs_dir, self.objects_dir, self.tmp_dir):
+            os.makedirs(path, exist_ok=True)
+
+        self._active = set()
+        # Digests of the objects adopted by active runs.
+        self._pins = {}
+        # Digest each stored run references, by run ID.
+        self._digests = {}
+        # Sizes of finished runs and objects, by path; None until first used.
+        self._sizes = None
+        self._next_expiry = 0
+        self._lock = threading.Lock()
+
+    # --- Runs ---
+
+    def create_run(self):
+        """
+        Creates an empty, active run directory.
+
+        Returns:
+            str: The new run ID.
+        """
+        run_id = time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        os.makedirs(self.run_dir(run_id))
+        with self._lock:
+            self._active.add(run_id)
+        self._write_meta(run_id, {'run_id': run_id, 'created_at': time.time(), 'digest': None})
+        return run_id
+
+    def release(self, run_id):
+        """Marks a run as finished, making it eligible for eviction."""
+        path = self.run_dir(run_id)
+        with self._lock:
+            self._active.discard(run_id)
+            self._pins.pop(run_id, None)
+            if self._sizes is not None and os.path.isdir(path):
+                self._sizes[path] = self._dir_size(path)
+                if self.max_age:
+                    self._next_expiry = min(self._next_expiry, os.path.getmtime(path) + self.max_age)
+
+    def run_dir(self, run_id):
+        return os.path.join(self.runs_dir, run_id)
+
+    def has_run(self, run_id):
+        """True if `run_id` names an existing run, e.g. one taken from a URL."""
+        return (bool(run_id) and not run_id.startswith('.') and os.path.basename(run_id) == run_id
+                and os.path.isdir(self.run_dir(run_id)))
+
+    def run_for_path(self, path):
+        """Returns the ID of the run that owns `path`, or None."""
+        parent = os.path.dirname(os.path.abspath(path))
+        if os.path.dirname(parent) == os.path.abspath(self.runs_dir):
+            return os.path.basename(parent)
+        return None
+
+    def get_meta(self, run_id):
+        try:
+            with open(os.path.join(self.run_dir(run_id), RUN_META_NAME)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _write_meta(self, run_id, meta):
+        self.write_run_json(run_id, RUN_META_NAME, meta)
+
+    def write_run_json(self, run_id, name, data):
+        """Atomically writes a JSON artifact that lives with the run."""
+        path = os.path.join(self.run_dir(run_id), name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        self._replace(tmp_path, path)
+
+    def get_digest(self, run_id):
+        meta = self.get_meta(run_id)
+        return meta.get('digest') if meta else None
+
+    def artifact_path(self, run_id, name):
+        """
+        Returns the path of a run's artifact, whether it is stored with the
+        run or in the content-addressed objects, or None if the run has no
+        folded stacks yet.
+        """
+        if name in RUN_ARTIFACTS:
+            return os.path.join(self.run_dir(run_id), name)
+        digest = self.get_digest(run_id)
+        if not digest:
+            return None
+        self._touch(self.run_dir(run_id))
+        self._touch(self.object_dir(digest))
+        return self.object_path(digest, name)
+
+    # --- Content-addressed objects ---
+
+    def object_dir(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def object_path(self, digest, name):
+        return os.path.join(self.object_dir(digest), name)
+
+    def store_folded(self, run_id, write, encoding='utf-8', errors='strict'):
+        """
+        Stores a run's folded stacks under the digest of their content.
+
+        Args:
+            run_id (str): The run the stacks belong to.
+            write (callable): Called with a text file object to write the
+                folded stacks to.
+
+        Returns:
+            tuple: (digest, reused) where `reused` is True if an identical
+                profile was already in the store.
+        """
+        tmp_path = os.path.join(self.tmp_dir, f"{run_id}.{FOLDED_NAME}")
+        with open(tmp_path, 'wb') as f:
+            writer = _HashingWriter(f, encoding, errors)
+            write(writer)
+        digest = writer.hash.hexdigest()
+
+        # Pinned before looking for an identical object, so that eviction
+        # cannot remove the object between the check and run.json naming it.
+        with self._lock:
+            if run_id in self._active:
+                self._pins[run_id] = digest
+            self._digests[run_id] = digest
+
+        object_dir = self.object_dir(digest)
+        folded_path = os.path.join(object_dir, FOLDED_NAME)
+        reused = os.path.exists(folded_path)
+        if reused:
+            os.remove(tmp_path)
+        else:
+            os.makedirs(object_dir, exist_ok=True)
+            self._replace(tmp_path, folded_path)
+        self._touch(object_dir)
+
+        meta = self.get_meta(run_id) or {'run_id': run_id, 'created_at': time.time()}
+        meta['digest'] = digest
+        self._write_meta(run_id, meta)
+        return digest, reused
+
+    def write_object(self, digest, name, write, mode='w', **open_kwargs):
+        """
+        Atomically writes an artifact derived from the folded stacks.
+
+        Args:
+            write (callable): Called with the file object to write to.
+        """
+        path = self.object_path(digest, name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, mode, **open_kwargs) as f:
+            write(f)
+        self._replace(tmp_path, path)
+        return path
+
+    # --- Pre-compressed copies ---
+
+    def encoded_path(self, path, encoding):
+        """
+        Returns the path of an artifact compressed with a content encoding,
+        compressing it first if there is no up-to-date copy yet.
+
+        Args:
+            path (str): The artifact's path.
+            encoding (str): 'gzip', or 'br' if brotli is installed.
+
+        Returns:
+            str: The path of the compressed copy.
+        """
+        encoded = path + ENCODING_SUFFIXES[encoding]
+        try:
+            if os.path.getmtime(encoded) >= os.path.getmtime(path):
+                return encoded
+        except OSError:
+            pass
+
+        tmp_path = f"{encoded}.{uuid.uuid4().hex}.tmp"
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            if encoding == 'gzip':
+                # A fixed mtime keeps the output, and so its ETag, reproducible.
+                with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=9, mtime=0) as compressed:
+                    shutil.copyfileobj(src, compressed, COMPRESS_BUFFER_SIZE)
+            else:
+                compressor = brotli.Compressor(quality=9)
+                for block in iter(lambda: src.read(COMPRESS_BUFFER_SIZE), b''):
+                    dst.write(compressor.process(block))
+                dst.write(compressor.finish())
+        self._replace(tmp_path, encoded)
+        return encoded
+
+    def precompress(self, path):
+        """Writes an artifact's compressed copies ahead of the first request."""
+        for encoding in ENCODINGS:
+            self.encoded_path(path, encoding)
+
+    # --- Retention ---
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _dir_size(path):
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        return total
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _is_run(self, path):
+        return os.path.dirname(path) == self.runs_dir
+
+    def _replace(self, tmp_path, path):
+        """Moves a finished write into place and accounts for its size."""
+        entry = os.path.dirname(path)
+        with self._lock:
+            old_size = self._file_size(path)
+            os.replace(tmp_path, path)
+            # Active runs are measured once they are released.
+            if self._sizes is not None and (entry in self._sizes or not self._is_run(entry)):
+                self._sizes[entry] = self._sizes.get(entry, 0) + self._file_size(path) - old_size
+
+    def _load_sizes(self):
+        """Measures every run and object once; called with the lock held."""
+        if self._sizes is None:
+            run_ids = os.listdir(self.runs_dir)
+            for run_id in run_ids:
+                if run_id not in self._digests:
+                    digest = self.get_digest(run_id)
+                    if digest:
+                        self._digests[run_id] = digest
+            paths = [self.run_dir(run_id) for run_id in run_ids]
+            for prefix in os.listdir(self.objects_dir):
+                prefix_dir = os.path.join(self.objects_dir, prefix)
+                paths.extend(os.path.join(prefix_dir, digest) for digest in os.listdir(prefix_dir))
+            self._sizes = {path: self._dir_size(path) for path in paths}
+        return self._sizes
+
+    def evict(self):
+        """
+        Removes expired runs and objects, then the least recently used ones
+        until the store fits within its size budget. Returns at once, without
+        touching the disk, while the store is within budget and nothing can
+        have expired yet.
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        now = time.time()
+        with self._lock:
+            sizes = dict(self._load_sizes())
+            total = sum(sizes.values())
+            if ((not self.max_bytes or total <= self.max_bytes)
+                    and (not self.max_age or now < self._next_expiry)):
+                return 0
+            # Runs released during the sweep lower this again.
+            self._next_expiry = float('inf')
+
+        entries = []
+        for path, size in sizes.items():
+            try:
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                # Removed outside the store.
+                with self._lock:
+                    self._sizes.pop(path, None)
+                    if self._is_run(path):
+                        self._digests.pop(os.path.basename(path), None)
+                total -= size
+        entries.sort()
+
+        freed = 0
+        next_expiry = float('inf')
+        for mtime, size, path in entries:
+            expired = self.max_age and now - mtime > self.max_age
+            over_budget = self.max_bytes and total - freed > self.max_bytes
+            removed = []
+            if expired or over_budget:
+                # Checked and moved aside under the lock, so that a run
+                # adopting the object in the meantime keeps it.
+                with self._lock:
+                    removed = self._evict_entry(path)
+            for evicted_path, evicted_size in removed:
+                shutil.rmtree(evicted_path, ignore_errors=True)
+                freed += evicted_size
+            if not removed and self.max_age and os.path.exists(path):
+                next_expiry = min(next_expiry, mtime + self.max_age)
+
+        with self._lock:
+            self._next_expiry = min(self._next_expiry, next_expiry)
+        if freed:
+            print(f"Artifact store: evicted {freed} bytes from {self.root}")
+        return freed
+
+    def _evict_entry(self, path):
+        """
+        Moves a run, with its object unless another run still references it,
+        or an unreferenced object out of the store; called with the lock held.
+
+        Returns:
+            list: (moved path, size) of each entry moved aside for deletion.
+        """
+        if path in self._active_paths():
+            return []
+        run_id = os.path.basename(path) if self._is_run(path) else None
+        if run_id is None and os.path.basename(path) in self._digests.values():
+            return []
+
+        removed = self._move_aside(path)
+        if run_id and not os.path.exists(path):
+            digest = self._digests.pop(run_id, None)
+            if digest and digest not in self._digests.values():
+                object_dir = self.object_dir(digest)
+                if object_dir not in self._active_paths():
+                    removed += self._move_aside(object_dir)
+        return removed
+
+    def _move_aside(self, path):
+        """Renames an entry into the tmp directory; called with the lock held."""
+        evicted_path = os.path.join(self.tmp_dir, f"evicted-{uuid.uuid4().hex}")
+        try:
+            os.rename(path, evicted_path)
+        except FileNotFoundError:
+            # Already gone; it no longer takes up space.
+            self._sizes.pop(path, None)
+            return []
+        except OSError as e:
+            print(f"Warning: could not evict {path}: {e}")
+            return []
+        return [(evicted_path, self._sizes.pop(path, 0))]
+
+    def _active_paths(self):
+        """Runs in progress and the objects they adopted; called with the lock held."""
+        return ({self.run_dir(run_id) for run_id in self._active}
+                | {self.object_dir(digest) for digest in self._pins.values()})
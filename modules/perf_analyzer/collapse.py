@@ -0,0 +1,419 @@
+import bisect
+import os
+import re
+
+# Regular expressions mirror the ones used by stackcollapse-perf.pl so the
+# folded output stays byte-compatible with the Perl implementation.
+EVENT_HEADER_RE = re.compile(r'^(\S.+?)\s+(\d+)/*(\d+)?\s+')
+EVENT_PERIOD_RE = re.compile(r':\s*(\d+)?\s+(\S+):\s*$')
+STACK_LINE_RE = re.compile(r'^\s*(\w+)\s*(.+) \((\S*)\)')
+SYMBOL_OFFSET_RE = re.compile(r'\+0x[\da-f]+$')
+GOLANG_METHOD_RE = re.compile(r'\.\(.*\)\.')
+ARGUMENT_LIST_RE = re.compile(r'\((?!anonymous namespace\)).*')
+
+# Scheduler tracepoints, as printed by `perf script`.
+EVENT_TIME_RE = re.compile(r'\s(\d+\.\d+):\s+(?:\d+\s+)?(\S+):\s*(.*)$')
+SCHED_SWITCH_RE = re.compile(r'prev_pid=(\d+) .*prev_state=(\S+) ==> .*next_pid=(\d+)')
+SCHED_WAKEUP_RE = re.compile(r'(?:^|\s)pid=(\d+)')
+
+# CPython's perf trampoline (3.12+, `-X perf` or PYTHONPERFSUPPORT=1) writes
+# the address of each Python function's trampoline to /tmp/perf-<pid>.map,
+# as `py::<qualname>:<filename>`.
+PERF_MAP_DIR = '/tmp'
+PERF_MAP_RE = re.compile(r'(?:^|/)perf-(\d+)\.map$')
+PYTHON_FRAME_PREFIX = 'py::'
+
+# The interpreter's evaluation loop and call machinery, which sit between
+# every pair of Python frames. Allocation, GC and GIL frames are kept.
+INTERPRETER_FRAME_RE = re.compile(
+    r'^(?:_?PyEval_(?:EvalFrame\w*|Vector|EvalCode\w*)|_?PyObject_(?:Vectorcall\w*|Call\w*|FastCall\w*|MakeTpCall)'
+    r'|_?PyVectorcall_Call|_PyFunction_Vectorcall|method_vectorcall\w*|cfunction_(?:vectorcall|call)\w*'
+    r'|slot_tp_call|vectorcall_\w+|object_vacall|py_trampoline_evaluator|_?PyRun_\w+|pyrun_\w+'
+    r'|run_eval_code_obj|run_mod|pymain_\w+|Py_RunMain|Py_BytesMain)$'
+)
+
+# Weighting of folded samples
+WEIGHT_SAMPLES = 'samples'
+WEIGHT_PERIOD = 'period'
+
+# perf script output is not guaranteed to be valid UTF-8 (mangled symbols,
+# raw comm names), so bytes that do not decode are carried through unchanged.
+PERF_SCRIPT_ENCODING = 'utf-8'
+PERF_SCRIPT_ERRORS = 'surrogateescape'
+
+
+class StackCollapser:
+    """
+    Folds `perf script` output into aggregated stacks, one line at a time.
+
+    This is a port of the default behaviour of Brendan Gregg's
+    stackcollapse-perf.pl (process name as the root frame, generic and Java
+    symbol tidying, only the first event type seen is kept). Samples are
+    aggregated as soon as their stack is complete, so memory grows with the
+    number of distinct stacks rather than with the length of the capture.
+
+    By default every sample counts once. With `weight='period'`, samples
+    are weighted by their event period, so a hardware counter profile adds
+    up to the estimated number of events (cache misses, cycles, ...) rather
+    than the number of samples.
+    """
+
+    def __init__(self, event_filter=None, weight=WEIGHT_SAMPLES):
+        self.stacks = {}
+        self.samples = 0
+        self.event_filter = event_filter
+        self.weight = weight
+        self._stack = []
+        self._pname = None
+        self._period = 1
+
+    def feed(self, line):
+        """
+        Consumes a single line of `perf script` output.
+
+        Args:
+            line (str): The line, with or without its trailing newline.
+        """
+        if line.endswith('\n'):
+            line = line[:-1]
+
+        if line.startswith('#'):
+            return
+
+        # End of stack: save the cached sample.
+        if not line:
+            self._end_sample()
+            return
+
+        header = EVENT_HEADER_RE.match(line)
+        if header:
+            self._start_sample(line, header.group(1))
+            return
+
+        frame = STACK_LINE_RE.match(line)
+        if frame and self._pname:
+            self._stack[:0] = self._tidy_frames(frame.group(2), frame.group(3), frame.group(1))
+
+    def feed_lines(self, lines):
+        """Consumes an iterable of `perf script` lines, e.g. a pipe or file."""
+        for line in lines:
+            self.feed(line)
+        self.finish()
+        return self
+
+    def finish(self):
+        """Flushes a trailing sample that was not terminated by a blank line."""
+        self._end_sample()
+
+    def _start_sample(self, line, comm):
+        self._stack = []
+        self._pname = None
+        self._period = 1
+
+        period = EVENT_PERIOD_RE.search(line)
+        if period:
+            if self.weight == WEIGHT_PERIOD and period.group(1):
+                self._period = int(period.group(1))
+            event = period.group(2)
+            if self.event_filter is None:
+                # Merging different event types, such as instructions and
+                # cycles, produces misleading results; keep the first one.
+                self.event_filter = event
+            elif event != self.event_filter:
+                return
+
+        self._pname = comm.replace(' ', '_')
+
+    def _end_sample(self):
+        if self._pname:
+            key = ';'.join([self._pname] + self._stack)
+            self.stacks[key] = self.stacks.get(key, 0) + self._period
+            self.samples += 1
+        self._stack = []
+        self._pname = None
+
+    def _tidy_frames(self, rawfunc, module, address=None):
+        # Linux 4.8+ includes symbol offsets by default; strip them off.
+        rawfunc = SYMBOL_OFFSET_RE.sub('', rawfunc)
+        if rawfunc.startswith('('):
+            return []
+
+        inline = []
+        for func in rawfunc.split('->'):
+            if func == '[unknown]':
+                if module != '[unknown]':
+                    # Use the module name instead, if known.
+                    func = '[%s]' % module.rsplit('/', 1)[-1]
+                else:
+                    func = '[unknown]'
+
+            func = func.replace(';', ':')
+            if not GOLANG_METHOD_RE.search(func):
+                # Drop the argument list, but keep C++ anonymous namespaces.
+                func = ARGUMENT_LIST_RE.sub('', func, count=1)
+            func = func.replace('"', '').replace("'", '')
+
+            if self._pname == 'java' and '/' in func and func.startswith('L'):
+                func = func[1:]
+
+            inline.append(func)
+        return inline
+
+    def write(self, fp):
+        """
+        Writes the folded stacks in stackcollapse-perf.pl's format and order.
+
+        Args:
+            fp: A text file object opened for writing.
+        """
+        for stack in sorted(self.stacks):
+            fp.write(f"{stack} {self.stacks[stack]}\n")
+
+
+class PerfMap:
+    """
+    The symbols of a JIT or interpreter perf map file: one `START SIZE name`
+    line per symbol, with the start address and size in hex.
+    """
+
+    def __init__(self, entries):
+        self._entries = sorted(entries)
+        self._starts = [start for start, _, _ in self._entries]
+
+    @classmethod
+    def load(cls, path):
+        """Reads a perf map file, or returns None if it cannot be read."""
+        entries = []
+        try:
+            with open(path, encoding=PERF_SCRIPT_ENCODING, errors=PERF_SCRIPT_ERRORS) as f:
+                for line in f:
+                    parts = line.rstrip('\n').split(' ', 2)
+                    if len(parts) != 3:
+                        continue
+                    try:
+                        start, size = int(parts[0], 16), int(parts[1], 16)
+                    except ValueError:
+                        continue
+                    entries.append((start, start + size, parts[2]))
+        except IOError:
+            return None
+        return cls(entries)
+
+    def lookup(self, address):
+        """Returns the name of the symbol containing `address`, or None."""
+        i = bisect.bisect_right(self._starts, address) - 1
+        if i >= 0 and address < self._entries[i][1]:
+            return self._entries[i][2]
+        return None
+
+
+class PythonStackCollapser(StackCollapser):
+    """
+    Folds `perf script` output of Python processes run with CPython's perf
+    trampoline, so Python functions show up between the native frames that
+    call them and that they call.
+
+    Python frames are named `py::<function>:<file name>`. Addresses that
+    `perf script` could not symbolize, e.g. because the map file belongs to
+    another user, are looked up in the `perf-<pid>.map` files of
+    `perf_map_dirs` instead. The interpreter's evaluation and call frames
+    between Python frames are dropped.
+
+    `perf_map_pids` collects the pids whose perf map frames appear in the
+    stacks, i.e. the map files worth keeping with the capture.
+    """
+
+    def __init__(self, perf_map_dirs=(PERF_MAP_DIR,), **kwargs):
+        super().__init__(**kwargs)
+        self.perf_map_dirs = tuple(perf_map_dirs)
+        self.perf_map_pids = set()
+        self._perf_maps = {}
+
+    def _perf_map(self, pid):
+        if pid not in self._perf_maps:
+            self._perf_maps[pid] = None
+            for directory in self.perf_map_dirs:
+                perf_map = PerfMap.load(os.path.join(directory, f'perf-{pid}.map'))
+                if perf_map is not None:
+                    self._perf_maps[pid] = perf_map
+                    break
+        return self._perf_maps[pid]
+
+    def _tidy_frames(self, rawfunc, module, address=None):
+        match = PERF_MAP_RE.search(module)
+        if match:
+            self.perf_map_pids.add(match.group(1))
+        if rawfunc.startswith('[unknown]') and address:
+            perf_map = self._perf_map(match.group(1)) if match else None
+            name = perf_map.lookup(int(address, 16)) if perf_map else None
+            if name:
+                rawfunc = name
+
+        frames = []
+        for func in super()._tidy_frames(rawfunc, module):
+            if INTERPRETER_FRAME_RE.match(func):
+                continue
+            if func.startswith(PYTHON_FRAME_PREFIX):
+                # py::<qualname>:<path>; the path is shortened to the file name.
+                qualname, _, path = func[len(PYTHON_FRAME_PREFIX):].partition(':')
+                func = PYTHON_FRAME_PREFIX + qualname + (':' + path.rsplit('/', 1)[-1] if path else '')
+            frames.append(func)
+        return frames
+
+
+class CounterRatioCollapser(StackCollapser):
+    """
+    Folds a capture of the `cycles` and `instructions` hardware counters,
+    sampled together, into stacks weighted by cycles.
+
+    Instructions do not go into the stacks; `functions` instead holds the
+    estimated cycles and instructions of each function while it was the
+    leaf frame, i.e. its self cost, from which its instructions per cycle
+    (IPC) follow.
+    """
+
+    CYCLES = 'cycles'
+    INSTRUCTIONS = 'instructions'
+
+    def __init__(self):
+        super().__init__(weight=WEIGHT_PERIOD)
+        self.functions = {}  # function -> [cycles, instructions]
+        self._counter = None
+
+    @classmethod
+    def _counter_name(cls, event):
+        # e.g. 'cycles:u', 'cpu-cycles' or 'cpu_core/instructions/'
+        name = event.split(':', 1)[0].strip('/').rsplit('/', 1)[-1]
+        if name in ('cycles', 'cpu-cycles'):
+            return cls.CYCLES
+        if name == 'instructions':
+            return cls.INSTRUCTIONS
+        return None
+
+    def _start_sample(self, line, comm):
+        self._stack = []
+        self._pname = None
+        self._period = 1
+        self._counter = None
+
+        period = EVENT_PERIOD_RE.search(line)
+        if period and period.group(1):
+            self._counter = self._counter_name(period.group(2))
+            self._period = int(period.group(1))
+        if self._counter:
+            self._pname = comm.replace(' ', '_')
+
+    def _end_sample(self):
+        if self._pname:
+            function = self._stack[-1] if self._stack else self._pname
+            counts = self.functions.setdefault(function, [0, 0])
+            if self._counter == self.CYCLES:
+                counts[0] += self._period
+                super()._end_sample()
+            else:
+                counts[1] += self._period
+        self._stack = []
+        self._pname = None
+
+
+class SchedCollapser(StackCollapser):
+    """
+    Folds `sched:sched_switch` and `sched:sched_wakeup` tracepoints into
+    stacks weighted by time in microseconds, instead of by samples.
+
+    In 'offcpu' mode, each stack is weighted by how long the thread was
+    blocked (switched out in any state but runnable) until it ran again:
+    the stack is where it blocked, e.g. in a read() or a futex wait.
+
+    In 'latency' mode, each stack is weighted by how long the thread waited
+    for a CPU after becoming runnable, either woken up or preempted: the
+    stack is where it had blocked or was preempted.
+
+    Tracepoints of every CPU are needed to see both ends of each interval,
+    so captures should be system-wide. The root frame is the thread's
+    process name, as for on-CPU profiles.
+    """
+
+    OFFCPU = 'offcpu'
+    LATENCY = 'latency'
+
+    def __init__(self, kind=OFFCPU):
+        super().__init__()
+        self.kind = kind
+        self._event = None
+        self._blocked = {}   # tid -> (time it blocked, stack)
+        self._runnable = {}  # tid -> (time it became runnable, stack)
+        self._last_stack = {}  # tid -> stack it last blocked in, for wakeups
+
+    def _start_sample(self, line, comm):
+        self._stack = []
+        self._pname = comm.replace(' ', '_')
+        self._event = None
+        match = EVENT_TIME_RE.search(line)
+        if match:
+            self._event = (float(match.group(1)), match.group(2), match.group(3))
+
+    def _end_sample(self):
+        if self._pname and self._event:
+            timestamp, event, trace = self._event
+            stack = ';'.join([self._pname] + self._stack)
+            if event == 'sched:sched_switch':
+                self._switch(timestamp, trace, stack)
+            elif event in ('sched:sched_wakeup', 'sched:sched_wakeup_new'):
+                self._wakeup(timestamp, trace)
+        self._stack = []
+        self._pname = None
+        self._event = None
+
+    def _switch(self, timestamp, trace, stack):
+        match = SCHED_SWITCH_RE.search(trace)
+        if not match:
+            return
+        prev_tid, prev_state, next_tid = int(match.group(1)), match.group(2), int(match.group(3))
+
+        # The thread switching out; tid 0 is the idle task.
+        if prev_tid:
+            if prev_state.startswith('R'):
+                # Preempted: runnable straight away.
+                self._runnable[prev_tid] = (timestamp, stack)
+            else:
+                self._blocked[prev_tid] = (timestamp, stack)
+                self._last_stack[prev_tid] = stack
+
+        # The thread switching in ends its blocked or runnable interval.
+        if self.kind == self.OFFCPU:
+            start = self._blocked.pop(next_tid, None)
+        else:
+            start = self._runnable.pop(next_tid, None)
+            self._blocked.pop(next_tid, None)
+        if start:
+            self._add(start[1], timestamp - start[0])
+
+    def _wakeup(self, timestamp, trace):
+        match = SCHED_WAKEUP_RE.search(trace)
+        if not match:
+            return
+        tid = int(match.group(1))
+        if tid not in self._runnable and tid in self._last_stack:
+            self._runnable[tid] = (timestamp, self._last_stack[tid])
+
+    def _add(self, stack, seconds):
+        micros = int(seconds * 1e6)
+        if micros > 0:
+            self.stacks[stack] = self.stacks.get(stack, 0) + micros
+            self.samples += 1
+
+
+def collapse_perf_script(lines, event_filter=None):
+    """
+    Folds `perf script` output into aggregated stacks.
+
+    Args:
+        lines (iterable): Lines of `perf script` output.
+        event_filter (str): Only keep samples of this event type. Defaults to
+            the first event type encountered.
+
+    Returns:
+        StackCollapser: The collapser holding the aggregated stacks.
+    """
+    return StackCollapser(event_filter=event_filter).feed_lines(lines)
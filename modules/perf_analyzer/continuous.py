@@ -0,0 +1,401 @@
+import os
+import re
+import shutil
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import settings
+from .profile import Profile
+
+WINDOW_SUFFIX = '.prof'
+
+# Windows that may wait for folding before recording pauses.
+MAX_PENDING_FOLDS = 2
+
+# Consecutive failed windows after which a session gives up.
+MAX_FAILED_WINDOWS = 3
+
+DURATION_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$')
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+TIME_OF_DAY_RE = re.compile(r'^\s*(\d{1,2}):(\d{2})(?::(\d{2}))?\s*$')
+
+
+def find_pids(target):
+    """
+    Resolves a profiling target to process IDs.
+
+    Args:
+        target (str or int): A PID, or a process name matched against each
+            process's command name and the file name of its executable.
+
+    Returns:
+        list: The matching PIDs, oldest first; empty if none match.
+    """
+    target = str(target).strip()
+    if target.isdigit():
+        return [int(target)] if os.path.exists(f"/proc/{target}") else []
+
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(f"/proc/{entry}/comm") as f:
+                comm = f.read().strip()
+            with open(f"/proc/{entry}/cmdline", 'rb') as f:
+                argv0 = f.read().split(b'\0', 1)[0].decode('utf-8', 'replace')
+        except OSError:
+            continue
+        if target in (comm, os.path.basename(argv0)):
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def parse_duration(value):
+    """Parses '300', '30s', '5m', '2h' or '1d' into seconds, or None."""
+    match = DURATION_RE.match(str(value))
+    if not match:
+        return None
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_time(value, now=None):
+    """
+    Parses a point in time: epoch seconds, or a local time of day such as
+    '10:02' or '10:02:30'. Times of day refer to the last time the clock
+    showed them, so '23:50' just after midnight means yesterday.
+
+    Returns:
+        float: Epoch seconds, or None if `value` is not understood.
+    """
+    now = time.time() if now is None else now
+    match = TIME_OF_DAY_RE.match(str(value))
+    if not match:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    hour, minute, second = int(match.group(1)), int(match.group(2)), int(match.group(3) or 0)
+    today = time.localtime(now)
+    moment = time.mktime((today.tm_year, today.tm_mon, today.tm_mday, hour, minute, second, 0, 0, -1))
+    if moment > now:
+        moment -= 86400
+    return moment
+
+
+class WindowStore:
+    """
+    A rolling store of per-window profiles on disk.
+
+    Each window is a compact Profile named after the time range it covers.
+    The oldest windows are deleted once the store exceeds `max_bytes` or
+    they are older than `max_age` seconds.
+    """
+
+    def __init__(self, root, max_bytes=None, max_age=None):
+        self.root = root
+        self.max_bytes = settings.PERF_CONTINUOUS_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_age = settings.PERF_CONTINUOUS_MAX_AGE if max_age is None else max_age
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def add(self, start, end, profile):
+        """Stores the profile of one window and evicts old windows."""
+        name = f"{int(start * 1000)}-{int(end * 1000)}{WINDOW_SUFFIX}"
+        path = os.path.join(self.root, name)
+        tmp_path = f"{path}.tmp"
+        profile.save(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def windows(self, since=None, until=None):
+        """
+        Lists the stored windows that overlap [since, until], oldest first.
+
+        Returns:
+            list: (start, end, path) tuples, with times in epoch seconds.
+        """
+        found = []
+        for name in os.listdir(self.root):
+            if not name.endswith(WINDOW_SUFFIX):
+                continue
+            try:
+                start, end = (int(part) / 1000 for part in name[:-len(WINDOW_SUFFIX)].split('-'))
+            except ValueError:
+                continue
+            if (since is None or end >= since) and (until is None or start <= until):
+                found.append((start, end, os.path.join(self.root, name)))
+        found.sort()
+        return found
+
+    def merge(self, since=None, until=None):
+        """
+        Merges every window that overlaps [since, until] into one profile.
+        Windows are the unit of time: a window that overlaps the range only
+        partially is included whole.
+
+        Returns:
+            tuple: (Profile, list of the merged (start, end) ranges)
+        """
+        merged = Profile()
+        ranges = []
+        for start, end, path in self.windows(since, until):
+            try:
+                merged.merge(Profile.load(path))
+            except (OSError, ValueError):
+                # Evicted while merging.
+                continue
+            ranges.append((start, end))
+        return merged, ranges
+
+    def evict(self):
+        with self._lock:
+            windows = self.windows()
+            sizes = []
+            for start, end, path in windows:
+                try:
+                    sizes.append(os.path.getsize(path))
+                except OSError:
+                    sizes.append(0)
+            total = sum(sizes)
+            now = time.time()
+            # The newest window is always kept, even over budget.
+            for (start, end, path), size in zip(windows[:-1], sizes):
+                expired = self.max_age and now - end > self.max_age
+                over_budget = self.max_bytes and total > self.max_bytes
+                if not (expired or over_budget):
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def stats(self):
+        windows = self.windows()
+        return {
+            'windows': len(windows),
+            'bytes': sum(os.path.getsize(path) for _, _, path in windows if os.path.exists(path)),
+            'oldest': windows[0][0] if windows else None,
+            'newest': windows[-1][1] if windows else None,
+        }
+
+
+class ContinuousProfiler:
+    """
+    Profiles running processes continuously, without restarting them.
+
+    `perf record` attaches to the target for back-to-back windows of
+    `window` seconds at a low sampling frequency. Each finished window is
+    folded on a background thread while the next one records, and its
+    profile goes into a rolling WindowStore. Named targets are resolved
+    again for every window, so restarted processes are picked up.
+    """
+
+    def __init__(self, perf_analyzer, target, window=None, freq=None, root=None, max_bytes=None, max_age=None):
+        self.id = uuid.uuid4().hex
+        self.perf_analyzer = perf_analyzer
+        self.target = str(target).strip()
+        self.window = window or settings.PERF_CONTINUOUS_WINDOW
+        self.freq = freq or settings.PERF_CONTINUOUS_FREQ
+        self.root = root or os.path.join(perf_analyzer.output_dir, 'continuous', self.id)
+        self.store = WindowStore(os.path.join(self.root, 'windows'), max_bytes, max_age)
+        self.status = 'created'  # created -> running -> stopped | failed
+        self.error = None
+        self.pids = []
+        self.windows_recorded = 0
+        self.windows_failed = 0
+        self.started_at = None
+
+        self._stopping = threading.Event()
+        # Held while starting or signalling perf, so stop() cannot miss a window.
+        self._process_lock = threading.Lock()
+        self._process = None
+        self._thread = None
+        self._fold_slots = threading.BoundedSemaphore(MAX_PENDING_FOLDS)
+        self._folder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='perf-fold')
+
+    def start(self):
+        """
+        Starts recording in the background.
+
+        Returns:
+            bool: False if the target does not match any process.
+        """
+        self.pids = find_pids(self.target)
+        if not self.pids:
+            self.status = 'failed'
+            self.error = f"No process matches '{self.target}'."
+            return False
+
+        self.status = 'running'
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._loop, name=f"perf-continuous-{self.id[:8]}", daemon=True)
+        self._thread.start()
+        print(f"Continuous profiling of {self.target} (PIDs {self.pids}) started: "
+              f"{self.window}s windows at {self.freq} Hz.")
+        return True
+
+    def stop(self):
+        """Stops recording; the window in progress is cut short and kept."""
+        self._stopping.set()
+        with self._process_lock:
+            process = self._process
+            if process and process.poll() is None:
+                try:
+                    process.send_signal(signal.SIGINT)
+                except OSError:
+                    pass
+        if self._thread:
+            self._thread.join()
+        self._folder.shutdown(wait=True)
+        if self.status == 'running':
+            self.status = 'stopped'
+
+    def _loop(self):
+        failures = 0
+        while not self._stopping.is_set():
+            if not self.target.isdigit():
+                self.pids = find_pids(self.target) or self.pids
+
+            self._fold_slots.acquire()
+            path = os.path.join(self.root, f"window-{uuid.uuid4().hex[:8]}.data")
+            start = time.time()
+            if not self._record(path):
+                self._fold_slots.release()
+                if self._stopping.is_set():
+                    break
+                failures += 1
+                self.windows_failed += 1
+                if failures >= MAX_FAILED_WINDOWS:
+                    self.status = 'failed'
+                    self.error = f"perf record failed {failures} times in a row; is '{self.target}' still running?"
+                    print(f"Continuous profiling of {self.target} stopped: {self.error}")
+                    return
+                self._stopping.wait(1)
+                continue
+
+            failures = 0
+            self.windows_recorded += 1
+            self._folder.submit(self._fold, start, time.time(), path)
+
+    def _record(self, path):
+        perf_command = [
+            'sudo', 'perf', 'record',
+            '-F', str(self.freq),
+            '-g',
+            '-p', ','.join(str(pid) for pid in self.pids),
+            '-o', path,
+            '--', 'sleep', str(self.window)
+        ]
+        try:
+            with self._process_lock:
+                # Stopped between windows: do not start another one.
+                if self._stopping.is_set():
+                    return False
+                self._process = subprocess.Popen(perf_command, stdout=subprocess.DEVNULL,
+                                                 stderr=subprocess.DEVNULL)
+            returncode = self._process.wait(timeout=self.window + 10)
+        except FileNotFoundError:
+            print("Error: 'perf' command not found. Please ensure it is installed and in your PATH.")
+            return False
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            print("Error: perf command timed out.")
+            return False
+        # An interrupted window (stop) still leaves a usable perf.data.
+        if returncode != 0 and not self._stopping.is_set():
+            print(f"Error executing perf command: exit status {returncode}")
+            return False
+        return os.path.exists(path)
+
+    def _fold(self, start, end, path):
+        try:
+            collapser = self.perf_analyzer.collapse_perf_data(path)
+            self.store.add(start, end, Profile.from_stacks(collapser.stacks))
+        except Exception as e:
+            print(f"Failed to fold continuous profiling window {path}: {e}")
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._fold_slots.release()
+
+    def to_dict(self):
+        return dict({
+            'id': self.id,
+            'target': self.target,
+            'pids': list(self.pids),
+            'status': self.status,
+            'error': self.error,
+            'window': self.window,
+            'freq': self.freq,
+            'started_at': self.started_at,
+            'windows_recorded': self.windows_recorded,
+            'windows_failed': self.windows_failed,
+        }, **self.store.stats())
+
+
+class ContinuousProfilerManager:
+    """
+    Keeps track of the continuous profiling sessions of one PerfAnalyzer.
+    At most `max_sessions` record at once; stopped sessions keep their
+    windows until they are deleted.
+    """
+
+    def __init__(self, perf_analyzer, max_sessions=None):
+        self.perf_analyzer = perf_analyzer
+        self.max_sessions = settings.PERF_CONTINUOUS_MAX_SESSIONS if max_sessions is None else max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, target, window=None, freq=None):
+        """
+        Starts a session.
+
+        Returns:
+            ContinuousProfiler: The session; check its status, since a target
+                that matches no process fails straight away. None if
+                `max_sessions` sessions are already recording.
+        """
+        with self._lock:
+            running = sum(1 for session in self._sessions.values() if session.status == 'running')
+            if self.max_sessions and running >= self.max_sessions:
+                return None
+            session = ContinuousProfiler(self.perf_analyzer, target, window, freq)
+            if session.start():
+                self._sessions[session.id] = session
+            else:
+                shutil.rmtree(session.root, ignore_errors=True)
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def stop(self, session_id):
+        session = self.get(session_id)
+        if session:
+            session.stop()
+        return session
+
+    def delete(self, session_id):
+        """Stops a session if it is still recording and deletes its windows."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session:
+            session.stop()
+            shutil.rmtree(session.root, ignore_errors=True)
+        return session
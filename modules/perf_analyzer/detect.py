@@ -0,0 +1,315 @@
+import re
+
+from core.config import settings
+from .profile import ROOT
+
+# Where an analysis came from, in its "source" key
+SOURCE_LOCAL = 'local'
+
+# Hot leaf functions reported on their own, beyond the pattern findings
+MAX_HOT_LEAVES = 3
+
+
+class Pattern:
+    """A kind of bottleneck recognized by the names of the frames it runs in."""
+
+    def __init__(self, kind, title, regex, analysis, suggestion, inclusive=True):
+        """
+        Args:
+            kind (str): The pattern's identifier.
+            title (str): A short description for summaries.
+            regex (str): Matches the frame names of the pattern.
+            analysis (str): Explains a finding; formatted with `percent`,
+                `function`, `function_percent` and `unit`.
+            suggestion (str): How to fix it; formatted like `analysis`.
+            inclusive (bool): Count every sample with a matching frame on
+                its stack. Otherwise only samples whose leaf frame matches
+                are counted, for frames that sit on nearly every stack,
+                such as an interpreter's evaluation loop.
+        """
+        self.kind = kind
+        self.title = title
+        self.regex = re.compile(regex)
+        self.analysis = analysis
+        self.suggestion = suggestion
+        self.inclusive = inclusive
+
+
+PATTERNS = (
+    Pattern(
+        'lock', 'lock contention',
+        r'futex|pthread_mutex|pthread_rwlock|pthread_spin|pthread_cond_(timed)?wait|__lll_lock|spin_lock|'
+        r'mutex_lock|rwsem|osq_lock|sem_wait|std::mutex|Lock::|lock_acquire|take_gil|PyThread_acquire_lock',
+        "{percent}% of the {unit} are spent in lock, futex or condition variable frames, mostly under "
+        "`{function}` ({function_percent}%). Threads are contending for a shared lock or waiting to be woken up.",
+        "Find the contended lock from the callers of `{function}`. Hold it for less time, split it into finer "
+        "grained or per-thread locks, or replace the shared state with lock-free or batched updates.",
+    ),
+    Pattern(
+        'memory', 'memory copies and allocation',
+        r'mem(cpy|move|set)|copy_(to|from)_user|copy_user|\bmalloc\b|_int_malloc|\bfree\b|_int_free|\bcalloc\b|'
+        r'\brealloc\b|operator new|operator delete|tcmalloc|jemalloc|\bje_|mmap|\bbrk\b|page_fault|clear_page|'
+        r'PyObject_Malloc|PyMem_',
+        "{percent}% of the {unit} are spent copying memory or in the allocator, mostly under `{function}` "
+        "({function_percent}%). The code moves or allocates more data than it computes on.",
+        "Avoid the copies under `{function}` by passing views or reusing buffers, allocate once and reuse "
+        "objects or pools in hot loops, reserve capacity up front, or try a faster allocator such as jemalloc.",
+    ),
+    Pattern(
+        'syscall', 'system calls',
+        r'entry_SYSCALL|do_syscall_64|__x64_sys_|__arm64_sys_|\bsys_[a-z]|\bsyscall\b',
+        "{percent}% of the {unit} are spent inside system calls, mostly under `{function}` "
+        "({function_percent}%). Frequent small reads, writes or polls pay the kernel entry cost each time.",
+        "Batch the system calls under `{function}`: use larger buffers, vectored or asynchronous I/O "
+        "(io_uring, sendfile), and avoid busy polling or repeated stat/open calls.",
+    ),
+    Pattern(
+        'gc', 'garbage collection',
+        r'gc_collect|_PyObject_GC|collect_generations|GarbageCollect|GCTask|G1\w*Collect|ParallelGC|'
+        r'runtime\.gc|runtime\.mallocgc|runtime\.scanobject|v8::internal::Heap|Scavenger|MarkCompact',
+        "{percent}% of the {unit} are spent in garbage collection, mostly under `{function}` "
+        "({function_percent}%). The program allocates short-lived objects faster than the collector keeps up.",
+        "Reduce allocation churn in the hot paths, reuse objects, and tune the collector's thresholds or "
+        "heap size so it runs less often.",
+    ),
+    Pattern(
+        'interpreter', 'interpreter overhead',
+        r'_PyEval_EvalFrame|PyEval_|_PyObject_(Vectorcall|Call)|_PyFunction_Vectorcall|ruby_vm|vm_exec|'
+        r'Interpreter::|BytecodeHandler',
+        "{percent}% of the {unit} are spent in the interpreter itself, mostly in `{function}` "
+        "({function_percent}%), dispatching bytecode rather than running native code.",
+        "Move the hot loops into vectorized or native libraries (NumPy, C extensions, a JIT). For Python, "
+        "profile with `-X perf` to see which Python functions drive the interpreter time.",
+        inclusive=False,
+    ),
+)
+
+
+def _percent(samples, total):
+    return round(100 * samples / total, 2) if total else 0.0
+
+
+class Finding:
+    """One detected bottleneck, in the report's bottleneck schema."""
+
+    def __init__(self, kind, title, function_stack, percentage, function, function_percentage, analysis,
+                 optimization_suggestion):
+        self.kind = kind
+        self.title = title
+        self.function_stack = function_stack
+        self.percentage = percentage
+        self.function = function
+        self.function_percentage = function_percentage
+        self.analysis = analysis
+        self.optimization_suggestion = optimization_suggestion
+
+    def to_dict(self):
+        return {
+            "function_stack": self.function_stack,
+            "percentage": self.percentage,
+            "analysis": self.analysis,
+            "optimization_suggestion": self.optimization_suggestion,
+            "kind": self.kind,
+        }
+
+
+class Detection:
+    """The findings of detect_bottlenecks on one profile."""
+
+    def __init__(self, findings, total, unit, min_percent):
+        self.findings = findings
+        self.total = total
+        self.unit = unit
+        self.min_percent = min_percent
+
+    def summary(self):
+        if not self.total:
+            return "The profile is empty."
+        if not self.findings:
+            return (f"No function or known pattern accounts for {self.min_percent:g}% or more of the "
+                    f"{self.total} {self.unit}; the cost is spread across many code paths.")
+        patterns = [f for f in self.findings if f.kind != 'hot_leaf']
+        leaves = [f for f in self.findings if f.kind == 'hot_leaf']
+        parts = []
+        if patterns:
+            parts.append("The biggest costs are " + ", ".join(
+                f"{finding.title} ({finding.percentage}%)" for finding in patterns
+            ) + ".")
+        if leaves:
+            parts.append("The hottest functions by their own time are " + ", ".join(
+                f"`{finding.function}` ({finding.percentage}%)" for finding in leaves
+            ) + ".")
+        return f"Local analysis of {self.total} {self.unit}. " + " ".join(parts)
+
+    def to_analysis(self, fallback_reason=None):
+        """
+        Returns the findings as an analysis in the same JSON schema as the
+        LLM's, with `"source": "local"`.
+
+        Args:
+            fallback_reason (str): Why the local analysis stands in for the
+                LLM's, e.g. a timeout; shown to the user as a warning.
+        """
+        analysis = {
+            "identified_bottlenecks": [finding.to_dict() for finding in self.findings],
+            "overall_summary": self.summary(),
+            "source": SOURCE_LOCAL,
+        }
+        if fallback_reason:
+            analysis["fallback_reason"] = fallback_reason
+        return analysis
+
+    def facts(self, common_prefix=()):
+        """
+        Renders the findings as pre-computed facts for the LLM prompt, with
+        `common_prefix` trimmed from the stacks like in the profile summary.
+        """
+        prefix = ';'.join(common_prefix)
+        lines = []
+        for finding in self.findings:
+            stack = finding.function_stack
+            if prefix and stack.startswith(prefix + ';'):
+                stack = stack[len(prefix) + 1:]
+            if finding.kind == 'hot_leaf':
+                lines.append(f"- Hot function `{finding.function}`: {finding.percentage}% self, "
+                             f"{finding.function_percentage}% total; hottest stack: {stack}")
+            else:
+                lines.append(f"- {finding.title.capitalize()}: {finding.percentage}% of the {self.unit}, "
+                             f"mostly `{finding.function}` ({finding.function_percentage}%); "
+                             f"hottest stack: {stack}")
+        return '\n'.join(lines) or f"- No function or known pattern reaches {self.min_percent:g}% of the {self.unit}."
+
+
+def _pattern_masks(profile):
+    """Returns a bit mask per frame ID of the patterns matching its name."""
+    masks = []
+    for name in profile.frames:
+        mask = 0
+        for bit, pattern in enumerate(PATTERNS):
+            if pattern.regex.search(name):
+                mask |= 1 << bit
+        masks.append(mask)
+    return masks
+
+
+def _match_patterns(profile):
+    """
+    Attributes the profile's samples to the patterns in one pass over the
+    call tree.
+
+    Returns:
+        list: Per pattern, a dict of frame ID -> [samples, heaviest node].
+    """
+    masks = _pattern_masks(profile)
+    hits = [{} for _ in PATTERNS]
+    inclusive = 0
+    for bit, pattern in enumerate(PATTERNS):
+        if pattern.inclusive:
+            inclusive |= 1 << bit
+
+    # Nodes come after their parents, so a node's set of patterns on its
+    # path is its parent's plus its own. Only the topmost matching node of
+    # a path counts its subtree, so nested matches are not counted twice.
+    on_path = [0] * len(profile.parent)
+    for node in range(1, len(profile.parent)):
+        frame_id = profile.frame[node]
+        mask = masks[frame_id]
+        parent_mask = on_path[profile.parent[node]]
+        on_path[node] = parent_mask | (mask & inclusive)
+        if not mask:
+            continue
+        for bit, pattern in enumerate(PATTERNS):
+            if not mask & (1 << bit):
+                continue
+            if pattern.inclusive:
+                if parent_mask & (1 << bit):
+                    continue
+                samples = profile.total_samples[node]
+            else:
+                samples = profile.self_samples[node]
+            if not samples:
+                continue
+            hit = hits[bit].setdefault(frame_id, [0, node])
+            hit[0] += samples
+            if samples > (profile.total_samples[hit[1]] if pattern.inclusive else profile.self_samples[hit[1]]):
+                hit[1] = node
+    return hits
+
+
+def _hot_leaves(profile):
+    """Returns the hottest functions by self time as (frame ID, samples, heaviest node)."""
+    leaves = {}
+    for node, samples in profile.iter_stacks():
+        frame_id = profile.frame[node]
+        leaf = leaves.setdefault(frame_id, [0, node])
+        leaf[0] += samples
+        if samples > profile.self_samples[leaf[1]]:
+            leaf[1] = node
+    ranked = sorted(leaves.items(), key=lambda item: item[1][0], reverse=True)
+    return [(frame_id, samples, node) for frame_id, (samples, node) in ranked[:MAX_HOT_LEAVES]]
+
+
+def detect_bottlenecks(profile, unit='samples', min_percent=None, max_findings=None):
+    """
+    Finds common bottleneck patterns in a profile with exact percentages:
+    lock contention, memory copies and allocation, system calls, garbage
+    collection, interpreter overhead, and hot leaf functions.
+
+    Runs in one pass over the call tree plus a regex match per distinct
+    frame name, so it takes milliseconds even on large profiles.
+
+    Args:
+        profile (Profile): The call tree.
+        unit (str): What the profile's weights count, e.g. 'us'.
+        min_percent (float): Findings below this share of the total are
+            dropped. Defaults to `PERF_DETECT_MIN_PERCENT`.
+        max_findings (int): Maximum number of findings. Defaults to
+            `PERF_DETECT_MAX_FINDINGS`.
+
+    Returns:
+        Detection: The findings, biggest first.
+    """
+    min_percent = settings.PERF_DETECT_MIN_PERCENT if min_percent is None else min_percent
+    max_findings = max_findings or settings.PERF_DETECT_MAX_FINDINGS
+    total = profile.total
+    if not total:
+        return Detection([], 0, unit, min_percent)
+
+    findings = []
+    for pattern, hits in zip(PATTERNS, _match_patterns(profile)):
+        samples = sum(hit[0] for hit in hits.values())
+        if not samples or _percent(samples, total) < min_percent:
+            continue
+        frame_id, (function_samples, node) = max(hits.items(), key=lambda item: item[1][0])
+        values = {
+            'percent': _percent(samples, total),
+            'function': profile.frames[frame_id],
+            'function_percent': _percent(function_samples, total),
+            'unit': unit,
+        }
+        findings.append(Finding(
+            pattern.kind, pattern.title, profile.stack(node), values['percent'], values['function'],
+            values['function_percent'], pattern.analysis.format(**values), pattern.suggestion.format(**values),
+        ))
+
+    # Hot leaves inside a reported pattern, e.g. a futex under a mutex, are
+    # already explained by it.
+    function_total = profile.function_total()
+    explained = tuple(finding.function_stack for finding in findings)
+    for frame_id, samples, node in _hot_leaves(profile):
+        name = profile.frames[frame_id]
+        percent = _percent(samples, total)
+        stack = profile.stack(node)
+        if percent < min_percent or any(stack == s or stack.startswith(s + ';') for s in explained):
+            continue
+        caller = profile.name(profile.parent[node]) if profile.parent[node] != ROOT else None
+        total_percent = _percent(function_total.get(name, samples), total)
+        analysis = (f"`{name}` itself accounts for {percent}% of the {unit} ({total_percent}% including "
+                    f"the functions it calls), so the time goes into its own code rather than its callees.")
+        suggestion = f"Optimize the body of `{name}`: a better algorithm, caching, or vectorizing its inner loop"
+        suggestion += f", or call it less often from `{caller}`." if caller else "."
+        findings.append(Finding('hot_leaf', 'hot function', stack, percent, name, total_percent,
+                                analysis, suggestion))
+
+    findings.sort(key=lambda finding: finding.percentage, reverse=True)
+    return Detection(findings[:max_findings], total, unit, min_percent)
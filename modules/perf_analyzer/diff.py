@@ -0,0 +1,224 @@
+from array import array
+
+from core.config import settings
+from .flamegraph import FlameGraphRenderer
+from .profile import ROOT
+from .summarize import CHARS_PER_TOKEN, prompt_token_budget
+
+# Share of the summary budget given to function deltas; stacks get the rest.
+DIFF_FUNCTIONS_SHARE = 0.5
+
+# Strongest color component change for the largest delta in a diff graph.
+DIFF_COLOR_RANGE = 210
+
+
+def _shares(counts, total):
+    return {key: 100 * samples / total for key, samples in counts.items()} if total else {}
+
+
+def _stack_counts(profile):
+    return {profile.stack(node): samples for node, samples in profile.iter_stacks()}
+
+
+def _deltas(baseline, candidate):
+    """Returns [(key, baseline %, candidate %, delta)] for every key in either mapping."""
+    rows = []
+    for key in baseline.keys() | candidate.keys():
+        before, after = baseline.get(key, 0.0), candidate.get(key, 0.0)
+        rows.append((key, before, after, after - before))
+    return rows
+
+
+class ProfileDiff:
+    """
+    Compares a baseline profile with a candidate profile.
+
+    Both profiles are normalized by their total samples, so captures of
+    different lengths or sampling rates compare fairly: every delta is the
+    change in percentage points of all samples.
+    """
+
+    def __init__(self, baseline, candidate):
+        """
+        Args:
+            baseline (Profile): The reference profile, e.g. the last release.
+            candidate (Profile): The profile to check for regressions.
+        """
+        self.baseline = baseline
+        self.candidate = candidate
+        base_total, cand_total = baseline.total, candidate.total
+
+        self.stack_deltas = _deltas(
+            _shares(_stack_counts(baseline), base_total), _shares(_stack_counts(candidate), cand_total)
+        )
+        self.self_deltas = _deltas(
+            _shares(baseline.function_self(), base_total), _shares(candidate.function_self(), cand_total)
+        )
+        self.total_deltas = {
+            name: delta for name, _, _, delta in _deltas(
+                _shares(baseline.function_total(), base_total), _shares(candidate.function_total(), cand_total)
+            )
+        }
+
+    def regressions(self, threshold=None, limit=None):
+        """
+        Returns the functions whose self time grew by at least `threshold`
+        percentage points, largest increase first.
+
+        Args:
+            threshold (float): Minimum increase. Defaults to `PERF_DIFF_THRESHOLD`.
+            limit (int): Maximum number of functions to return.
+
+        Returns:
+            list: Dicts with the function name, its self percentage in each
+                profile, the self delta and the delta of its total time.
+        """
+        return self._ranked(self.self_deltas, threshold, limit, regressed=True)
+
+    def improvements(self, threshold=None, limit=None):
+        """Like regressions, for the functions whose self time shrank."""
+        return self._ranked(self.self_deltas, threshold, limit, regressed=False)
+
+    def stack_changes(self, threshold=None, limit=None, regressed=True):
+        """Like regressions, for complete stacks instead of functions."""
+        return self._ranked(self.stack_deltas, threshold, limit, regressed, key='function_stack')
+
+    def _ranked(self, rows, threshold, limit, regressed, key='function'):
+        threshold = settings.PERF_DIFF_THRESHOLD if threshold is None else threshold
+        sign = 1 if regressed else -1
+        changed = [row for row in rows if sign * row[3] >= threshold and row[3]]
+        changed.sort(key=lambda row: (-sign * row[3], row[0]))
+        result = []
+        for name, before, after, delta in changed[:limit]:
+            item = {
+                key: name,
+                'baseline_percent': round(before, 4),
+                'candidate_percent': round(after, 4),
+                'delta_percent': round(delta, 4),
+            }
+            if key == 'function':
+                item['total_delta_percent'] = round(self.total_deltas.get(name, 0.0), 4)
+            result.append(item)
+        return result
+
+    def node_deltas(self):
+        """
+        Returns, for every node of the candidate's call tree, the change in
+        its share of samples (including callees) since the baseline.
+
+        Returns:
+            array: Percentage point deltas indexed by candidate node ID.
+        """
+        baseline, candidate = self.baseline, self.candidate
+        base_total = baseline.total or 1
+        cand_total = candidate.total or 1
+        nodes = len(candidate.parent)
+        deltas = array('d', [0.0]) * nodes
+        # Map each candidate node to the baseline node with the same path;
+        # parents always come first.
+        matched = array('i', [ROOT]) * nodes
+        for node in range(1, nodes):
+            parent = matched[candidate.parent[node]]
+            match = baseline.child(parent, candidate.name(node)) if parent >= 0 else None
+            matched[node] = -1 if match is None else match
+            before = baseline.total_samples[match] / base_total if match is not None else 0.0
+            deltas[node] = 100 * (candidate.total_samples[node] / cand_total - before)
+        return deltas
+
+
+class DiffFlameGraphRenderer(FlameGraphRenderer):
+    """
+    Renders the candidate of a ProfileDiff as a differential flame graph.
+
+    Frame widths are the candidate's samples; frames that grew since the
+    baseline are red and frames that shrank are blue, more saturated the
+    larger the change. Code that disappeared entirely is not drawn, as in
+    flamegraph.pl's differential mode; render the reversed diff to see it.
+    """
+
+    def __init__(self, diff, title='Differential Flame Graph', **kwargs):
+        super().__init__(title=title, **kwargs)
+        self.diff = diff
+        self.deltas = diff.node_deltas()
+        self.max_delta = max((abs(d) for d in self.deltas), default=0.0) or 1.0
+
+    def render(self, profile=None):
+        return super().render(self.diff.candidate if profile is None else profile)
+
+    def _frame_fill(self, name, node):
+        if node is None or node == ROOT:
+            return 'rgb(224,224,224)'
+        delta = self.deltas[node]
+        v = int(DIFF_COLOR_RANGE * min(abs(delta) / self.max_delta, 1.0))
+        if delta > 0:
+            return f"rgb(255,{255 - v},{255 - v})"
+        return f"rgb({255 - v},{255 - v},255)"
+
+    def _frame_info(self, node, samples, pct):
+        info = super()._frame_info(node, samples, pct)
+        if node is None or node == ROOT:
+            return info
+        return f"{info}, {self.deltas[node]:+.2f}%"
+
+
+def _format_rows(rows, key):
+    return [
+        f"{row['baseline_percent']:.2f}% -> {row['candidate_percent']:.2f}% "
+        f"({row['delta_percent']:+.2f}) {row[key]}"
+        for row in rows
+    ]
+
+
+def _take(title, lines, budget_chars):
+    """Returns the title plus as many lines as fit, and the characters used."""
+    if not lines:
+        return [], 0
+    taken, used = [title], len(title) + 1
+    for line in lines:
+        if used + len(line) + 1 > budget_chars:
+            break
+        taken.append(line)
+        used += len(line) + 1
+    return (taken, used) if len(taken) > 1 else ([], 0)
+
+
+def summarize_diff(diff, token_budget=None, threshold=None):
+    """
+    Summarizes only what changed between two profiles, for an LLM prompt.
+
+    Args:
+        diff (ProfileDiff): The comparison to summarize.
+        token_budget (int): Approximate number of tokens the summary may use.
+        threshold (float): Changes smaller than this many percentage points
+            are left out. Defaults to `PERF_DIFF_THRESHOLD`.
+
+    Returns:
+        str: The summary, or an empty string if nothing changed.
+    """
+    token_budget = prompt_token_budget() if token_budget is None else token_budget
+    budget_chars = token_budget * CHARS_PER_TOKEN
+
+    header = (f"Baseline samples: {diff.baseline.total}, candidate samples: {diff.candidate.total}. "
+              f"Changes below {settings.PERF_DIFF_THRESHOLD if threshold is None else threshold} "
+              f"percentage points are omitted.")
+    budget_chars -= len(header) + 1
+
+    function_budget = int(budget_chars * DIFF_FUNCTIONS_SHARE)
+    regressed, regressed_used = _take(
+        "Regressed functions (% self time baseline -> candidate, change):",
+        _format_rows(diff.regressions(threshold), 'function'), function_budget * 2 // 3
+    )
+    improved, improved_used = _take(
+        "Improved functions (% self time baseline -> candidate, change):",
+        _format_rows(diff.improvements(threshold), 'function'), function_budget - regressed_used
+    )
+    stacks, _ = _take(
+        "Stacks that grew (% of samples baseline -> candidate, change, root-first stack):",
+        _format_rows(diff.stack_changes(threshold), 'function_stack'),
+        budget_chars - regressed_used - improved_used
+    )
+
+    sections = [section for section in (regressed, improved, stacks) if section]
+    if not sections:
+        return ''
+    return "\n\n".join("\n".join(section) for section in [[header]] + sections)
@@ -0,0 +1,190 @@
+import zlib
+from xml.sax.saxutils import escape
+
+from core.config import settings
+from .profile import Profile, ROOT
+
+# Layout constants, matching flamegraph.pl's defaults.
+FRAME_HEIGHT = 16
+FONT_SIZE = 12
+FONT_WIDTH = 0.59
+X_PAD = 10
+Y_PAD_TOP = FONT_SIZE * 3
+Y_PAD_BOTTOM = FONT_SIZE * 2 + 10
+
+# How much the pruning threshold grows each time a render exceeds max_bytes.
+BUDGET_GROWTH = 2.0
+MAX_BUDGET_PASSES = 32
+
+
+def hot_color(name):
+    """Returns a deterministic 'hot' palette color for a frame name."""
+    h = zlib.crc32(name.encode('utf-8', 'surrogateescape'))
+    v1 = (h & 0xff) / 255
+    v2 = ((h >> 8) & 0xff) / 255
+    v3 = ((h >> 16) & 0xff) / 255
+    return f"rgb({205 + int(50 * v3)},{int(230 * v1)},{int(55 * v2)})"
+
+
+class FlameGraphRenderer:
+    """
+    Renders folded stacks as an SVG flame graph without shelling out to
+    flamegraph.pl.
+
+    Frames narrower than `min_width` pixels (or with fewer than `min_samples`
+    samples) are not drawn individually: small siblings are merged into a
+    single "[other]" frame when that frame would be wide enough to show, and
+    dropped otherwise. If the result is still larger than `max_bytes`, the
+    threshold is raised until it fits.
+
+    Each frame is a `<g class="f">` that nests its callees, so the full stack
+    of any rect can be recovered from its ancestors. Tooltips count frame
+    widths in `unit`, e.g. microseconds for off-CPU profiles.
+    """
+
+    def __init__(self, width=None, min_width=None, min_samples=None, max_bytes=None,
+                 title='CPU Flame Graph', color=hot_color, unit='samples'):
+        self.width = width or settings.FLAMEGRAPH_WIDTH
+        self.min_width = settings.FLAMEGRAPH_MIN_WIDTH if min_width is None else min_width
+        self.min_samples = settings.FLAMEGRAPH_MIN_SAMPLES if min_samples is None else min_samples
+        self.max_bytes = settings.FLAMEGRAPH_MAX_BYTES if max_bytes is None else max_bytes
+        self.title = title
+        self.color = color
+        self.unit = unit
+        self.stats = {}
+
+    def render(self, profile):
+        """
+        Renders a flame graph.
+
+        Args:
+            profile (Profile or dict): The call tree, or a mapping of folded
+                stack -> sample count.
+
+        Returns:
+            str: The SVG document.
+        """
+        if not isinstance(profile, Profile):
+            profile = Profile.from_stacks(profile)
+        total = profile.total
+        scale = (self.width - 2 * X_PAD) / total if total else 0
+        threshold = max(self.min_samples, self.min_width / scale if scale else 0)
+
+        for _ in range(MAX_BUDGET_PASSES):
+            events, frames, depth, pruned = self._layout(profile, threshold)
+            svg = self._to_svg(events, depth, total, scale)
+            size = len(svg.encode('utf-8', 'surrogateescape'))
+            if not self.max_bytes or size <= self.max_bytes or frames <= 1:
+                break
+            threshold = max(threshold * BUDGET_GROWTH, 1)
+
+        self.stats = {
+            'total_samples': total,
+            'frames': frames,
+            'pruned_frames': pruned,
+            'min_samples': threshold,
+            'bytes': size,
+        }
+        return svg
+
+    def render_to_file(self, profile, path):
+        """Renders a flame graph and writes it to `path`."""
+        svg = self.render(profile)
+        with open(path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+            f.write(svg)
+        return path
+
+    @staticmethod
+    def _layout(profile, threshold):
+        """
+        Flattens the call tree into a list of ('open', name, node, x, depth,
+        samples) and ('close',) events, in document order, pruning frames below
+        threshold. Children of pruned frames are never visited.
+
+        Returns:
+            tuple: (events, frame count, max depth, pruned frame count)
+        """
+        totals = profile.total_samples
+        frames = 0
+        events = []
+        max_depth = 0
+        pruned = 0
+        work = [('node', 'all', ROOT, profile.total, 0, 0)]
+        while work:
+            item = work.pop()
+            if item[0] == 'close':
+                events.append(item)
+                continue
+
+            _, name, node, samples, x, depth = item
+            events.append(('open', name, node, x, depth, samples))
+            frames += 1
+            max_depth = max(max_depth, depth)
+
+            children = []
+            other_samples = 0
+            other_count = 0
+            child_x = x
+            for child in (profile.children(node) if node is not None else ()):
+                if totals[child] >= threshold:
+                    children.append((profile.name(child), child, totals[child], child_x))
+                    child_x += totals[child]
+                else:
+                    other_samples += totals[child]
+                    other_count += 1
+
+            if other_count > 1 and other_samples >= threshold:
+                children.append((f"[other: {other_count} frames]", None, other_samples, child_x))
+                pruned += other_count - 1
+            else:
+                pruned += other_count
+
+            work.append(('close',))
+            for child_name, child, child_samples, cx in reversed(children):
+                work.append(('node', child_name, child, child_samples, cx, depth + 1))
+        return events, frames, max_depth, pruned
+
+    def _frame_fill(self, name, node):
+        """The fill color of a frame; `node` is None for merged frames."""
+        return self.color(name)
+
+    def _frame_info(self, node, samples, pct):
+        """The tooltip text after the frame name, inside the parentheses."""
+        return f"{samples} {self.unit}, {pct:.2f}%"
+
+    def _to_svg(self, events, max_depth, total, scale):
+        height = (max_depth + 1) * FRAME_HEIGHT + Y_PAD_TOP + Y_PAD_BOTTOM
+        out = [
+            '<?xml version="1.0" standalone="no"?>\n',
+            f'<svg version="1.1" width="{self.width}" height="{height}" '
+            f'viewBox="0 0 {self.width} {height}" xmlns="http://www.w3.org/2000/svg">\n',
+            '<style type="text/css">text { font-family:Verdana; font-size:12px; fill:rgb(0,0,0); } '
+            '.f:hover > rect { stroke:black; stroke-width:0.5; cursor:pointer; }</style>\n',
+            f'<rect x="0" y="0" width="{self.width}" height="{height}" fill="#f8f8f8"/>\n',
+            f'<text x="{self.width / 2:.0f}" y="{FONT_SIZE * 2}" text-anchor="middle" '
+            f'style="font-size:17px">{escape(self.title)}</text>\n',
+        ]
+        max_chars_scale = FONT_SIZE * FONT_WIDTH
+        for event in events:
+            if event[0] == 'close':
+                out.append('</g>\n')
+                continue
+
+            _, name, node, x, depth, samples = event
+            rx = X_PAD + x * scale
+            rw = samples * scale
+            ry = height - Y_PAD_BOTTOM - (depth + 1) * FRAME_HEIGHT
+            pct = 100 * samples / total if total else 0
+            label = escape(name, {'"': '&quot;'})
+            out.append(
+                f'<g class="f"><title>{label} ({self._frame_info(node, samples, pct)})</title>'
+                f'<rect x="{rx:.1f}" y="{ry}" width="{rw:.1f}" height="{FRAME_HEIGHT - 1}" '
+                f'fill="{self._frame_fill(name, node)}" rx="2" ry="2"/>'
+            )
+            chars = int(rw / max_chars_scale)
+            if chars >= 3:
+                text = name if len(name) <= chars else name[:chars - 2] + '..'
+                out.append(f'<text x="{rx + 3:.1f}" y="{ry + 10.5}">{escape(text)}</text>')
+            out.append('\n')
+        out.append('</svg>\n')
+        return ''.join(out)
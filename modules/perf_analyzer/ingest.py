@@ -0,0 +1,244 @@
+import gzip
+import io
+import os
+import re
+import threading
+import time
+import uuid
+
+from .collapse import StackCollapser, PERF_SCRIPT_ENCODING, PERF_SCRIPT_ERRORS
+from .profile import Profile
+
+UPLOAD_SUFFIX = '.prof'
+
+# Upload formats
+FORMAT_FOLDED = 'folded'
+FORMAT_PERF_SCRIPT = 'perf-script'
+FORMATS = (FORMAT_FOLDED, FORMAT_PERF_SCRIPT)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Host and service names become directory names.
+NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$')
+
+
+def valid_name(name):
+    return bool(name) and bool(NAME_RE.match(name))
+
+
+def open_upload(stream):
+    """
+    Wraps a binary upload stream as text, decompressing it on the fly if it
+    is gzip-compressed. Nothing is buffered beyond what decoding needs.
+    """
+    stream = io.BufferedReader(stream) if not hasattr(stream, 'peek') else stream
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    return io.TextIOWrapper(stream, encoding=PERF_SCRIPT_ENCODING, errors=PERF_SCRIPT_ERRORS, newline='\n')
+
+
+def parse_upload(stream, fmt=FORMAT_FOLDED):
+    """
+    Parses an uploaded profile line by line as it streams in.
+
+    Args:
+        stream: A binary file-like object, optionally gzip-compressed.
+        fmt (str): 'folded' for folded stacks, or 'perf-script' for raw
+            `perf script` output, which is collapsed on the fly.
+
+    Returns:
+        Profile: The uploaded profile.
+    """
+    text = open_upload(stream)
+    if fmt == FORMAT_PERF_SCRIPT:
+        return Profile.from_stacks(StackCollapser().feed_lines(text).stacks)
+    return Profile.from_folded(text)
+
+
+class HostProfile:
+    """The aggregate of one host's uploads for a service."""
+
+    def __init__(self, host):
+        self.host = host
+        self.profile = Profile()
+        self.uploads = 0
+        self.first_seen = None
+        self.last_seen = None
+
+    def add(self, profile, timestamp):
+        self.profile.merge(profile)
+        self.uploads += 1
+        self.first_seen = timestamp if self.first_seen is None else min(self.first_seen, timestamp)
+        self.last_seen = timestamp if self.last_seen is None else max(self.last_seen, timestamp)
+
+
+class IngestStore:
+    """
+    Collects profiles uploaded by many hosts and merges them per service.
+
+    Every upload is merged into its host's aggregate and into the service's
+    aggregate as it arrives, so the cost of an upload depends only on its
+    own size, never on how many hosts came before. Uploads are also kept on
+    disk, tagged with host, service and time, for time-range queries and to
+    rebuild the aggregates after a restart.
+
+    Layout under `root`: <service>/<host>/<timestamp ms>-<id>.prof
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._services = {}   # service -> {'profile': Profile, 'hosts': {host: HostProfile}}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        for service, host, timestamp, path in self._uploads():
+            try:
+                self._merge(service, host, timestamp, Profile.load(path))
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable upload {path}: {e}")
+
+    def _uploads(self, service=None):
+        """Yields (service, host, timestamp, path) for the stored uploads."""
+        services = [service] if service else sorted(os.listdir(self.root))
+        for service_name in services:
+            service_dir = os.path.join(self.root, service_name)
+            if not os.path.isdir(service_dir):
+                continue
+            for host in sorted(os.listdir(service_dir)):
+                host_dir = os.path.join(service_dir, host)
+                for name in sorted(os.listdir(host_dir)):
+                    if not name.endswith(UPLOAD_SUFFIX):
+                        continue
+                    try:
+                        timestamp = int(name.split('-', 1)[0]) / 1000
+                    except ValueError:
+                        continue
+                    yield service_name, host, timestamp, os.path.join(host_dir, name)
+
+    def _merge(self, service, host, timestamp, profile):
+        with self._lock:
+            entry = self._services.setdefault(service, {'profile': Profile(), 'hosts': {}})
+            entry['profile'].merge(profile)
+            entry['hosts'].setdefault(host, HostProfile(host)).add(profile, timestamp)
+
+    def ingest(self, stream, host, service, timestamp=None, fmt=FORMAT_FOLDED):
+        """
+        Parses one upload and merges it into the aggregates.
+
+        Args:
+            stream: The binary upload, optionally gzip-compressed.
+            host (str): The host the profile was captured on.
+            service (str): The service it belongs to.
+            timestamp (float): When it was captured; defaults to now.
+            fmt (str): 'folded' or 'perf-script'.
+
+        Returns:
+            dict: The upload's tags and sample count, or an error dictionary.
+        """
+        if not valid_name(host) or not valid_name(service):
+            return {"error": "Host and service must be 1-128 letters, digits, '.', '_' or '-'."}
+        if fmt not in FORMATS:
+            return {"error": f"Unsupported format '{fmt}'; expected one of {', '.join(FORMATS)}."}
+        timestamp = time.time() if timestamp is None else timestamp
+
+        try:
+            profile = parse_upload(stream, fmt)
+        except (OSError, EOFError, ValueError) as e:
+            return {"error": f"Could not read the uploaded profile: {e}"}
+        if not profile.total:
+            return {"error": "The uploaded profile has no samples."}
+
+        upload_id = uuid.uuid4().hex[:12]
+        host_dir = os.path.join(self.root, service, host)
+        os.makedirs(host_dir, exist_ok=True)
+        path = os.path.join(host_dir, f"{int(timestamp * 1000)}-{upload_id}{UPLOAD_SUFFIX}")
+        profile.save(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+        self._merge(service, host, timestamp, profile)
+        print(f"Ingested {profile.total} samples from {host} for {service}.")
+        return {"upload_id": upload_id, "service": service, "host": host,
+                "timestamp": timestamp, "samples": profile.total}
+
+    def services(self):
+        """Returns a summary of every service and its hosts."""
+        with self._lock:
+            return {
+                service: {
+                    'samples': entry['profile'].total,
+                    'hosts': sorted(entry['hosts']),
+                }
+                for service, entry in sorted(self._services.items())
+            }
+
+    def hosts(self, service, function=None):
+        """
+        Breaks a service's samples down by host, largest first.
+
+        Args:
+            function (str): If given, drill down into this function: count
+                only the samples spent in it (self) on each host.
+
+        Returns:
+            list: Dicts with the host, its samples and share, and upload
+                info, or None if the service is unknown.
+        """
+        with self._lock:
+            entry = self._services.get(service)
+            if entry is None:
+                return None
+            rows = []
+            for host in entry['hosts'].values():
+                total = host.profile.total
+                samples = host.profile.function_self().get(function, 0) if function else total
+                rows.append({
+                    'host': host.host,
+                    'samples': samples,
+                    'percent': round(100 * samples / total, 4) if total else 0.0,
+                    'uploads': host.uploads,
+                    'first_seen': host.first_seen,
+                    'last_seen': host.last_seen,
+                })
+        rows.sort(key=lambda row: (-row['samples'], row['host']))
+        return rows
+
+    def profile(self, service, hosts=None, since=None, until=None):
+        """
+        Returns the merged profile of a service, optionally limited to some
+        hosts and to uploads captured within [since, until].
+
+        Without a time range this is served from the running aggregates;
+        with one, the matching uploads are merged from disk.
+
+        Returns:
+            Profile: A new profile, or None if the service is unknown.
+        """
+        hosts = set(hosts) if hosts else None
+        if since is None and until is None:
+            with self._lock:
+                entry = self._services.get(service)
+                if entry is None:
+                    return None
+                if hosts is None:
+                    return Profile().merge(entry['profile'])
+                merged = Profile()
+                for host in entry['hosts'].values():
+                    if host.host in hosts:
+                        merged.merge(host.profile)
+                return merged
+
+        if service not in self._services:
+            return None
+        merged = Profile()
+        for _, host, timestamp, path in self._uploads(service):
+            if hosts is not None and host not in hosts:
+                continue
+            if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+                continue
+            try:
+                merged.merge(Profile.load(path))
+            except (OSError, ValueError):
+                continue
+        return merged
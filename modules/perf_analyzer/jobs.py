@@ -0,0 +1,305 @@
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import settings
+from core.metrics import Span, Timeline
+from .artifacts import PERF_DATA_NAME
+from .ingest import FORMAT_PERF_SCRIPT
+from .modes import DEFAULT_MODE
+
+# Pipeline stages, in the order a job runs them.
+STAGES = ('collect', 'render', 'analyze')
+# Uploaded captures are read from the upload instead of being collected.
+UPLOAD_STAGES = ('upload', 'render', 'analyze')
+
+
+class Job:
+    """The state of one queued /perf/analyze request."""
+
+    def __init__(self, command, duration, upload=None, mode=DEFAULT_MODE):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.duration = duration
+        self.mode = mode
+        self.upload = upload
+        self.stages = UPLOAD_STAGES if upload else STAGES
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.stage = None
+        self.error = None
+        self.warnings = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        # Stage outputs
+        self.run_id = None
+        self.perf_data_file = None
+        self.profile = None
+        self.counters = None
+        self.flamegraph_svg_path = None
+        self.folded_stacks_file = None
+        self.analysis = None
+
+        # Timing spans of every stage, shown with the report; `span` times
+        # the whole job across the stages' workers
+        self.timeline = Timeline()
+        self.span = None
+
+        # Progress events for streaming clients, as (name, data) pairs
+        self.events = []
+        self._events_changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def publish(self, name, data=None):
+        """Appends an event and wakes up every client waiting for one."""
+        with self._events_changed:
+            self.events.append((name, data))
+            self._events_changed.notify_all()
+
+    def wait_for_events(self, start, timeout=None):
+        """
+        Returns the events from index `start` on, waiting up to `timeout`
+        seconds for one if there are none yet.
+        """
+        with self._events_changed:
+            self._events_changed.wait_for(lambda: len(self.events) > start, timeout)
+            return self.events[start:]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'run_id': self.run_id,
+            'command': self.command,
+            'duration': self.duration,
+            'mode': self.mode,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': list(self.stages),
+            'error': self.error,
+            'warnings': list(self.warnings),
+            'flamegraph_ready': bool(self.flamegraph_svg_path),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'timings': self.timeline.to_list(),
+        }
+
+
+class JobQueue:
+    """
+    Runs perf analyses on bounded pools of background workers.
+
+    Each stage has its own pool, sized by its concurrency limit, since a perf
+    capture, a flame graph render and an LLM call have very different costs.
+    A job is handed to the next stage's pool when a stage finishes, so a job
+    that reaches a saturated stage waits in that stage's queue without
+    holding a worker, and other jobs keep progressing through the other
+    stages.
+    """
+
+    def __init__(self, perf_analyzer, workers=None, max_pending=None, stage_limits=None, history=None):
+        """
+        Args:
+            perf_analyzer (PerfAnalyzer): Runs the stages.
+            workers (int): Workers reading uploaded captures. Defaults to
+                `PERF_JOB_WORKERS`.
+            max_pending (int): Queued or running jobs before new ones are
+                rejected.
+            stage_limits (dict): Workers per stage, overriding the
+                `PERF_*_CONCURRENCY` settings.
+            history (int): Finished jobs kept for lookups.
+        """
+        self.perf_analyzer = perf_analyzer
+        self.max_pending = max_pending or settings.PERF_JOB_MAX_PENDING
+        self.history = history or settings.PERF_JOB_HISTORY
+
+        limits = {
+            'upload': workers or settings.PERF_JOB_WORKERS,
+            'collect': settings.PERF_COLLECT_CONCURRENCY,
+            'render': settings.PERF_RENDER_CONCURRENCY,
+            'analyze': settings.PERF_LLM_CONCURRENCY,
+        }
+        limits.update(stage_limits or {})
+        self._stage_handlers = {
+            'upload': self._read_upload,
+            'collect': self._collect,
+            'render': self._render,
+            'analyze': self._analyze,
+        }
+        self._executors = {
+            stage: ThreadPoolExecutor(max_workers=limits[stage], thread_name_prefix=f'perf-{stage}')
+            for stage in self._stage_handlers
+        }
+
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, command, duration, upload=None, mode=DEFAULT_MODE):
+        """
+        Enqueues an analysis and returns immediately.
+
+        Args:
+            command (str): The command to profile.
+            duration (int): The duration of the profiling in seconds.
+            upload (Upload): A completed upload to analyze instead of
+                profiling `command`, which then only labels the job.
+            mode (str): The profiling mode, e.g. 'cpu' or 'offcpu'.
+
+        Returns:
+            Job: The queued job, or None if the queue is full.
+        """
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self.max_pending:
+                print(f"Job queue is full ({pending} pending jobs); rejecting '{command}'.")
+                return None
+
+            job = Job(command, duration, upload, mode)
+            self._jobs[job.id] = job
+            self._prune_history()
+
+        self._enqueue(job, 0)
+        print(f"Queued perf analysis job {job.id}: {command}")
+        return job
+
+    def get(self, job_id):
+        """Returns the job with the given ID, or None."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait=True):
+        # In pipeline order, so jobs still in flight can reach the later stages.
+        for stage in ('upload',) + STAGES:
+            self._executors[stage].shutdown(wait=wait)
+
+    def _prune_history(self):
+        # Forget the oldest finished jobs once the history limit is reached.
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def _enqueue(self, job, index):
+        """Queues stage `index` of a job on that stage's workers."""
+        stage = job.stages[index]
+        # Reading an upload is mostly waiting for its parser thread.
+        wait_span = Span(f'{stage}_wait').__enter__() if stage in STAGES else None
+        try:
+            self._executors[stage].submit(self._run_stage, job, index, wait_span)
+        except RuntimeError:
+            # The queue was shut down without waiting for this job.
+            job.error = "The job queue was shut down."
+            self._finish(job)
+
+    def _run_stage(self, job, index, wait_span):
+        stage = job.stages[index]
+        with job.timeline.activate():
+            if wait_span is not None:
+                wait_span.__exit__(None, None, None)
+            if index == 0:
+                job.status = 'running'
+                job.started_at = time.time()
+                job.span = Span('job', mode=job.mode).__enter__()
+                job.span.set(queued=job.started_at - job.created_at)
+
+            job.stage = stage
+            try:
+                self._stage_handlers[stage](job)
+            except Exception as e:
+                print(f"Perf analysis job {job.id} failed in stage '{stage}': {e}")
+                job.error = f"An unexpected error occurred: {e}"
+            if job.error or index == len(job.stages) - 1:
+                self._finish(job)
+                return
+        self._enqueue(job, index + 1)
+
+    def _finish(self, job):
+        status = 'failed' if job.error else 'done'
+        try:
+            if job.span is not None:
+                if job.error:
+                    job.span.fail(job.error)
+                with job.timeline.activate():
+                    job.span.__exit__(None, None, None)
+            if job.run_id:
+                self.perf_analyzer.finish_run(job.run_id)
+        finally:
+            # Publish the final status last so pollers never see a finished
+            # job without its finish time.
+            job.finished_at = time.time()
+            job.status = status
+            job.publish('end', {'status': status, 'error': job.error})
+
+    def _collect(self, job):
+        job.run_id = self.perf_analyzer.new_run()
+        job.perf_data_file = self.perf_analyzer.collect_data(
+            command=job.command.split(), duration=job.duration, run_id=job.run_id, mode=job.mode
+        )
+        if not job.perf_data_file:
+            job.error = "Failed to collect perf data. Ensure 'perf' is installed and you have sudo privileges."
+
+    def _read_upload(self, job):
+        upload = job.upload
+        with Span('upload', bytes_in=upload.received):
+            upload.wait()
+        job.run_id = self.perf_analyzer.new_run()
+        try:
+            if upload.status != 'parsed':
+                job.error = upload.error or f"The upload is {upload.status}."
+            elif upload.format == FORMAT_PERF_SCRIPT and upload.mode != job.mode:
+                job.error = f"The perf script output was folded as '{upload.mode}', not '{job.mode}'."
+            elif upload.profile is not None:
+                job.profile = upload.profile
+                job.counters = upload.counters
+            else:
+                # Keep the capture with the run, as if it had been collected.
+                job.perf_data_file = self.perf_analyzer.store.artifact_path(job.run_id, PERF_DATA_NAME)
+                shutil.move(upload.perf_data_path, job.perf_data_file)
+        finally:
+            upload.cleanup()
+
+    def _render(self, job):
+        if job.profile is not None:
+            job.flamegraph_svg_path = self.perf_analyzer.generate_flamegraph_from_profile(
+                job.profile, run_id=job.run_id, mode=job.mode, counters=job.counters
+            )
+            job.profile = None
+        else:
+            job.flamegraph_svg_path = self.perf_analyzer.generate_flamegraph(
+                job.perf_data_file, run_id=job.run_id, mode=job.mode
+            )
+        if not job.flamegraph_svg_path:
+            job.error = "Failed to generate flame graph."
+
+    def _analyze(self, job):
+        job.folded_stacks_file = self.perf_analyzer.folded_stacks_path(job.run_id)
+        analysis = {'error': 'No analysis was produced.'}
+        # Bottlenecks are published as they stream in, so the report can
+        # show them before the model has finished.
+        for name, data in self.perf_analyzer.stream_analysis(job.folded_stacks_file, job.mode):
+            if name == 'bottleneck':
+                job.publish('bottleneck', data)
+            else:
+                analysis = data
+
+        # The local analysis stands in when the LLM fails or is too slow
+        if analysis.get('fallback_reason'):
+            warning = f"AI analysis unavailable ({analysis['fallback_reason']}); showing the local analysis."
+            job.warnings.append(warning)
+            job.publish('warning', warning)
+
+        # Proceed without AI analysis if it fails
+        if 'error' in analysis:
+            warning = f"AI analysis failed: {analysis['error']}"
+            job.warnings.append(warning)
+            job.publish('warning', warning)
+            analysis = {}
+        job.analysis = analysis
+        self.perf_analyzer.save_analysis(job.run_id, analysis)
+        job.publish('analysis', analysis)
@@ -0,0 +1,192 @@
+import os
+import re
+import zlib
+
+from .collapse import StackCollapser, SchedCollapser, PythonStackCollapser, CounterRatioCollapser, WEIGHT_PERIOD, \
+    PERF_MAP_DIR, PYTHON_FRAME_PREFIX
+from .flamegraph import hot_color
+
+DEFAULT_MODE = 'cpu'
+
+# Interpreters that take CPython's `-X perf` option
+PYTHON_EXECUTABLE_RE = re.compile(r'^python[\d.]*$')
+
+
+def io_color(name):
+    """Returns a deterministic blue 'io' palette color, as flamegraph.pl uses for off-CPU time."""
+    h = zlib.crc32(name.encode('utf-8', 'surrogateescape'))
+    v1 = (h & 0xff) / 255
+    v2 = ((h >> 8) & 0xff) / 255
+    shade = 80 + int(60 * v1)
+    return f"rgb({shade},{shade},{190 + int(55 * v2)})"
+
+
+def wakeup_color(name):
+    """Returns a deterministic aqua palette color, for scheduler latency."""
+    h = zlib.crc32(name.encode('utf-8', 'surrogateescape'))
+    v1 = (h & 0xff) / 255
+    return f"rgb({50 + int(60 * v1)},{165 + int(55 * v1)},{165 + int(55 * v1)})"
+
+
+def counter_color(name):
+    """Returns a deterministic purple palette color, for hardware counters."""
+    h = zlib.crc32(name.encode('utf-8', 'surrogateescape'))
+    v1 = (h & 0xff) / 255
+    v2 = ((h >> 8) & 0xff) / 255
+    return f"rgb({190 + int(65 * v1)},{80 + int(60 * v2)},{190 + int(65 * v1)})"
+
+
+def python_color(name):
+    """Returns a green palette color for Python frames, as flamegraph.pl uses for Java, and 'hot' otherwise."""
+    if not name.startswith(PYTHON_FRAME_PREFIX):
+        return hot_color(name)
+    h = zlib.crc32(name.encode('utf-8', 'surrogateescape'))
+    v1 = (h & 0xff) / 255
+    v2 = ((h >> 8) & 0xff) / 255
+    return f"rgb({50 + int(60 * v1)},{190 + int(55 * v2)},{50 + int(60 * v1)})"
+
+
+class ProfilingMode:
+    """
+    What `perf record` captures and how its output is folded.
+
+    Each mode weights its folded stacks by its own unit: on-CPU samples,
+    microseconds blocked or waiting for a CPU, or estimated hardware events.
+    The flame graph and the LLM prompt state that unit, so widths and
+    percentages are read as the right kind of cost.
+    """
+
+    def __init__(self, name, label, title, unit, description, events=(), system_wide=False,
+                 weight=None, sched=None, color=hot_color, env=None, python=False, ipc=False):
+        """
+        Args:
+            name (str): The mode's identifier.
+            label (str): A short name for forms.
+            title (str): The flame graph's title.
+            unit (str): What stack weights count, e.g. 'samples' or 'us'.
+            description (str): What the weights mean, for the LLM prompt.
+            events (tuple): Events to record; on-CPU sampling if empty.
+            system_wide (bool): Record every CPU; scheduler tracepoints only
+                show both ends of an interval that way.
+            weight (str): 'period' to weight samples by their event period.
+            sched (str): 'offcpu' or 'latency' to fold scheduler tracepoints
+                into time intervals.
+            color (callable): The flame graph palette.
+            env (dict): Environment variables the profiled command runs with.
+            python (bool): Run Python interpreters with `-X perf` and fold
+                their stacks with Python function names.
+            ipc (bool): Fold `cycles` and `instructions` samples into stacks
+                weighted by cycles plus each function's counts, for its IPC.
+        """
+        self.name = name
+        self.label = label
+        self.title = title
+        self.unit = unit
+        self.description = description
+        self.events = tuple(events)
+        self.system_wide = system_wide
+        self.weight = weight
+        self.sched = sched
+        self.color = color
+        self.env = dict(env or {})
+        self.python = python
+        self.ipc = ipc
+
+    def record_args(self, freq):
+        """Returns the `perf record` options that select what is captured."""
+        args = []
+        for event in self.events:
+            args += ['-e', event]
+        if not self.sched:
+            # Counters are sampled at a frequency too, with varying periods.
+            args += ['-F', str(freq)]
+        if self.system_wide:
+            args.append('-a')
+        return args + ['-g']
+
+    def wrap_command(self, command):
+        """Returns the command to profile, run with this mode's environment and interpreter options."""
+        command = list(command)
+        if self.python and command and PYTHON_EXECUTABLE_RE.match(os.path.basename(command[0])):
+            command[1:1] = ['-X', 'perf']
+        if self.env:
+            # sudo resets the environment, so it is set on the command itself.
+            command = ['env'] + [f'{key}={value}' for key, value in sorted(self.env.items())] + command
+        return command
+
+    def collapser(self, perf_map_dirs=None):
+        """
+        Returns a new collapser that folds this mode's `perf script` output.
+
+        Args:
+            perf_map_dirs (list): Where to look for `perf-<pid>.map` files in
+                Python mode, in order. Defaults to /tmp.
+        """
+        if self.python:
+            return PythonStackCollapser(perf_map_dirs or (PERF_MAP_DIR,))
+        if self.sched:
+            return SchedCollapser(self.sched)
+        if self.ipc:
+            return CounterRatioCollapser()
+        if self.weight:
+            return StackCollapser(weight=self.weight)
+        return StackCollapser()
+
+    def to_dict(self):
+        return {'name': self.name, 'label': self.label, 'unit': self.unit, 'description': self.description}
+
+
+def _counter_mode(event, label, description):
+    return ProfilingMode(
+        event, label, f"{label} Flame Graph", event,
+        f"Stacks are weighted by the estimated number of {description}, from sampling the `{event}` hardware "
+        f"counter; percentages are shares of all {description}.",
+        events=(event,), weight=WEIGHT_PERIOD, color=counter_color,
+    )
+
+
+MODES = {mode.name: mode for mode in (
+    ProfilingMode(
+        'cpu', 'On-CPU', 'CPU Flame Graph', 'samples',
+        "Stacks are weighted by on-CPU samples; percentages are shares of CPU time.",
+    ),
+    ProfilingMode(
+        'python', 'Python', 'Python Flame Graph', 'samples',
+        "Stacks are weighted by on-CPU samples; percentages are shares of CPU time. Python functions appear "
+        "as `py::function:file.py` frames, from CPython's perf trampoline, between the native frames that "
+        "call them and that they call; the interpreter's own evaluation frames are left out.",
+        env={'PYTHONPERFSUPPORT': '1'}, python=True, color=python_color,
+    ),
+    ProfilingMode(
+        'offcpu', 'Off-CPU', 'Off-CPU Time Flame Graph', 'us',
+        "Stacks are weighted by microseconds spent blocked off-CPU (I/O, locks, sleeps, waits), measured from "
+        "`sched:sched_switch` tracepoints; each stack is where the thread blocked. Percentages are shares of "
+        "all blocked time.",
+        events=('sched:sched_switch',), system_wide=True, sched=SchedCollapser.OFFCPU, color=io_color,
+    ),
+    ProfilingMode(
+        'sched-latency', 'Scheduler Latency', 'Scheduler Latency Flame Graph', 'us',
+        "Stacks are weighted by microseconds spent runnable but waiting for a CPU after a wakeup or "
+        "preemption, measured from scheduler tracepoints; each stack is where the thread waited. Percentages "
+        "are shares of all scheduler latency. High values point to CPU saturation or oversubscription.",
+        events=('sched:sched_switch', 'sched:sched_wakeup', 'sched:sched_wakeup_new'), system_wide=True,
+        sched=SchedCollapser.LATENCY, color=wakeup_color,
+    ),
+    _counter_mode('cache-misses', 'Cache Misses', 'cache misses'),
+    _counter_mode('branch-misses', 'Branch Misses', 'branch mispredictions'),
+    _counter_mode('cycles', 'CPU Cycles', 'CPU cycles'),
+    _counter_mode('instructions', 'Instructions', 'instructions retired'),
+    ProfilingMode(
+        'ipc', 'Cycles & IPC', 'CPU Cycles Flame Graph', 'cycles',
+        "Stacks are weighted by the estimated number of CPU cycles, from sampling the `cycles` and `instructions` "
+        "hardware counters together; percentages are shares of all cycles. The hottest functions are also listed "
+        "with their instructions per cycle (IPC) and cycles per instruction (CPI): a low IPC points to stalls on "
+        "memory, branch mispredictions or long dependency chains, a high IPC to compute-bound code.",
+        events=('cycles', 'instructions'), weight=WEIGHT_PERIOD, color=counter_color, ipc=True,
+    ),
+)}
+
+
+def get_mode(name):
+    """Returns the named mode, the on-CPU mode if `name` is empty, or None if unknown."""
+    return MODES.get(name or DEFAULT_MODE)
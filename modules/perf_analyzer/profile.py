@@ -0,0 +1,345 @@
+import heapq
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+# Binary profile format: magic, then a zlib stream of
+#   <frame table length: u64><node count: u64><frame table: JSON list>
+#   <parent: int32 * nodes><frame: int32 * nodes><self: int64 * nodes>
+PROFILE_MAGIC = b'PFPROF1\n'
+PROFILE_ENCODING = 'utf-8'
+PROFILE_ERRORS = 'surrogateescape'
+
+ROOT = 0
+
+# Child lookups are keyed by (parent << FRAME_BITS) | frame in a single dict.
+FRAME_BITS = 32
+
+
+class Profile:
+    """
+    A call tree built from folded stacks.
+
+    Frame names are interned into `frames`, and the tree is stored as
+    parallel arrays indexed by node ID: `parent`, `frame` (an index into
+    `frames`), `self_samples` (samples whose stack ends at the node) and
+    `total_samples` (samples in the node's subtree). Node 0 is a synthetic
+    root and every node's parent has a smaller ID than the node itself, so
+    the arrays can be walked in order without recursion.
+    """
+
+    def __init__(self):
+        self.frames = []
+        self._frame_ids = {}
+        self.parent = array('i', [-1])
+        self.frame = array('i', [-1])
+        self.self_samples = array('q', [0])
+        self.total_samples = array('q', [0])
+        self._index = {}
+        self._children = None
+
+    # --- Construction ---
+
+    @classmethod
+    def from_stacks(cls, stacks):
+        """
+        Builds a profile from a mapping of folded stack -> sample count.
+        """
+        profile = cls()
+        for stack, count in stacks.items():
+            profile.add_stack(stack.split(';'), count)
+        return profile
+
+    @classmethod
+    def from_folded(cls, fp):
+        """
+        Builds a profile from folded stack lines ("a;b;c 42") in one pass.
+        """
+        profile = cls()
+        for line in fp:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if not stack:
+                continue
+            try:
+                count = int(count)
+            except ValueError:
+                continue
+            profile.add_stack(stack.split(';'), count)
+        return profile
+
+    def intern(self, name):
+        """Returns the frame ID of `name`, adding it to the frame table."""
+        frame_id = self._frame_ids.get(name)
+        if frame_id is None:
+            frame_id = self._frame_ids[name] = len(self.frames)
+            self.frames.append(name)
+        return frame_id
+
+    def _child_index(self):
+        # Loaded profiles rebuild the child lookup only once it is needed.
+        if self._index is None:
+            parent, frame = self.parent, self.frame
+            self._index = {(parent[node] << FRAME_BITS) | frame[node]: node for node in range(1, len(parent))}
+        return self._index
+
+    def _child(self, node, frame_id):
+        key = (node << FRAME_BITS) | frame_id
+        index = self._child_index()
+        child = index.get(key)
+        if child is None:
+            child = index[key] = len(self.parent)
+            self.parent.append(node)
+            self.frame.append(frame_id)
+            self.self_samples.append(0)
+            self.total_samples.append(0)
+            self._children = None
+        return child
+
+    def add_stack(self, frames, count=1):
+        """
+        Adds `count` samples of a stack, given as a root-first list of names.
+        """
+        node = ROOT
+        self.total_samples[ROOT] += count
+        for name in frames:
+            node = self._child(node, self.intern(name))
+            self.total_samples[node] += count
+        self.self_samples[node] += count
+
+    def merge(self, other):
+        """
+        Adds every sample of `other` to this profile in place.
+
+        Returns:
+            Profile: self, for chaining.
+        """
+        mapped = array('i', [ROOT]) * len(other.parent)
+        frame_map = [self.intern(name) for name in other.frames]
+        self.total_samples[ROOT] += other.total_samples[ROOT]
+        self.self_samples[ROOT] += other.self_samples[ROOT]
+        for node in range(1, len(other.parent)):
+            target = self._child(mapped[other.parent[node]], frame_map[other.frame[node]])
+            mapped[node] = target
+            self.self_samples[target] += other.self_samples[node]
+            self.total_samples[target] += other.total_samples[node]
+        return self
+
+    # --- Navigation ---
+
+    @property
+    def total(self):
+        return self.total_samples[ROOT]
+
+    def __len__(self):
+        """The number of call tree nodes, excluding the root."""
+        return len(self.parent) - 1
+
+    def name(self, node):
+        return self.frames[self.frame[node]]
+
+    def children(self, node):
+        """Returns the child node IDs of `node`, sorted by frame name."""
+        kids = self._child_lists()[node]
+        kids.sort(key=self.name)
+        return kids
+
+    def child(self, node, name):
+        """Returns the child of `node` called `name`, or None."""
+        frame_id = self._frame_ids.get(name)
+        if frame_id is None:
+            return None
+        return self._child_index().get((node << FRAME_BITS) | frame_id)
+
+    def find(self, path):
+        """
+        Returns the node for a root-first list of frame names, or None.
+        """
+        node = ROOT
+        for name in path:
+            node = self.child(node, name)
+            if node is None:
+                return None
+        return node
+
+    def path(self, node):
+        """Returns the root-first list of frame names leading to `node`."""
+        names = []
+        while node > ROOT:
+            names.append(self.frames[self.frame[node]])
+            node = self.parent[node]
+        names.reverse()
+        return names
+
+    def stack(self, node):
+        return ';'.join(self.path(node))
+
+    def iter_stacks(self):
+        """Yields (node, samples) for every node that ends at least one stack."""
+        self_samples = self.self_samples
+        for node in range(1, len(self.parent)):
+            if self_samples[node]:
+                yield node, self_samples[node]
+
+    # --- Queries ---
+
+    def function_self(self):
+        """Returns a dict of function name -> samples spent in the function itself."""
+        totals = [0] * len(self.frames)
+        for node, samples in self.iter_stacks():
+            totals[self.frame[node]] += samples
+        return {self.frames[f]: samples for f, samples in enumerate(totals) if samples}
+
+    def function_total(self):
+        """
+        Returns a dict of function name -> samples with the function anywhere
+        on the stack. Recursive calls are only counted once per stack.
+        """
+        totals = [0] * len(self.frames)
+        # A node counts towards its function unless an ancestor already did.
+        # Walk depth-first, tracking how often each frame is on the path.
+        on_path = [0] * len(self.frames)
+        children = self._child_lists()
+        work = [(child, False) for child in children[ROOT]]
+        while work:
+            node, leaving = work.pop()
+            frame_id = self.frame[node]
+            if leaving:
+                on_path[frame_id] -= 1
+                continue
+            if not on_path[frame_id]:
+                totals[frame_id] += self.total_samples[node]
+            on_path[frame_id] += 1
+            work.append((node, True))
+            work.extend((child, False) for child in children[node])
+        return {self.frames[f]: samples for f, samples in enumerate(totals) if samples}
+
+    def top_stacks(self, n=10):
+        """Returns the `n` hottest complete stacks as (stack, samples) pairs."""
+        hottest = heapq.nlargest(n, self.iter_stacks(), key=lambda item: item[1])
+        return [(self.stack(node), samples) for node, samples in hottest]
+
+    def top_functions(self, n=10, inclusive=False):
+        """Returns the `n` hottest functions by self (or total) samples."""
+        totals = self.function_total() if inclusive else self.function_self()
+        return heapq.nlargest(n, totals.items(), key=lambda item: item[1])
+
+    def subtree(self, path):
+        """
+        Extracts the stacks that pass through `path` as a new profile. The
+        path itself is kept as the prefix of every stack.
+
+        Returns:
+            Profile: The extracted profile, empty if the path does not exist.
+        """
+        if not path:
+            return Profile().merge(self)
+
+        result = Profile()
+        start = self.find(path)
+        if start is None:
+            return result
+
+        # Recreate the path above the subtree; it carries only the subtree's samples.
+        prefix = ROOT
+        result.total_samples[ROOT] = self.total_samples[start]
+        for name in path[:-1]:
+            prefix = result._child(prefix, result.intern(name))
+            result.total_samples[prefix] = self.total_samples[start]
+
+        mapped = {self.parent[start]: prefix}
+        for node in [start] + self._descendants(start):
+            target = result._child(mapped[self.parent[node]], result.intern(self.name(node)))
+            mapped[node] = target
+            result.self_samples[target] = self.self_samples[node]
+            result.total_samples[target] = self.total_samples[node]
+        return result
+
+    def _child_lists(self):
+        if self._children is None:
+            children = [[] for _ in range(len(self.parent))]
+            for child in range(1, len(self.parent)):
+                children[self.parent[child]].append(child)
+            self._children = children
+        return self._children
+
+    def _descendants(self, node):
+        """Returns every node below `node`, parents before children."""
+        children = self._child_lists()
+        found = []
+        work = list(children[node])
+        while work:
+            child = work.pop()
+            found.append(child)
+            work.extend(children[child])
+        found.sort()
+        return found
+
+    # --- Serialization ---
+
+    def write_folded(self, fp):
+        """Writes the profile as folded stacks, sorted like stackcollapse output."""
+        lines = sorted(f"{self.stack(node)} {samples}\n" for node, samples in self.iter_stacks())
+        fp.writelines(lines)
+
+    def to_bytes(self):
+        """Returns the profile in its compact binary form."""
+        frames = json.dumps(self.frames, ensure_ascii=False).encode(PROFILE_ENCODING, PROFILE_ERRORS)
+        arrays = [self.parent, self.frame, self.self_samples]
+        if sys.byteorder != 'little':
+            arrays = [array(a.typecode, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+
+        compressor = zlib.compressobj(1)
+        chunks = [PROFILE_MAGIC, compressor.compress(struct.pack('<QQ', len(frames), len(self.parent)))]
+        chunks.append(compressor.compress(frames))
+        for a in arrays:
+            chunks.append(compressor.compress(a.tobytes()))
+        chunks.append(compressor.flush())
+        return b''.join(chunks)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """Reads a profile produced by `to_bytes`."""
+        if not blob.startswith(PROFILE_MAGIC):
+            raise ValueError("Not a serialized profile")
+        data = zlib.decompress(blob[len(PROFILE_MAGIC):])
+
+        frames_len, nodes = struct.unpack_from('<QQ', data)
+        offset = struct.calcsize('<QQ')
+        profile = cls()
+        profile.frames = json.loads(data[offset:offset + frames_len].decode(PROFILE_ENCODING, PROFILE_ERRORS))
+        profile._frame_ids = {name: i for i, name in enumerate(profile.frames)}
+        offset += frames_len
+
+        for attr in ('parent', 'frame', 'self_samples'):
+            a = array(getattr(profile, attr).typecode)
+            size = a.itemsize * nodes
+            a.frombytes(data[offset:offset + size])
+            if sys.byteorder != 'little':
+                a.byteswap()
+            setattr(profile, attr, a)
+            offset += size
+
+        # Totals are derived: children always come after their parent.
+        total = array('q', profile.self_samples)
+        parent = profile.parent
+        for node in range(nodes - 1, 0, -1):
+            total[parent[node]] += total[node]
+        profile.total_samples = total
+        profile._index = None
+        return profile
+
+    def save(self, path):
+        """Writes the profile to `path` in its compact binary form."""
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Reads a profile written by `save`."""
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
@@ -0,0 +1,251 @@
+import heapq
+
+from core.config import settings
+from .profile import ROOT
+
+# Rough size of a token for budgeting; LLM tokenizers average ~4 characters
+# per token on code-like text such as symbol names.
+CHARS_PER_TOKEN = 4
+
+# Share of the budget reserved for the hottest-functions table and for the
+# cold-stack buckets; the hot stacks get the rest.
+FUNCTIONS_SHARE = 0.15
+BUCKETS_SHARE = 0.15
+
+# Room kept for the final "[all other stacks]" line.
+CATCH_ALL_CHARS = 40
+
+# Stacks deeper than this have their middle frames elided.
+MAX_STACK_FRAMES = 48
+ELIDED_FRAME = '..'
+
+
+def estimate_tokens(text):
+    """Estimates the number of LLM tokens in `text`."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def prompt_token_budget(*fixed_parts):
+    """
+    Returns how many tokens of profile data fit in a prompt.
+
+    The budget is the model's context size minus the tokens reserved for the
+    completion (`LLM_MAX_TOKENS`) and the fixed parts of the prompt, capped by
+    `PERF_PROMPT_MAX_TOKENS` when that is set.
+
+    Args:
+        *fixed_parts (str): The prompt template, system prompt, etc.
+    """
+    available = settings.LLM_CONTEXT_TOKENS - settings.LLM_MAX_TOKENS
+    available -= sum(estimate_tokens(part) for part in fixed_parts if part)
+    # Keep a margin for tokenizer variance.
+    available = int(available * 0.9)
+    if settings.PERF_PROMPT_MAX_TOKENS:
+        available = min(available, settings.PERF_PROMPT_MAX_TOKENS)
+    return max(available, 0)
+
+
+class ProfileSummary:
+    """A token-budgeted text rendering of a profile, plus how to read it back."""
+
+    def __init__(self, text, common_prefix, total, shown_samples, elided=None):
+        self.text = text
+        self.common_prefix = common_prefix
+        self.total = total
+        self.shown_samples = shown_samples
+        # Full frames of the listed stacks that had middle frames elided
+        self.elided = elided or []
+
+    def __str__(self):
+        return self.text
+
+    def restore_stack(self, stack):
+        """
+        Re-attaches the common prefix that was trimmed from the listed stacks,
+        and the frames elided from deep ones, so a stack quoted back by the
+        model matches the flame graph.
+        """
+        if not stack:
+            return stack
+        prefix = ';'.join(self.common_prefix)
+        if prefix and stack != prefix and not stack.startswith(prefix + ';'):
+            stack = f"{prefix};{stack}"
+
+        frames = stack.split(';')
+        if ELIDED_FRAME not in frames:
+            return stack
+        cut = frames.index(ELIDED_FRAME)
+        head, tail = frames[:cut], frames[cut + 1:]
+        for full in self.elided:
+            if (len(full) > len(head) + len(tail) and full[:len(head)] == head
+                    and full[len(full) - len(tail):] == tail):
+                return ';'.join(full)
+        return stack
+
+
+def _percent(samples, total):
+    return f"{100 * samples / total:.2f}%"
+
+
+def _format_stack(frames):
+    if len(frames) > MAX_STACK_FRAMES:
+        keep = MAX_STACK_FRAMES // 2
+        frames = frames[:keep] + [ELIDED_FRAME] + frames[-keep:]
+    return ';'.join(frames)
+
+
+def _common_prefix(profile):
+    """Follows the root while the tree does not branch; returns (node, names)."""
+    node, names = ROOT, []
+    while True:
+        children = profile.children(node)
+        if len(children) != 1 or profile.self_samples[node]:
+            return node, names
+        node = children[0]
+        names.append(profile.name(node))
+
+
+def _fit(lines, budget_chars):
+    """Returns the longest head of `lines` that fits in `budget_chars`."""
+    used = 0
+    for count, line in enumerate(lines):
+        used += len(line) + 1
+        if used > budget_chars:
+            return count
+    return len(lines)
+
+
+def _ipc(cycles, instructions):
+    ipc = f"{instructions / cycles:.2f}" if cycles else "n/a"
+    cpi = f"{cycles / instructions:.2f}" if instructions else "n/a"
+    return f"{ipc} / {cpi}"
+
+
+def summarize_profile(profile, token_budget=None, min_percent=None, max_functions=None, unit='samples',
+                      counters=None):
+    """
+    Summarizes a profile for an LLM prompt.
+
+    Stacks are ranked by samples and listed with exact percentages of the
+    total. The prefix shared by every stack is stated once instead of on
+    every line. Stacks colder than `min_percent`, or that do not fit in the
+    budget, are collapsed into one "other" bucket per first branch of the
+    call tree, so their samples still add up to 100%.
+
+    Args:
+        profile (Profile): The profile to summarize.
+        token_budget (int): Approximate number of tokens the summary may use.
+            Defaults to `prompt_token_budget()`.
+        min_percent (float): Stacks below this share of the samples are never
+            listed individually. Defaults to `PERF_SUMMARY_MIN_PERCENT`.
+        max_functions (int): Number of hottest functions to list.
+        unit (str): What the profile's weights count, e.g. 'us' for off-CPU time.
+        counters (dict): Estimated [cycles, instructions] of each function
+            as the leaf frame, from a cycles and instructions capture; the
+            hottest functions' IPC and CPI are listed too.
+
+    Returns:
+        ProfileSummary: The summary text and the trimmed prefix.
+    """
+    token_budget = prompt_token_budget() if token_budget is None else token_budget
+    min_percent = settings.PERF_SUMMARY_MIN_PERCENT if min_percent is None else min_percent
+    max_functions = max_functions or settings.PERF_SUMMARY_MAX_FUNCTIONS
+    total = profile.total
+    if not total:
+        return ProfileSummary('', [], 0, 0)
+
+    budget_chars = token_budget * CHARS_PER_TOKEN
+    prefix_node, prefix = _common_prefix(profile)
+    prefix_len = len(prefix)
+
+    header = [f"Total {unit}: {total}"]
+    if counters:
+        cycles = sum(counts[0] for counts in counters.values())
+        instructions = sum(counts[1] for counts in counters.values())
+        header.append(f"Overall IPC / CPI: {_ipc(cycles, instructions)}")
+    if prefix:
+        header.append(f"Common prefix of every stack (omitted below): {';'.join(prefix)}")
+    budget_chars -= sum(len(line) + 1 for line in header)
+
+    min_samples = total * min_percent / 100
+
+    # Hottest functions by self time, with their total time.
+    function_lines = ["Hottest functions (% self / % total):"]
+    function_total = profile.function_total()
+    for name, samples in profile.top_functions(max_functions):
+        if samples < min_samples:
+            break
+        function_lines.append(
+            f"{_percent(samples, total)} / {_percent(function_total.get(name, samples), total)} {name}"
+        )
+    function_lines = function_lines[:_fit(function_lines, int(budget_chars * FUNCTIONS_SHARE))]
+    if len(function_lines) == 1:
+        function_lines = []
+    budget_chars -= sum(len(line) + 1 for line in function_lines)
+
+    # Instructions per cycle of the functions spending the most cycles.
+    ipc_lines = []
+    if counters:
+        ipc_lines.append("Instructions per cycle of the hottest functions (IPC / CPI, % of cycles):")
+        hottest = heapq.nlargest(max_functions, counters.items(), key=lambda item: item[1][0])
+        for name, (cycles, instructions) in hottest:
+            if not cycles or cycles < min_samples:
+                break
+            ipc_lines.append(f"{_ipc(cycles, instructions)} {_percent(cycles, total)} {name}")
+        ipc_lines = ipc_lines[:_fit(ipc_lines, int(budget_chars * FUNCTIONS_SHARE))]
+        if len(ipc_lines) == 1:
+            ipc_lines = []
+        budget_chars -= sum(len(line) + 1 for line in ipc_lines)
+
+    # Hot stacks, hottest first, down to min_percent or the budget.
+    bucket_title = f"Colder stacks by caller (% of total, {unit}, caller):"
+    stack_budget = int((budget_chars - len(bucket_title) - CATCH_ALL_CHARS) * (1 - BUCKETS_SHARE))
+    max_lines = max(stack_budget // 16, 1)
+    hottest = heapq.nlargest(max_lines, profile.iter_stacks(), key=lambda item: item[1])
+    stack_lines = [f"Hottest stacks (% of total, {unit}, root-first stack):"]
+    shown = []
+    elided = []
+    for node, samples in hottest:
+        if samples < min_samples:
+            break
+        path = profile.path(node)
+        frames = path[prefix_len:] or [profile.name(node)]
+        if len(frames) > MAX_STACK_FRAMES:
+            elided.append(path)
+        stack_lines.append(f"{_percent(samples, total)} {samples} {_format_stack(frames)}")
+        shown.append((node, samples))
+    count = _fit(stack_lines, stack_budget)
+    stack_lines = stack_lines[:count] if count > 1 else []
+    shown = shown[:max(count - 1, 0)]
+    budget_chars -= sum(len(line) + 1 for line in stack_lines)
+
+    # Everything else, bucketed by the first branch below the common prefix.
+    buckets = {child: profile.total_samples[child] for child in profile.children(prefix_node)}
+    shown_samples = 0
+    for node, samples in shown:
+        shown_samples += samples
+        while node != ROOT and node not in buckets:
+            node = profile.parent[node]
+        if node in buckets:
+            buckets[node] -= samples
+    cold = sorted(((samples, node) for node, samples in buckets.items() if samples > 0), reverse=True)
+
+    bucket_lines = []
+    if cold:
+        bucket_lines.append(bucket_title)
+        budget_chars -= len(bucket_title) + CATCH_ALL_CHARS
+        listed = 0
+        for samples, node in cold:
+            line = f"{_percent(samples, total)} {samples} {profile.name(node)};[other]"
+            if len(line) + 1 > budget_chars:
+                break
+            bucket_lines.append(line)
+            budget_chars -= len(line) + 1
+            listed += samples
+        rest = total - shown_samples - listed
+        if rest > 0:
+            bucket_lines.append(f"{_percent(rest, total)} {rest} [all other stacks]")
+
+    sections = [header, function_lines, ipc_lines, stack_lines, bucket_lines]
+    text = "\n\n".join("\n".join(section) for section in sections if section)
+    return ProfileSummary(text, prefix, total, shown_samples, elided)
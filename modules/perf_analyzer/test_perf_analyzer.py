@@ -0,0 +1,936 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from modules.perf_analyzer.collapse import collapse_perf_script
+from modules.perf_analyzer.flamegraph import FlameGraphRenderer
+from modules.perf_analyzer.profile import Profile
+from modules.perf_analyzer.summarize import summarize_profile, estimate_tokens
+from modules.perf_analyzer.jobs import JobQueue
+from modules.perf_analyzer.diff import ProfileDiff, DiffFlameGraphRenderer, summarize_diff
+from modules.perf_analyzer.continuous import ContinuousProfiler, ContinuousProfilerManager, WindowStore, \
+    parse_duration, parse_time
+from modules.perf_analyzer.ingest import IngestStore
+from modules.perf_analyzer.uploads import UploadManager, detect_format, parse_content_range, DETECT_BYTES
+from modules.perf_analyzer.modes import MODES
+from modules.perf_analyzer.collapse import StackCollapser
+from modules.perf_analyzer.artifacts import ArtifactStore, FOLDED_NAME, PERF_DATA_NAME, PERF_MAPS_NAME
+from modules.perf_analyzer.detect import detect_bottlenecks
+from modules.perf_analyzer.analyzer import PerfAnalyzer
+from modules.perf_analyzer.tree_index import TreeIndex
+from core import llm_analyzer
+from core.config import settings
+from unittest import mock
+
+PERF_SCRIPT_SAMPLE = """\
+# ========
+# captured on    : Thu Jul 17 10:00:00 2025
+# ========
+#
+python3 12345 [002] 6544038.708352:   10101010 cpu-clock:
+\tffffffff81063bd6 native_safe_halt+0x6 ([kernel.kallsyms])
+\t    7f1c2a3b4c5d process_data+0x1d (/usr/bin/myapp)
+\t    7f1c2a3b4000 main+0x20 (/usr/bin/myapp)
+
+python3 12345 [002] 6544038.718352:   10101010 cpu-clock:
+\t    7f1c2a3b4c5d process_data+0x1d (/usr/bin/myapp)
+\t    7f1c2a3b4000 main+0x20 (/usr/bin/myapp)
+
+V8 WorkerThread 24636/25607 [000] 94564.109216:   10101010 cpu-clock:
+\t    7f1c2a3b4c5d std::vector<int>::push_back(int const&)+0x1d (/usr/lib/libv8.so)
+\t    7f1c2a3b5000 [unknown] (/usr/lib/libv8.so)
+\t    7f1c2a3b6000 [unknown] ([unknown])
+
+python3 12345 [002] 6544038.728352:   10101010 cpu-clock:
+\t    7f1c2a3b4c5d process_data+0x1d (/usr/bin/myapp)
+\t    7f1c2a3b4000 main+0x20 (/usr/bin/myapp)
+
+"""
+
+
+class StackCollapserTestCase(unittest.TestCase):
+    def test_folds_and_aggregates_samples(self):
+        collapser = collapse_perf_script(io.StringIO(PERF_SCRIPT_SAMPLE))
+        self.assertEqual(collapser.samples, 4)
+        self.assertEqual(collapser.stacks['python3;main;process_data'], 2)
+        self.assertEqual(collapser.stacks['python3;main;process_data;native_safe_halt'], 1)
+
+    def test_tidies_symbols_like_stackcollapse_perf(self):
+        collapser = collapse_perf_script(io.StringIO(PERF_SCRIPT_SAMPLE))
+        self.assertIn('V8_WorkerThread;[unknown];[libv8.so];std::vector<int>::push_back', collapser.stacks)
+
+    def test_tidies_cpp_symbols_like_stackcollapse_perf(self):
+        text = ("app 1 [000] 1.0: 1 cpu-clock:\n"
+                "\t    401000 ns::(anonymous namespace)::worker(int)+0x10 (/bin/app)\n"
+                "\t    400800 std::map<std::string, int>::operator[](std::string const&)+0x8 (/bin/app)\n"
+                "\t    400400 void run<Task>(Task&) [clone .isra.0]+0x4 (/bin/app)\n"
+                "\t    400000 main+0x1 (/bin/app)\n\n")
+        collapser = collapse_perf_script(io.StringIO(text))
+        self.assertEqual(list(collapser.stacks), [
+            'app;main;void run<Task>;std::map<std::string, int>::operator[];ns::(anonymous namespace)::worker'
+        ])
+
+    def test_only_first_event_type_is_kept(self):
+        mixed = PERF_SCRIPT_SAMPLE.replace('10101010 cpu-clock:\n\t    7f1c2a3b4c5d process_data+0x1d (/usr/bin/myapp)\n\t    7f1c2a3b4000 main+0x20 (/usr/bin/myapp)\n\nV8',
+                                           '10101010 cycles:\n\t    7f1c2a3b4c5d process_data+0x1d (/usr/bin/myapp)\n\t    7f1c2a3b4000 main+0x20 (/usr/bin/myapp)\n\nV8')
+        collapser = collapse_perf_script(io.StringIO(mixed))
+        self.assertEqual(collapser.event_filter, 'cpu-clock')
+        self.assertEqual(collapser.stacks['python3;main;process_data'], 1)
+
+    def test_write_matches_folded_format(self):
+        collapser = collapse_perf_script(io.StringIO(PERF_SCRIPT_SAMPLE))
+        out = io.StringIO()
+        collapser.write(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines, sorted(lines))
+        self.assertIn('python3;main;process_data 2', lines)
+
+
+SCHED_SCRIPT_SAMPLE = """\
+app 100 [000] 10.000000: sched:sched_switch: prev_comm=app prev_pid=100 prev_prio=120 prev_state=S ==> next_comm=swapper/0 next_pid=0 next_prio=120
+\tffffffff81000000 __schedule+0x1 ([kernel.kallsyms])
+\t    7f0000000000 read+0x1 (/lib/libc.so)
+\t          400000 main+0x1 (/bin/app)
+
+kworker 7 [001] 10.000500: sched:sched_wakeup: comm=app pid=100 prio=120 target_cpu=000
+\tffffffff81000300 try_to_wake_up+0x1 ([kernel.kallsyms])
+
+swapper 0 [000] 10.002000: sched:sched_switch: prev_comm=swapper/0 prev_pid=0 prev_prio=120 prev_state=R ==> next_comm=app next_pid=100 next_prio=120
+\tffffffff81000000 __schedule+0x1 ([kernel.kallsyms])
+
+"""
+
+
+class ProfilingModeTestCase(unittest.TestCase):
+    def fold(self, mode, text):
+        return MODES[mode].collapser().feed_lines(text.splitlines(True)).stacks
+
+    def test_off_cpu_is_weighted_by_blocked_time(self):
+        # Blocked at 10.000000 in read(), running again at 10.002000.
+        self.assertEqual(self.fold('offcpu', SCHED_SCRIPT_SAMPLE), {'app;main;read;__schedule': 2000})
+
+    def test_scheduler_latency_starts_at_wakeup(self):
+        self.assertEqual(self.fold('sched-latency', SCHED_SCRIPT_SAMPLE), {'app;main;read;__schedule': 1500})
+
+    def test_counters_are_weighted_by_period(self):
+        text = ("app 1 [000] 1.0: 5000 cache-misses:\n\t400000 main+0x1 (/bin/app)\n\n"
+                "app 1 [000] 1.1: 7000 cache-misses:\n\t400000 main+0x1 (/bin/app)\n\n")
+        self.assertEqual(self.fold('cache-misses', text), {'app;main': 12000})
+        self.assertEqual(self.fold('cpu', text), {'app;main': 2})
+
+    def test_ipc_mode_folds_cycles_and_counts_instructions_per_function(self):
+        text = ("app 1 [000] 1.0: 4000 cycles:u:\n\t400100 spin+0x1 (/bin/app)\n\t400000 main+0x1 (/bin/app)\n\n"
+                "app 1 [000] 1.1: 8000 instructions:u:\n\t400100 spin+0x1 (/bin/app)\n\t400000 main+0x1 (/bin/app)\n\n"
+                "app 1 [000] 1.2: 6000 cycles:u:\n\t400200 load+0x1 (/bin/app)\n\t400000 main+0x1 (/bin/app)\n\n"
+                "app 1 [000] 1.3: 1500 instructions:u:\n\t400200 load+0x1 (/bin/app)\n\t400000 main+0x1 (/bin/app)\n\n")
+        self.assertEqual(MODES['ipc'].record_args(99), ['-e', 'cycles', '-e', 'instructions', '-F', '99', '-g'])
+        collapser = MODES['ipc'].collapser().feed_lines(text.splitlines(True))
+        self.assertEqual(collapser.stacks, {'app;main;spin': 4000, 'app;main;load': 6000})
+        self.assertEqual(collapser.functions, {'spin': [4000, 8000], 'load': [6000, 1500]})
+
+        summary = summarize_profile(Profile.from_stacks(collapser.stacks), token_budget=1000, min_percent=0,
+                                    unit='cycles', counters=collapser.functions).text
+        self.assertIn('Overall IPC / CPI: 0.95 / 1.05', summary)
+        self.assertIn('0.25 / 4.00 60.00% load\n2.00 / 0.50 40.00% spin', summary)
+
+    def test_record_args(self):
+        self.assertEqual(MODES['cpu'].record_args(99), ['-F', '99', '-g'])
+        self.assertEqual(MODES['offcpu'].record_args(99), ['-e', 'sched:sched_switch', '-a', '-g'])
+        svg = FlameGraphRenderer(min_width=0, max_bytes=0, unit=MODES['offcpu'].unit).render({'app;read': 2000})
+        self.assertIn('2000 us, 100.00%', svg)
+
+    def test_python_mode_runs_the_command_with_the_perf_trampoline(self):
+        self.assertEqual(MODES['python'].wrap_command(['/usr/bin/python3.12', 'train.py']),
+                         ['env', 'PYTHONPERFSUPPORT=1', '/usr/bin/python3.12', '-X', 'perf', 'train.py'])
+        self.assertEqual(MODES['python'].wrap_command(['gunicorn', 'app']),
+                         ['env', 'PYTHONPERFSUPPORT=1', 'gunicorn', 'app'])
+        self.assertEqual(MODES['cpu'].wrap_command(['python3', 'train.py']), ['python3', 'train.py'])
+
+    def test_python_mode_interleaves_python_and_native_frames(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        # perf script could not read this map itself; the collapser looks it up.
+        with open(os.path.join(tmp_dir, 'perf-4242.map'), 'w') as f:
+            f.write("7f0000001000 40 py::<module>:/srv/app/train.py\n")
+        text = (
+            "python3 4242 [000] 1.0: 10101010 cpu-clock:\n"
+            "\t    7f1000000000 memcpy+0x10 (/lib/libc.so.6)\n"
+            "\t    7f2000000000 _PyEval_EvalFrameDefault+0x100 (/usr/bin/python3.12)\n"
+            "\t    7f0000002000 py::step:/srv/app/model.py+0x8 (/tmp/perf-4242.map)\n"
+            "\t    7f2000000100 _PyObject_Vectorcall+0x20 (/usr/bin/python3.12)\n"
+            "\t    7f2000000000 _PyEval_EvalFrameDefault+0x200 (/usr/bin/python3.12)\n"
+            "\t    7f0000001010 [unknown] (/tmp/perf-4242.map)\n"
+            "\t    7f2000000200 Py_RunMain+0x30 (/usr/bin/python3.12)\n"
+            "\t    7f1000000100 __libc_start_main+0x80 (/lib/libc.so.6)\n\n"
+        )
+        stacks = MODES['python'].collapser([tmp_dir]).feed_lines(text.splitlines(True)).stacks
+        self.assertEqual(stacks, {'python3;__libc_start_main;py::<module>:train.py;py::step:model.py;memcpy': 1})
+
+    def test_python_mode_keeps_only_the_perf_maps_of_captured_processes(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        map_dir = os.path.join(tmp_dir, 'tmp')
+        os.makedirs(map_dir)
+        for pid in (4242, 9999):
+            with open(os.path.join(map_dir, f'perf-{pid}.map'), 'w') as f:
+                f.write(f"7f0000001000 40 py::main:/srv/app{pid}.py\n")
+
+        analyzer = PerfAnalyzer(output_dir=os.path.join(tmp_dir, 'store'))
+        run_id = analyzer.new_run()
+        perf_data = analyzer.store.artifact_path(run_id, PERF_DATA_NAME)
+        open(perf_data, 'wb').close()
+        script = (b"python3 4242 [000] 1.0: 10101010 cpu-clock:\n"
+                  b"\t    7f0000001010 [unknown] (/tmp/perf-4242.map)\n"
+                  b"\t    7f1000000100 __libc_start_main+0x80 (/lib/libc.so.6)\n\n")
+        process = mock.Mock(stdout=io.BytesIO(script))
+        process.wait.return_value = 0
+        with mock.patch('modules.perf_analyzer.analyzer.PERF_MAP_DIR', map_dir), \
+                mock.patch('modules.perf_analyzer.analyzer.subprocess.Popen', return_value=process):
+            collapser = analyzer.collapse_perf_data(perf_data, mode='python')
+
+        self.assertEqual(collapser.stacks, {'python3;__libc_start_main;py::main:app4242.py': 1})
+        # The map of the unrelated process 9999 stays out of the run.
+        self.assertEqual(os.listdir(analyzer.store.artifact_path(run_id, PERF_MAPS_NAME)), ['perf-4242.map'])
+
+
+class FlameGraphRendererTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stacks = {'app;main;hot': 900, 'app;main;warm': 90}
+        self.stacks.update({f'app;main;cold_{i}': 1 for i in range(10)})
+
+    def test_renders_nested_frames(self):
+        svg = FlameGraphRenderer(min_width=0, max_bytes=0).render(self.stacks)
+        self.assertTrue(svg.startswith('<?xml'))
+        self.assertIn('<title>hot (900 samples, 90.00%)</title>', svg)
+        self.assertEqual(svg.count('<g class="f">'), svg.count('</g>'))
+
+    def test_merges_frames_below_min_samples(self):
+        renderer = FlameGraphRenderer(min_width=0, min_samples=5, max_bytes=0)
+        svg = renderer.render(self.stacks)
+        self.assertNotIn('cold_0', svg)
+        self.assertIn('[other: 10 frames] (10 samples', svg)
+        self.assertEqual(renderer.stats['pruned_frames'], 9)
+
+    def test_respects_size_budget(self):
+        stacks = {f'app;f{i};g{i};h{i}': 1 for i in range(2000)}
+        stacks['app;main;hot'] = 100000
+        renderer = FlameGraphRenderer(min_width=0, max_bytes=20000)
+        svg = renderer.render(stacks)
+        self.assertLessEqual(len(svg.encode('utf-8')), 20000)
+        self.assertIn('hot', svg)
+
+    def test_renders_profile(self):
+        svg = FlameGraphRenderer(min_width=0, max_bytes=0).render(Profile.from_stacks(self.stacks))
+        self.assertIn('<title>warm (90 samples, 9.00%)</title>', svg)
+
+
+class ProfileTestCase(unittest.TestCase):
+    FOLDED = 'app;main;parse;read 30\napp;main;parse 10\napp;main;eval;eval;eval 40\napp;gc 20\n'
+
+    def setUp(self):
+        self.profile = Profile.from_folded(io.StringIO(self.FOLDED))
+
+    def test_self_and_total_time(self):
+        self.assertEqual(self.profile.total, 100)
+        self.assertEqual(self.profile.function_self()['parse'], 10)
+        self.assertEqual(self.profile.function_total()['parse'], 40)
+        # Recursive frames are only counted once per stack.
+        self.assertEqual(self.profile.function_total()['eval'], 40)
+        self.assertEqual(self.profile.function_total()['app'], 100)
+
+    def test_top_stacks(self):
+        self.assertEqual(self.profile.top_stacks(2), [('app;main;eval;eval;eval', 40), ('app;main;parse;read', 30)])
+
+    def test_subtree_keeps_prefix(self):
+        subtree = self.profile.subtree(['app', 'main', 'parse'])
+        self.assertEqual(subtree.total, 40)
+        self.assertEqual(dict(subtree.top_stacks()), {'app;main;parse;read': 30, 'app;main;parse': 10})
+        self.assertEqual(self.profile.subtree(['nope']).total, 0)
+
+    def test_merge(self):
+        other = Profile.from_folded(io.StringIO('app;gc 5\napp;io 5\n'))
+        self.profile.merge(other)
+        self.assertEqual(self.profile.total, 110)
+        self.assertEqual(self.profile.function_self()['gc'], 25)
+        self.assertEqual(self.profile.total_samples[self.profile.find(['app'])], 110)
+
+    def test_round_trips_through_bytes(self):
+        loaded = Profile.from_bytes(self.profile.to_bytes())
+        self.assertEqual(loaded.total, 100)
+        self.assertEqual(loaded.top_stacks(10), self.profile.top_stacks(10))
+        out = io.StringIO()
+        loaded.write_folded(out)
+        self.assertEqual(sorted(out.getvalue().splitlines()), sorted(self.FOLDED.splitlines()))
+
+
+class TreeIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.profile = Profile.from_stacks({
+            'app;main;parse;read': 10, 'app;main;parse': 5, 'app;main;compute': 60,
+            'app;main;compute;parse': 20, 'app;idle': 5,
+        })
+        self.index = TreeIndex(TreeIndex.build(self.profile))
+
+    def test_subtree_lists_hottest_children_first(self):
+        node = self.index.find(['app', 'main'])
+        tree = self.index.subtree(node, depth=2, limit=1)
+        self.assertEqual((tree['name'], tree['total'], tree['child_count']), ('main', 95, 2))
+        self.assertEqual([child['name'] for child in tree['children']], ['compute'])
+        self.assertEqual((tree['other_count'], tree['other_total']), (1, 15))
+        compute = tree['children'][0]
+        self.assertEqual((compute['self'], compute['total']), (60, 80))
+        self.assertEqual(compute['children'][0]['child_count'], 0)
+        self.assertNotIn('children', self.index.subtree(node, depth=0))
+        self.assertIsNone(self.index.find(['app', 'missing']))
+
+    def test_search_highlights_and_counts_nested_matches_once(self):
+        result = self.index.search('PAR')
+        self.assertEqual(result['match_count'], 1)
+        match = result['matches'][0]
+        self.assertEqual((match['name'], match['match'], match['total'], match['node_count']),
+                         ('parse', [[0, 3]], 35, 2))
+        self.assertEqual(match['paths'][0]['path'], ['app', 'main', 'compute', 'parse'])
+
+        result = self.index.search('a')  # app, main, parse, read
+        self.assertEqual((result['matched_total'], result['exact']), (100, True))
+        tree = self.index.subtree(self.index.find(['app']), depth=1, search='in')
+        self.assertEqual(tree['children'][0]['match'], [[2, 4]])
+
+    def test_memory_mapped_index_matches_profile(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'tree.idx')
+        with open(path, 'wb') as f:
+            f.write(TreeIndex.build(self.profile))
+        index = TreeIndex.open(path)
+        self.assertEqual(index.total, 100)
+        self.assertEqual(len(index), len(self.profile))
+        node = index.find(['app', 'main', 'parse', 'read'])
+        self.assertEqual(index.path(node), ['app', 'main', 'parse', 'read'])
+
+
+class SummarizeProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        stacks = {'python3;main;hot': 600, 'python3;main;warm;inner': 300}
+        stacks.update({f'python3;main;cold;c{i}': 1 for i in range(100)})
+        self.profile = Profile.from_stacks(stacks)
+
+    def test_ranks_stacks_with_exact_percentages(self):
+        summary = summarize_profile(self.profile, token_budget=2000, min_percent=1)
+        lines = summary.text.splitlines()
+        self.assertIn('Total samples: 1000', lines)
+        hot = lines.index('60.00% 600 hot')
+        self.assertEqual(lines[hot + 1], '30.00% 300 warm;inner')
+        self.assertNotIn('c1', summary.text)
+        self.assertIn('10.00% 100 cold;[other]', lines)
+
+    def test_trims_and_restores_common_prefix(self):
+        summary = summarize_profile(self.profile, token_budget=2000)
+        self.assertEqual(summary.common_prefix, ['python3', 'main'])
+        self.assertEqual(summary.restore_stack('warm;inner'), 'python3;main;warm;inner')
+        self.assertEqual(summary.restore_stack('python3;main;hot'), 'python3;main;hot')
+
+    def test_restores_elided_frames_of_deep_stacks(self):
+        deep = ['python3', 'main'] + [f'f{i}' for i in range(60)]
+        stacks = {';'.join(deep + ['a']): 600, ';'.join(deep + ['b']): 300, 'python3;main;hot': 100}
+        summary = summarize_profile(Profile.from_stacks(stacks), token_budget=2000)
+        listed = [line.split(' ', 2)[2] for line in summary.text.splitlines() if ';..;' in line]
+        self.assertEqual(len(listed), 2)
+        self.assertEqual([summary.restore_stack(stack) for stack in listed],
+                         [';'.join(deep + ['a']), ';'.join(deep + ['b'])])
+
+    def test_fits_token_budget(self):
+        summary = summarize_profile(self.profile, token_budget=60, min_percent=0)
+        self.assertLessEqual(estimate_tokens(summary.text), 60)
+        self.assertIn('60.00% 600 hot', summary.text)
+
+
+class DetectBottlenecksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.profile = Profile.from_stacks({
+            'app;main;worker;pthread_mutex_lock;__lll_lock_wait;futex_wait': 300,
+            'app;main;worker;compute': 250,
+            'app;main;load;read;entry_SYSCALL_64;do_syscall_64;__x64_sys_read;copy_user_generic': 150,
+            'app;main;load;parse;__memmove_avx_unaligned': 100,
+            'app;main;load;parse;malloc;_int_malloc': 100,
+            'app;main;misc': 100,
+        })
+
+    def test_finds_patterns_with_exact_percentages(self):
+        detection = detect_bottlenecks(self.profile, min_percent=5)
+        findings = {finding.kind: finding for finding in detection.findings}
+        self.assertEqual(findings['lock'].percentage, 30.0)
+        self.assertEqual(findings['lock'].function, 'pthread_mutex_lock')
+        self.assertEqual(findings['lock'].function_stack, 'app;main;worker;pthread_mutex_lock')
+        self.assertEqual(findings['syscall'].percentage, 15.0)
+        # The copy inside the read() syscall counts, but nested allocator frames only once.
+        self.assertEqual(findings['memory'].percentage, 35.0)
+        self.assertEqual(findings['memory'].function_percentage, 15.0)
+        # The futex is explained by the lock finding, so the hottest leaf left is compute.
+        self.assertEqual(findings['hot_leaf'].function, 'compute')
+        self.assertEqual(findings['hot_leaf'].percentage, 25.0)
+        self.assertNotIn('interpreter', findings)
+        percentages = [finding.percentage for finding in detection.findings]
+        self.assertEqual(percentages, sorted(percentages, reverse=True))
+
+    def test_emits_the_analysis_schema(self):
+        analysis = detect_bottlenecks(self.profile, min_percent=20).to_analysis()
+        self.assertEqual(analysis['source'], 'local')
+        self.assertIn('lock contention (30.0%)', analysis['overall_summary'])
+        for bottleneck in analysis['identified_bottlenecks']:
+            self.assertEqual(set(bottleneck), {'function_stack', 'percentage', 'analysis',
+                                               'optimization_suggestion', 'kind'})
+            self.assertGreaterEqual(bottleneck['percentage'], 20)
+
+    def test_interpreter_counts_only_its_own_time(self):
+        profile = Profile.from_stacks({
+            'python3;_PyEval_EvalFrameDefault;_PyEval_EvalFrameDefault': 40,
+            'python3;_PyEval_EvalFrameDefault;PyNumber_Add;long_add': 60,
+        })
+        [finding] = [f for f in detect_bottlenecks(profile).findings if f.kind == 'interpreter']
+        self.assertEqual(finding.percentage, 40.0)
+
+    def test_facts_trim_the_common_prefix(self):
+        facts = detect_bottlenecks(self.profile, min_percent=20).facts(['app', 'main'])
+        self.assertIn('Lock contention: 30.0% of the samples', facts)
+        self.assertIn('hottest stack: worker;pthread_mutex_lock', facts)
+        self.assertIn('No function or known pattern', detect_bottlenecks(Profile()).facts())
+
+
+class LocalAnalysisFallbackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.analyzer = PerfAnalyzer(output_dir=self.tmpdir)
+        self.run_id = self.analyzer.new_run()
+        profile = Profile.from_stacks({'app;main;pthread_mutex_lock;futex_wait': 70, 'app;main;work': 30})
+        self.analyzer.generate_flamegraph_from_profile(profile, run_id=self.run_id)
+        self.folded = self.analyzer.folded_stacks_path(self.run_id)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_prompt_includes_findings(self):
+        prompt, _, detection = self.analyzer._analysis_prompt(self.folded)
+        self.assertIn('Pre-computed Findings', prompt)
+        self.assertIn('Lock contention: 70.0% of the samples', prompt)
+        self.assertEqual(detection.findings[0].kind, 'lock')
+
+    def test_disabled_llm_uses_the_local_analysis(self):
+        with mock.patch.object(settings, 'SIMULATE_LLM', False), mock.patch.object(settings, 'LLM_PROVIDER', 'none'):
+            analysis = self.analyzer.analyze_with_llm(self.folded)
+            events = list(self.analyzer.stream_analysis(self.folded))
+        self.assertEqual(analysis['source'], 'local')
+        self.assertNotIn('fallback_reason', analysis)
+        self.assertEqual([name for name, _ in events], ['bottleneck'] * len(analysis['identified_bottlenecks'])
+                         + ['analysis'])
+
+    def test_slow_llm_falls_back(self):
+        def slow_response(*args, **kwargs):
+            time.sleep(1)
+            return {'identified_bottlenecks': [], 'overall_summary': 'late'}
+
+        with mock.patch.object(settings, 'SIMULATE_LLM', True), \
+                mock.patch.object(settings, 'PERF_LLM_TIMEOUT', 0.1), \
+                mock.patch.object(llm_analyzer, 'get_llm_response', side_effect=slow_response):
+            started = time.time()
+            analysis = self.analyzer.analyze_with_llm(self.folded)
+        self.assertLess(time.time() - started, 0.9)
+        self.assertEqual(analysis['source'], 'local')
+        self.assertIn('did not finish within', analysis['fallback_reason'])
+
+    def test_llm_errors_fall_back(self):
+        with mock.patch.object(settings, 'SIMULATE_LLM', True), \
+                mock.patch.object(llm_analyzer, 'get_llm_response', return_value='[LLM_ERROR: down]'):
+            analysis = self.analyzer.analyze_with_llm(self.folded)
+        self.assertEqual(analysis['fallback_reason'], '[LLM_ERROR: down]')
+        self.assertEqual(analysis['identified_bottlenecks'][0]['percentage'], 70.0)
+
+
+class ProfileDiffTestCase(unittest.TestCase):
+    def setUp(self):
+        # The candidate runs twice as long; only 'parse' got slower.
+        self.baseline = Profile.from_stacks({'main;parse': 20, 'main;render': 60, 'main;io': 20})
+        self.candidate = Profile.from_stacks({'main;parse': 80, 'main;render': 120, 'main;io': 0, 'main;gc': 0})
+        self.diff = ProfileDiff(self.baseline, self.candidate)
+
+    def test_deltas_are_normalized(self):
+        regressions = self.diff.regressions(threshold=1)
+        self.assertEqual([r['function'] for r in regressions], ['parse'])
+        self.assertAlmostEqual(regressions[0]['baseline_percent'], 20.0)
+        self.assertAlmostEqual(regressions[0]['candidate_percent'], 40.0)
+        self.assertAlmostEqual(regressions[0]['delta_percent'], 20.0)
+        self.assertEqual([r['function'] for r in self.diff.improvements(threshold=1)], ['io'])
+        self.assertEqual(self.diff.regressions(threshold=25), [])
+
+    def test_diff_flame_graph_colors(self):
+        svg = DiffFlameGraphRenderer(self.diff, min_width=0).render()
+        self.assertIn('parse (80 samples, 40.00%, +20.00%)', svg)
+        self.assertIn('render (120 samples, 60.00%, +0.00%)', svg)
+        self.assertIn('fill="rgb(255,45,45)"', svg)
+
+    def test_summary_lists_only_changes(self):
+        text = summarize_diff(self.diff, token_budget=1000, threshold=1)
+        self.assertIn('20.00% -> 40.00% (+20.00) parse', text)
+        self.assertIn('20.00% -> 0.00% (-20.00) io', text)
+        self.assertNotIn('render', text)
+        self.assertEqual(summarize_diff(ProfileDiff(self.baseline, self.baseline), 1000, threshold=1), '')
+
+
+class FakePerfAnalyzer:
+    def __init__(self, analysis=None):
+        self.analysis = analysis if analysis is not None else {'overall_summary': 'ok'}
+        self.finished_runs = []
+
+    def new_run(self):
+        return 'run-1'
+
+    def finish_run(self, run_id):
+        self.finished_runs.append(run_id)
+
+    def folded_stacks_path(self, run_id):
+        return '/tmp/out.perf-folded'
+
+    def collect_data(self, command, duration=10, run_id=None, mode='cpu'):
+        return '/tmp/perf.data' if command != ['fail'] else None
+
+    def generate_flamegraph(self, perf_data_path, run_id=None, mode='cpu'):
+        return '/tmp/flamegraph.svg'
+
+    def generate_flamegraph_from_profile(self, profile, run_id=None, mode='cpu', counters=None):
+        self.rendered_profile = profile
+        return '/tmp/flamegraph.svg'
+
+    def analyze_with_llm(self, folded_stacks_path, mode='cpu'):
+        return self.analysis
+
+    def stream_analysis(self, folded_stacks_path, mode='cpu'):
+        for bottleneck in self.analysis.get('identified_bottlenecks', []):
+            yield 'bottleneck', bottleneck
+        yield 'analysis', self.analysis
+
+    def save_analysis(self, run_id, analysis):
+        self.saved_analysis = analysis
+
+
+def wait_for(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+class JobQueueTestCase(unittest.TestCase):
+    def test_runs_all_stages(self):
+        analyzer = FakePerfAnalyzer()
+        queue = JobQueue(analyzer, workers=2)
+        job = wait_for(queue.submit('sleep 1', 1))
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(analyzer.finished_runs, ['run-1'])
+        self.assertEqual(job.stage, 'analyze')
+        self.assertEqual(job.analysis, {'overall_summary': 'ok'})
+        self.assertEqual(analyzer.saved_analysis, {'overall_summary': 'ok'})
+        self.assertIs(queue.get(job.id), job)
+        timings = job.to_dict()['timings']
+        self.assertEqual([span['stage'] for span in timings],
+                         ['collect_wait', 'render_wait', 'analyze_wait', 'job'])
+        self.assertIsNone(timings[-1]['error'])
+        queue.shutdown()
+
+    def test_streams_analysis_events(self):
+        analysis = {'identified_bottlenecks': [{'function_stack': 'a'}], 'overall_summary': 'ok'}
+        queue = JobQueue(FakePerfAnalyzer(analysis), workers=1)
+        job = wait_for(queue.submit('sleep 1', 1))
+        names = [name for name, _ in job.wait_for_events(0, timeout=1)]
+        self.assertEqual(names, ['bottleneck', 'analysis', 'end'])
+        self.assertEqual(job.wait_for_events(1)[0], ('analysis', analysis))
+        self.assertTrue(job.to_dict()['flamegraph_ready'])
+        queue.shutdown()
+
+    def test_failed_stage_stops_the_job(self):
+        queue = JobQueue(FakePerfAnalyzer(), workers=1)
+        job = wait_for(queue.submit('fail', 1))
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.stage, 'collect')
+        self.assertIn('Failed to collect perf data', job.error)
+        self.assertIn('Failed to collect perf data', job.to_dict()['timings'][-1]['error'])
+        queue.shutdown()
+
+    def test_llm_errors_become_warnings(self):
+        queue = JobQueue(FakePerfAnalyzer({'error': 'boom'}), workers=1)
+        job = wait_for(queue.submit('sleep 1', 1))
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.analysis, {})
+        self.assertEqual(job.warnings, ['AI analysis failed: boom'])
+        queue.shutdown()
+
+
+class ArtifactStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = ArtifactStore(self.root, max_bytes=0, max_age=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_runs_are_isolated(self):
+        first, second = self.store.create_run(), self.store.create_run()
+        self.assertNotEqual(self.store.artifact_path(first, PERF_DATA_NAME),
+                            self.store.artifact_path(second, PERF_DATA_NAME))
+        path = self.store.artifact_path(first, PERF_DATA_NAME)
+        self.assertEqual(self.store.run_for_path(path), first)
+
+    def test_identical_folded_stacks_are_shared(self):
+        first, second = self.store.create_run(), self.store.create_run()
+        digest, reused = self.store.store_folded(first, lambda f: f.write('a;b 1\n'))
+        self.assertFalse(reused)
+        same_digest, reused = self.store.store_folded(second, lambda f: f.write('a;b 1\n'))
+        self.assertTrue(reused)
+        self.assertEqual(digest, same_digest)
+        self.assertEqual(self.store.artifact_path(first, FOLDED_NAME),
+                         self.store.artifact_path(second, FOLDED_NAME))
+
+    def test_compressed_copies_are_reused_until_the_artifact_changes(self):
+        run_id = self.store.create_run()
+        self.store.store_folded(run_id, lambda f: f.write('a;b 1\n' * 100))
+        path = self.store.artifact_path(run_id, FOLDED_NAME)
+        encoded = self.store.encoded_path(path, 'gzip')
+        with gzip.open(encoded, 'rt') as f:
+            self.assertEqual(f.read(), 'a;b 1\n' * 100)
+        self.assertEqual(self.store.encoded_path(path, 'gzip'), encoded)
+
+        os.utime(encoded, (0, 0))
+        self.store.encoded_path(path, 'gzip')
+        self.assertGreater(os.path.getmtime(encoded), 0, 'stale copies must be recompressed')
+
+    def test_has_run_rejects_paths(self):
+        run_id = self.store.create_run()
+        self.assertTrue(self.store.has_run(run_id))
+        self.assertFalse(self.store.has_run('..'))
+        self.assertFalse(self.store.has_run(f'{run_id}/..'))
+        self.assertFalse(self.store.has_run('missing'))
+
+    def test_evicts_oldest_finished_runs_over_budget(self):
+        old, new = self.store.create_run(), self.store.create_run()
+        for run_id in (old, new):
+            with open(self.store.artifact_path(run_id, PERF_DATA_NAME), 'wb') as f:
+                f.write(b'x' * 1000)
+        os.utime(self.store.run_dir(old), (0, 0))
+
+        self.store.max_bytes = 1500
+        self.store.evict()
+        self.assertTrue(os.path.exists(self.store.run_dir(old)), 'active runs must not be evicted')
+
+        self.store.release(old)
+        self.store.release(new)
+        self.store.evict()
+        self.assertFalse(os.path.exists(self.store.run_dir(old)))
+        self.assertTrue(os.path.exists(self.store.run_dir(new)))
+
+    def test_objects_adopted_by_active_runs_are_not_evicted(self):
+        old = self.store.create_run()
+        digest, _ = self.store.store_folded(old, lambda f: f.write('a;b 1\n'))
+        self.store.release(old)
+        os.utime(self.store.object_dir(digest), (0, 0))
+        self.store.max_bytes = 1
+
+        # Eviction lands after the new run found the object, before run.json names it.
+        touch = self.store._touch
+        def evict_then_touch(path):
+            self.store.evict()
+            touch(path)
+
+        new = self.store.create_run()
+        with mock.patch.object(self.store, '_touch', side_effect=evict_then_touch):
+            _, reused = self.store.store_folded(new, lambda f: f.write('a;b 1\n'))
+        self.assertTrue(reused)
+        self.assertFalse(os.path.exists(self.store.run_dir(old)))
+        self.assertTrue(os.path.exists(self.store.artifact_path(new, FOLDED_NAME)))
+
+    def test_objects_are_evicted_with_the_last_run_referencing_them(self):
+        run_id = self.store.create_run()
+        digest, _ = self.store.store_folded(run_id, lambda f: f.write('a;b 1\n'))
+        self.store.release(run_id)
+        self.store.max_age = 100
+        os.utime(self.store.object_dir(digest), (0, 0))
+        self.store.evict()
+        self.assertTrue(os.path.exists(self.store.artifact_path(run_id, FOLDED_NAME)),
+                        'objects of retained runs must be kept')
+
+        os.utime(self.store.run_dir(run_id), (0, 0))
+        self.store.evict()
+        self.assertFalse(os.path.exists(self.store.run_dir(run_id)))
+        self.assertFalse(os.path.exists(self.store.object_dir(digest)))
+
+    def test_entries_that_cannot_be_removed_still_count(self):
+        run_id = self.store.create_run()
+        with open(self.store.artifact_path(run_id, PERF_DATA_NAME), 'wb') as f:
+            f.write(b'x' * 1000)
+        self.store.release(run_id)
+        self.store.max_bytes = 500
+        with mock.patch('modules.perf_analyzer.artifacts.os.rename', side_effect=PermissionError):
+            self.assertEqual(self.store.evict(), 0)
+        self.assertGreaterEqual(self.store.evict(), 1000)
+        self.assertFalse(os.path.exists(self.store.run_dir(run_id)))
+
+    def test_eviction_does_not_rescan_the_store(self):
+        self.store.max_bytes = 10000
+        first = self.store.create_run()
+        self.store.store_folded(first, lambda f: f.write('a;b 1\n'))
+        self.store.release(first)
+        self.assertEqual(self.store.evict(), 0)
+
+        second = self.store.create_run()
+        with mock.patch('modules.perf_analyzer.artifacts.os.walk', wraps=os.walk) as walk:
+            digest, _ = self.store.store_folded(second, lambda f: f.write('a;b 1\n' * 1000))
+            self.store.release(second)
+            self.assertEqual(self.store.evict(), 0)
+            # Only the released run is measured; its object was accounted as written.
+            self.assertEqual([c.args[0] for c in walk.call_args_list], [self.store.run_dir(second)])
+
+            self.store.max_bytes = 1000
+            self.assertGreaterEqual(self.store.evict(), 6000)
+        self.assertFalse(os.path.exists(self.store.object_dir(digest)))
+
+
+class ContinuousProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_window_store_merges_time_ranges(self):
+        store = WindowStore(self.root, max_bytes=0, max_age=0)
+        store.add(100, 110, Profile.from_stacks({'main;a': 1}))
+        store.add(110, 120, Profile.from_stacks({'main;a': 2, 'main;b': 1}))
+        store.add(120, 130, Profile.from_stacks({'main;b': 4}))
+
+        profile, ranges = store.merge(since=112, until=125)
+        self.assertEqual(ranges, [(110, 120), (120, 130)])
+        self.assertEqual(profile.function_self(), {'a': 2, 'b': 5})
+        self.assertEqual(store.merge()[0].total, 8)
+
+    def test_window_store_is_size_bounded(self):
+        store = WindowStore(self.root, max_bytes=1, max_age=0)
+        store.add(100, 110, Profile.from_stacks({'main;a': 1}))
+        store.add(110, 120, Profile.from_stacks({'main;b': 1}))
+        # The newest window is kept even when it alone is over budget.
+        self.assertEqual([w[:2] for w in store.windows()], [(110, 120)])
+
+    def test_parse_time_range(self):
+        self.assertEqual(parse_duration('5m'), 300)
+        self.assertEqual(parse_duration('90'), 90)
+        self.assertIsNone(parse_duration('soon'))
+        now = time.mktime((2025, 7, 17, 10, 30, 0, 0, 0, -1))
+        self.assertEqual(parse_time('10:02', now), now - 28 * 60)
+        self.assertEqual(parse_time('10:45', now), now + 15 * 60 - 86400)
+        self.assertEqual(parse_time('1700000000', now), 1700000000)
+
+    def test_profiler_folds_back_to_back_windows(self):
+        class FakeAnalyzer:
+            output_dir = self.root
+
+            def collapse_perf_data(self, path):
+                collapser = StackCollapser()
+                collapser.stacks['main;work'] = 3
+                return collapser
+
+        profiler = ContinuousProfiler(FakeAnalyzer(), str(os.getpid()), window=1, freq=1)
+
+        def fake_record(path):
+            with open(path, 'w') as f:
+                f.write('perf.data')
+            time.sleep(0.01)
+            return True
+
+        profiler._record = fake_record
+        self.assertTrue(profiler.start())
+        deadline = time.time() + 5
+        while len(profiler.store.windows()) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        profiler.stop()
+        self.assertEqual(profiler.status, 'stopped')
+        self.assertGreaterEqual(profiler.store.merge()[0].total, 9)
+        self.assertFalse([name for name in os.listdir(profiler.root) if name.endswith('.data')])
+
+    def test_unknown_target_fails(self):
+        profiler = ContinuousProfiler(type('A', (), {'output_dir': self.root})(), 'no-such-process-name')
+        self.assertFalse(profiler.start())
+        self.assertIn('No process matches', profiler.error)
+
+    def test_stop_between_windows_starts_no_new_window(self):
+        profiler = ContinuousProfiler(type('A', (), {'output_dir': self.root})(), str(os.getpid()))
+        profiler._stopping.set()
+        with mock.patch('modules.perf_analyzer.continuous.subprocess.Popen') as popen:
+            self.assertFalse(profiler._record(os.path.join(profiler.root, 'window.data')))
+        popen.assert_not_called()
+
+    def test_manager_limits_and_deletes_sessions(self):
+        def fake_record(profiler, path):
+            with open(path, 'w') as f:
+                f.write('perf.data')
+            profiler._stopping.wait(0.01)
+            return True
+
+        analyzer = type('A', (), {'output_dir': self.root,
+                                  'collapse_perf_data': lambda self, path: StackCollapser()})()
+        manager = ContinuousProfilerManager(analyzer, max_sessions=1)
+        with mock.patch.object(ContinuousProfiler, '_record', fake_record):
+            first = manager.start(str(os.getpid()))
+            self.addCleanup(first.stop)
+            self.assertEqual(first.status, 'running')
+            self.assertIsNone(manager.start(str(os.getpid())))
+
+            manager.stop(first.id)
+            second = manager.start(str(os.getpid()))
+            self.addCleanup(second.stop)
+            self.assertEqual(second.status, 'running')
+
+            manager.delete(first.id)
+            self.assertIsNone(manager.get(first.id))
+            self.assertFalse(os.path.exists(first.root))
+            manager.delete(second.id)
+            self.assertEqual(second.status, 'stopped')
+            self.assertEqual(manager.sessions(), [])
+
+
+class IngestStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_merges_uploads_per_host(self):
+        store = IngestStore(self.root)
+        store.ingest(io.BytesIO(b"main;work;malloc 6\nmain;idle 4\n"), 'web-1', 'checkout', timestamp=100)
+        store.ingest(io.BytesIO(gzip.compress(b"main;work;malloc 2\nmain;work 8\n")), 'web-2', 'checkout',
+                     timestamp=200)
+        store.ingest(io.BytesIO(gzip.compress(PERF_SCRIPT_SAMPLE.encode())), 'web-2', 'checkout',
+                     timestamp=300, fmt='perf-script')
+
+        self.assertEqual(store.profile('checkout').total, 24)
+        self.assertEqual(store.profile('checkout', hosts=['web-1']).total, 10)
+        self.assertEqual(store.profile('checkout', since=150, until=250).total, 10)
+        self.assertIsNone(store.profile('billing'))
+
+        rows = store.hosts('checkout', function='malloc')
+        self.assertEqual([(row['host'], row['samples']) for row in rows], [('web-1', 6), ('web-2', 2)])
+        self.assertEqual(rows[1]['uploads'], 2)
+
+        # The aggregates are rebuilt from disk.
+        self.assertEqual(IngestStore(self.root).services(),
+                         {'checkout': {'samples': 24, 'hosts': ['web-1', 'web-2']}})
+
+    def test_rejects_bad_uploads(self):
+        store = IngestStore(self.root)
+        self.assertIn('error', store.ingest(io.BytesIO(b"a 1\n"), '../etc', 'checkout'))
+        self.assertIn('error', store.ingest(io.BytesIO(b"a 1\n"), 'web-1', 'checkout', fmt='pprof'))
+        self.assertIn('error', store.ingest(io.BytesIO(b"not a profile\n"), 'web-1', 'checkout'))
+        self.assertEqual(store.services(), {})
+
+
+class UploadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.uploads = UploadManager(self.root, ttl=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_detects_formats(self):
+        self.assertEqual(detect_format(b'PERFILE2\x00\x01'), 'perf-data')
+        self.assertEqual(detect_format(PERF_SCRIPT_SAMPLE.encode()), 'perf-script')
+        self.assertEqual(detect_format(b"main;foo 10"), 'folded')
+        # A head cut at DETECT_BYTES ends mid-line.
+        self.assertEqual(detect_format((b"main;a 3\n" * DETECT_BYTES)[:DETECT_BYTES]), 'folded')
+        self.assertIsNone(detect_format(b"hello world\n"))
+        self.assertEqual(parse_content_range('bytes 0-99/200'), (0, 99, 200))
+        self.assertIsNone(parse_content_range('bytes 100-99/200'))
+
+    def test_parses_chunks_as_they_arrive(self):
+        body = gzip.compress(''.join(f"main;f{i % 7} {i}\n" for i in range(1, 5000)).encode())
+        upload = self.uploads.create('stacks.folded.gz', size=len(body))
+        half = len(body) // 2
+        upload.write_chunk(0, io.BytesIO(body[:half]))
+        # A resent chunk at a stale offset is refused; the client resumes.
+        result = upload.write_chunk(0, io.BytesIO(body[:half]))
+        self.assertEqual(result['offset'], half)
+        self.assertIn('error', upload.finish())
+
+        upload.write_chunk(half, io.BytesIO(body[half:]))
+        self.assertIsNone(upload.finish()['error'])
+        self.assertTrue(upload.wait(timeout=5))
+        self.assertEqual((upload.status, upload.format, upload.compressed), ('parsed', 'folded', True))
+        self.assertEqual(upload.profile.total, sum(range(1, 5000)))
+
+    def test_upload_job_skips_collection(self):
+        upload = self.uploads.create('out.perf-folded')
+        upload.write_chunk(0, io.BytesIO(b"main;work 5\n"))
+        upload.finish()
+        analyzer = FakePerfAnalyzer()
+        queue = JobQueue(analyzer, workers=1)
+        job = wait_for(queue.submit('upload: out.perf-folded', None, upload=upload))
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.to_dict()['stages'], ['upload', 'render', 'analyze'])
+        self.assertEqual(analyzer.rendered_profile.total, 5)
+        self.assertFalse(os.path.exists(upload.root))
+        queue.shutdown()
+
+    def test_perf_script_uploads_are_folded_in_their_mode(self):
+        upload = self.uploads.create('sched.txt', mode='offcpu')
+        upload.write_chunk(0, io.BytesIO(SCHED_SCRIPT_SAMPLE.encode()))
+        upload.finish()
+        self.assertTrue(upload.wait(timeout=5))
+        self.assertEqual((upload.status, upload.format), ('parsed', 'perf-script'))
+        self.assertEqual(upload.profile.total, 2000)
+
+        queue = JobQueue(FakePerfAnalyzer(), workers=1)
+        self.addCleanup(queue.shutdown)
+        job = wait_for(queue.submit('upload: sched.txt', None, upload=upload, mode='cpu'))
+        self.assertEqual(job.status, 'failed')
+        self.assertIn("folded as 'offcpu'", job.error)
+        self.assertIsInstance(self.uploads.create('x', mode='bogus'), dict)
+
+    def test_upload_job_completes_while_collection_is_saturated(self):
+        release = threading.Event()
+
+        class SlowCaptureAnalyzer(FakePerfAnalyzer):
+            def collect_data(self, command, duration=10, run_id=None, mode='cpu'):
+                release.wait(5)
+                return super().collect_data(command, duration, run_id, mode)
+
+        queue = JobQueue(SlowCaptureAnalyzer(), workers=1, stage_limits={'collect': 1})
+        self.addCleanup(queue.shutdown)
+        self.addCleanup(release.set)
+        captures = [queue.submit('sleep 1', 1) for _ in range(4)]
+
+        upload = self.uploads.create('out.perf-folded')
+        upload.write_chunk(0, io.BytesIO(b"main;work 5\n"))
+        upload.finish()
+        job = wait_for(queue.submit('upload: out.perf-folded', None, upload=upload))
+        self.assertEqual(job.status, 'done')
+        # At most one capture runs; the others wait without holding a worker.
+        statuses = [capture.status for capture in captures]
+        self.assertLessEqual(statuses.count('running'), 1)
+        self.assertEqual(statuses.count('queued'), 4 - statuses.count('running'))
+
+        release.set()
+        self.assertEqual({wait_for(capture).status for capture in captures}, {'done'})
+
+    def test_unrecognized_upload_fails(self):
+        upload = self.uploads.create('notes.txt')
+        upload.write_chunk(0, io.BytesIO(b"hello world\n"))
+        upload.finish()
+        self.assertTrue(upload.wait(timeout=5))
+        self.assertEqual(upload.status, 'failed')
+        self.assertIn('Unrecognized file format', upload.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
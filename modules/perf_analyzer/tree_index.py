@@ -0,0 +1,341 @@
+import bisect
+import json
+import mmap
+import re
+import struct
+import sys
+from array import array
+
+from .profile import ROOT
+
+# Index file format: magic, a header of counts, then uncompressed
+# little-endian arrays that are memory-mapped rather than parsed:
+#   <nodes: u64><frames: u64><frame table length: u64>
+#   <self: int64 * nodes><total: int64 * nodes>
+#   <frame self: int64 * frames><frame total: int64 * frames>
+#   <parent: int32 * nodes><frame: int32 * nodes>
+#   <child start: int32 * (nodes + 1)><children: int32 * (nodes - 1)>
+#   <frame node start: int32 * (frames + 1)><frame nodes: int32 * (nodes - 1)>
+#   <frame table: JSON list>
+# Children and the nodes of each frame are ordered by total samples, hottest
+# first, so the first entries are always the ones worth showing.
+TREE_INDEX_MAGIC = b'PFTREE1\n'
+TREE_INDEX_HEADER = struct.Struct('<QQQ')
+TREE_INDEX_ENCODING = 'utf-8'
+TREE_INDEX_ERRORS = 'surrogateescape'
+
+# Search results: matching nodes whose overlap is resolved exactly before
+# the matched share is estimated instead
+SEARCH_MAX_NODES = 200000
+
+
+def _highlight(name, pattern):
+    """Returns the [start, end) character ranges of `pattern` in `name`."""
+    return [[m.start(), m.end()] for m in pattern.finditer(name)]
+
+
+class TreeIndex:
+    """
+    A read-only, pre-built index of a profile's call tree for serving it
+    piece by piece: the hottest children of any node, a few levels deep,
+    and the frames whose name matches a search.
+
+    The index is written once next to the profile and memory-mapped when
+    opened, so queries only touch the nodes they return, however many
+    stacks the profile has.
+    """
+
+    def __init__(self, buffer):
+        if bytes(buffer[:len(TREE_INDEX_MAGIC)]) != TREE_INDEX_MAGIC:
+            raise ValueError("Not a tree index")
+        self._buffer = buffer
+        nodes, frames, frames_len = TREE_INDEX_HEADER.unpack_from(buffer, len(TREE_INDEX_MAGIC))
+        offset = len(TREE_INDEX_MAGIC) + TREE_INDEX_HEADER.size
+
+        layout = [
+            ('self_samples', 'q', nodes), ('total_samples', 'q', nodes),
+            ('frame_self', 'q', frames), ('frame_total', 'q', frames),
+            ('parent', 'i', nodes), ('frame', 'i', nodes),
+            ('child_start', 'i', nodes + 1), ('children', 'i', nodes - 1),
+            ('frame_node_start', 'i', frames + 1), ('frame_nodes', 'i', nodes - 1),
+        ]
+        for attr, typecode, count in layout:
+            size = array(typecode).itemsize * count
+            setattr(self, attr, self._view(buffer, offset, typecode, size))
+            offset += size
+
+        self.frames = json.loads(bytes(buffer[offset:offset + frames_len]).decode(TREE_INDEX_ENCODING,
+                                                                                  TREE_INDEX_ERRORS))
+        self._frame_ids = {name: i for i, name in enumerate(self.frames)}
+        # One lower-cased haystack, so a search is a few str.find calls.
+        lowered = [name.lower() for name in self.frames]
+        self._haystack = '\n'.join(lowered)
+        self._haystack_starts = []
+        position = 0
+        for name in lowered:
+            self._haystack_starts.append(position)
+            position += len(name) + 1
+
+    @staticmethod
+    def _view(buffer, offset, typecode, size):
+        if sys.byteorder == 'little':
+            return memoryview(buffer)[offset:offset + size].cast(typecode)
+        a = array(typecode)
+        a.frombytes(bytes(buffer[offset:offset + size]))
+        a.byteswap()
+        return a
+
+    # --- Building ---
+
+    @staticmethod
+    def _group(keys, count, weights, groups):
+        """
+        Counting-sorts node IDs 1..count-1 by `keys` into CSR form, each
+        group ordered by `weights`, heaviest first.
+
+        Returns:
+            tuple: (start offsets, one per group plus one; grouped node IDs)
+        """
+        starts = array('i', [0]) * (groups + 1)
+        for node in range(1, count):
+            starts[keys[node] + 1] += 1
+        for i in range(groups):
+            starts[i + 1] += starts[i]
+
+        grouped = array('i', [0]) * (count - 1)
+        fill = array('i', starts)
+        for node in range(1, count):
+            key = keys[node]
+            grouped[fill[key]] = node
+            fill[key] += 1
+
+        for i in range(groups):
+            start, end = starts[i], starts[i + 1]
+            if end - start > 1:
+                grouped[start:end] = array('i', sorted(grouped[start:end], key=weights.__getitem__, reverse=True))
+        return starts, grouped
+
+    @classmethod
+    def build(cls, profile):
+        """
+        Builds the index of a profile, using flat arrays only, so profiles
+        with millions of nodes fit in memory.
+
+        Args:
+            profile (Profile): The call tree.
+
+        Returns:
+            bytes: The index, to be written to disk and opened with `open`.
+        """
+        nodes = len(profile.parent)
+        frame_count = len(profile.frames)
+        parent, frame, total = profile.parent, profile.frame, profile.total_samples
+        self_samples = profile.self_samples
+
+        child_start, children = cls._group(parent, nodes, total, nodes)
+        frame_node_start, frame_nodes = cls._group(frame, nodes, total, frame_count)
+
+        # Per function: self samples, and samples with the function anywhere
+        # on the stack, counting recursive calls once (see Profile.function_total).
+        frame_self = array('q', [0]) * frame_count
+        frame_total = array('q', [0]) * frame_count
+        on_path = array('i', [0]) * frame_count
+        work = array('i', children[child_start[ROOT]:child_start[ROOT + 1]])
+        while work:
+            node = work.pop()
+            if node < 0:
+                on_path[frame[~node]] -= 1
+                continue
+            frame_id = frame[node]
+            frame_self[frame_id] += self_samples[node]
+            if not on_path[frame_id]:
+                frame_total[frame_id] += total[node]
+            on_path[frame_id] += 1
+            work.append(~node)
+            work.extend(children[child_start[node]:child_start[node + 1]])
+
+        frames = json.dumps(profile.frames, ensure_ascii=False).encode(TREE_INDEX_ENCODING, TREE_INDEX_ERRORS)
+        arrays = [array('q', self_samples), array('q', total), frame_self, frame_total,
+                  array('i', parent), array('i', frame), child_start, children, frame_node_start, frame_nodes]
+        if sys.byteorder != 'little':
+            for a in arrays:
+                a.byteswap()
+
+        chunks = [TREE_INDEX_MAGIC, TREE_INDEX_HEADER.pack(nodes, frame_count, len(frames))]
+        chunks.extend(a.tobytes() for a in arrays)
+        chunks.append(frames)
+        return b''.join(chunks)
+
+    @classmethod
+    def open(cls, path):
+        """Memory-maps an index written from `build`."""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    # --- Queries ---
+
+    @property
+    def total(self):
+        return self.total_samples[ROOT]
+
+    def __len__(self):
+        """The number of call tree nodes, excluding the root."""
+        return len(self.parent) - 1
+
+    def name(self, node):
+        return self.frames[self.frame[node]] if node != ROOT else 'all'
+
+    def path(self, node):
+        """Returns the root-first list of frame names leading to `node`."""
+        names = []
+        while node > ROOT:
+            names.append(self.frames[self.frame[node]])
+            node = self.parent[node]
+        names.reverse()
+        return names
+
+    def child_count(self, node):
+        return self.child_start[node + 1] - self.child_start[node]
+
+    def find(self, path):
+        """Returns the node for a root-first list of frame names, or None."""
+        node = ROOT
+        for name in path:
+            frame_id = self._frame_ids.get(name)
+            if frame_id is None:
+                return None
+            start, end = self.child_start[node], self.child_start[node + 1]
+            for i in range(start, end):
+                if self.frame[self.children[i]] == frame_id:
+                    node = self.children[i]
+                    break
+            else:
+                return None
+        return node
+
+    def subtree(self, node, depth=1, limit=50, search=None):
+        """
+        Summarizes a node and its hottest descendants.
+
+        Args:
+            node (int): The node, e.g. from `find`; 0 is the root.
+            depth (int): How many levels of children to include. The last
+                level only has its number of children.
+            limit (int): The most children listed per node; the rest are
+                summed up in `other_total`.
+            search (str): Highlight where this text occurs in frame names,
+                ignoring case.
+
+        Returns:
+            dict: The node as {id, name, self, total, child_count, children,
+                other_total, other_count}, with `match` ranges when searching.
+        """
+        pattern = re.compile(re.escape(search), re.IGNORECASE) if search else None
+
+        def summarize(node, levels):
+            count = self.child_count(node)
+            summary = {
+                'id': node,
+                'name': self.name(node),
+                'self': self.self_samples[node],
+                'total': self.total_samples[node],
+                'child_count': count,
+            }
+            if pattern is not None:
+                summary['match'] = _highlight(summary['name'], pattern) if node != ROOT else []
+            if levels > 0 and count:
+                start = self.child_start[node]
+                shown = [self.children[i] for i in range(start, start + min(count, limit))]
+                summary['children'] = [summarize(child, levels - 1) for child in shown]
+                summary['other_count'] = count - len(shown)
+                summary['other_total'] = (self.total_samples[node] - self.self_samples[node]
+                                          - sum(child['total'] for child in summary['children']))
+            return summary
+
+        return summarize(node, depth)
+
+    def _matching_frames(self, search):
+        """Yields the IDs of the frames whose name contains `search`, ignoring case."""
+        needle = search.lower()
+        starts = self._haystack_starts
+        position = self._haystack.find(needle)
+        while position != -1:
+            frame_id = bisect.bisect_right(starts, position) - 1
+            yield frame_id
+            # Continue after this frame; one match per frame is enough.
+            next_start = starts[frame_id + 1] if frame_id + 1 < len(starts) else len(self._haystack)
+            position = self._haystack.find(needle, next_start)
+
+    def search(self, search, limit=20, paths=3):
+        """
+        Finds the frames whose name contains `search`, ignoring case.
+
+        Args:
+            search (str): The text to look for.
+            limit (int): The most frames returned, hottest first.
+            paths (int): The hottest call paths listed per frame.
+
+        Returns:
+            dict: {matches: [{name, match, self, total, node_count, paths}],
+                match_count, matched_total, matched_percent, exact}, where
+                `matched_total` counts samples with any matching frame.
+        """
+        if not search:
+            return {'matches': [], 'match_count': 0, 'matched_total': 0, 'matched_percent': 0.0, 'exact': True}
+
+        pattern = re.compile(re.escape(search), re.IGNORECASE)
+        frame_ids = [f for f in self._matching_frames(search) if pattern.search(self.frames[f])]
+        frame_ids.sort(key=lambda f: self.frame_total[f], reverse=True)
+
+        matches = []
+        for frame_id in frame_ids[:limit]:
+            name = self.frames[frame_id]
+            start, end = self.frame_node_start[frame_id], self.frame_node_start[frame_id + 1]
+            matches.append({
+                'name': name,
+                'match': _highlight(name, pattern),
+                'self': self.frame_self[frame_id],
+                'total': self.frame_total[frame_id],
+                'node_count': end - start,
+                'paths': [{'id': self.frame_nodes[i], 'path': self.path(self.frame_nodes[i]),
+                           'total': self.total_samples[self.frame_nodes[i]]}
+                          for i in range(start, min(end, start + paths))],
+            })
+
+        matched_total, exact = self._matched_total(frame_ids)
+        return {
+            'matches': matches,
+            'match_count': len(frame_ids),
+            'matched_total': matched_total,
+            'matched_percent': round(100 * matched_total / self.total, 2) if self.total else 0.0,
+            'exact': exact,
+        }
+
+    def _matched_total(self, frame_ids):
+        """
+        Samples whose stack has any of the frames, like flamegraph.pl's
+        "Matched" figure. Nested matches are only counted once.
+
+        Returns:
+            tuple: (samples, exact); too many matching nodes give an upper bound.
+        """
+        if len(frame_ids) <= 1:
+            return (self.frame_total[frame_ids[0]] if frame_ids else 0), True
+
+        node_count = sum(self.frame_node_start[f + 1] - self.frame_node_start[f] for f in frame_ids)
+        if node_count > SEARCH_MAX_NODES:
+            return min(self.total, sum(self.frame_total[f] for f in frame_ids)), False
+
+        matching = set(frame_ids)
+        parent, frame = self.parent, self.frame
+        total = 0
+        for frame_id in frame_ids:
+            for i in range(self.frame_node_start[frame_id], self.frame_node_start[frame_id + 1]):
+                node = self.frame_nodes[i]
+                ancestor = parent[node]
+                while ancestor > ROOT and frame[ancestor] not in matching:
+                    ancestor = parent[ancestor]
+                if ancestor <= ROOT:
+                    total += self.total_samples[node]
+        return total, True
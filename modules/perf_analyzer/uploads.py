@@ -0,0 +1,399 @@
+import gzip
+import io
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from core.config import settings
+from .collapse import PERF_SCRIPT_ENCODING, PERF_SCRIPT_ERRORS
+from .ingest import GZIP_MAGIC, FORMAT_FOLDED, FORMAT_PERF_SCRIPT
+from .modes import DEFAULT_MODE, MODES
+from .profile import Profile
+
+FORMAT_PERF_DATA = 'perf-data'
+UPLOAD_FORMATS = (FORMAT_PERF_DATA, FORMAT_PERF_SCRIPT, FORMAT_FOLDED)
+
+# perf.data files start with this magic (written little-endian).
+PERF_DATA_MAGIC = b'PERFILE2'
+
+# Bytes inspected to detect an upload's format.
+DETECT_BYTES = 64 * 1024
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+DATA_NAME = 'upload.bin'
+PERF_DATA_OUT_NAME = 'perf.data'
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+FOLDED_LINE_RE = re.compile(r'^\S.* \d+$')
+
+
+class UploadAborted(Exception):
+    pass
+
+
+def parse_content_range(value):
+    """
+    Parses a `Content-Range: bytes start-end/total` request header.
+
+    Returns:
+        tuple: (start, end, total) with `end` inclusive and `total` None if
+            unknown, or None if the header is malformed.
+    """
+    match = CONTENT_RANGE_RE.match((value or '').strip())
+    if not match:
+        return None
+    start, end = int(match.group(1)), int(match.group(2))
+    total = None if match.group(3) == '*' else int(match.group(3))
+    if end < start or (total is not None and end >= total):
+        return None
+    return start, end, total
+
+
+def detect_format(head):
+    """
+    Guesses the format of an upload from its first (decompressed) bytes.
+
+    Args:
+        head (bytes): The start of the file, at most DETECT_BYTES; a head of
+            exactly that size is taken to end mid-line.
+
+    Returns:
+        str: 'perf-data', 'perf-script' or 'folded', or None if unknown.
+    """
+    if head.startswith(PERF_DATA_MAGIC):
+        return FORMAT_PERF_DATA
+    text = head.decode(PERF_SCRIPT_ENCODING, PERF_SCRIPT_ERRORS)
+    lines = text.split('\n')
+    if len(head) >= DETECT_BYTES:
+        # The last line was cut off.
+        lines = lines[:-1]
+    lines = [line for line in lines if line.strip() and not line.startswith('#')]
+    if not lines:
+        return None
+    # `perf script` prints each frame of a sample on its own indented line.
+    if any(line[0] in ' \t' for line in lines):
+        return FORMAT_PERF_SCRIPT
+    if all(FOLDED_LINE_RE.match(line) for line in lines):
+        return FORMAT_FOLDED
+    return None
+
+
+class _GrowingFileReader(io.RawIOBase):
+    """
+    Reads an upload's data file while it is still being written, blocking
+    until more bytes arrive and reporting end of file only once the upload
+    is complete.
+    """
+
+    def __init__(self, upload):
+        self._upload = upload
+        self._f = open(upload.data_path, 'rb')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._upload.wait_for_bytes(self._position + 1):
+            return 0
+        self._f.seek(self._position)
+        n = self._f.readinto(memoryview(buffer)[:self._upload.received - self._position])
+        self._position += n
+        return n
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+class Upload:
+    """
+    One file being uploaded in chunks.
+
+    Chunks are appended to a file on disk as they arrive; a chunk may be
+    resent from the last acknowledged offset after a dropped connection. A
+    background thread detects the format from the first bytes and parses
+    text formats as they arrive, so little work is left once the last
+    chunk lands. perf.data files need `perf script`, which can only run on
+    the complete file. `perf script` output is folded as the profiling
+    `mode` it was recorded in, e.g. by blocked time for 'offcpu'.
+    """
+
+    def __init__(self, root, filename, size=None, fmt=None, mode=DEFAULT_MODE):
+        self.id = uuid.uuid4().hex
+        self.filename = os.path.basename(filename or '') or 'upload'
+        self.size = size
+        self.format = fmt
+        self.mode = mode
+        self.compressed = None
+        self.root = os.path.join(root, self.id)
+        self.data_path = os.path.join(self.root, DATA_NAME)
+        self.received = 0
+        self.status = 'receiving'  # receiving -> complete -> parsed | failed; or aborted
+        self.error = None
+        self.created_at = self.updated_at = time.time()
+
+        # Parse results
+        self.profile = None
+        self.counters = None
+        self.perf_data_path = None
+
+        os.makedirs(self.root)
+        open(self.data_path, 'wb').close()
+        self._changed = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._parser = threading.Thread(target=self._parse, name=f"perf-upload-{self.id[:8]}", daemon=True)
+        self._parser.start()
+
+    @property
+    def finished(self):
+        return self.status in ('parsed', 'failed', 'aborted')
+
+    def write_chunk(self, start, stream, length=None):
+        """
+        Writes one chunk at byte offset `start`, streaming it to disk.
+
+        Args:
+            start (int): The chunk's offset; must equal the bytes received so far.
+            stream: A binary file-like object with the chunk's bytes.
+            length (int): The chunk's length, if known.
+
+        Returns:
+            dict: The upload's state, or an error dictionary. A dropped
+                connection keeps every byte that made it to disk.
+        """
+        if not self._write_lock.acquire(blocking=False):
+            return {"error": "Another chunk of this upload is being written.", "offset": self.received}
+        try:
+            if self.status != 'receiving':
+                return {"error": f"The upload is {self.status}.", "offset": self.received}
+            if start != self.received:
+                return {"error": f"Expected a chunk at offset {self.received}.", "offset": self.received}
+            max_bytes = self.size if self.size is not None else settings.PERF_UPLOAD_MAX_BYTES
+            if length is not None and start + length > max_bytes:
+                return {"error": f"The upload would exceed {max_bytes} bytes.", "offset": self.received}
+
+            with open(self.data_path, 'r+b') as f:
+                f.seek(start)
+                while True:
+                    block = stream.read(COPY_BUFFER_SIZE)
+                    if not block:
+                        break
+                    if self.received + len(block) > max_bytes:
+                        return {"error": f"The upload would exceed {max_bytes} bytes.", "offset": self.received}
+                    f.write(block)
+                    f.flush()
+                    self._advance(len(block))
+            return self.to_dict()
+        finally:
+            self._write_lock.release()
+
+    def _advance(self, n):
+        with self._changed:
+            self.received += n
+            self.updated_at = time.time()
+            self._changed.notify_all()
+
+    def finish(self):
+        """
+        Marks the upload as complete once every byte has arrived.
+
+        Returns:
+            dict: The upload's state, or an error dictionary.
+        """
+        with self._write_lock:
+            if self.status in ('complete', 'parsed'):
+                return self.to_dict()
+            if self.status != 'receiving':
+                return {"error": self.error or f"The upload is {self.status}."}
+            if not self.received:
+                return {"error": "The upload is empty."}
+            if self.size is not None and self.received != self.size:
+                return {"error": f"Received {self.received} of {self.size} bytes.", "offset": self.received}
+            self._set_status('complete')
+        return self.to_dict()
+
+    def abort(self):
+        """Stops the upload and deletes its files."""
+        self._set_status('aborted')
+        self._parser.join()
+        self.cleanup()
+
+    def cleanup(self):
+        """Deletes the upload's files once their contents have been taken."""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def wait(self, timeout=None):
+        """Waits until the upload is parsed, failed or aborted."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.finished, timeout)
+
+    def wait_for_bytes(self, n):
+        """
+        Waits until at least `n` bytes have been received.
+
+        Returns:
+            bool: False if the upload completed with fewer bytes.
+
+        Raises:
+            UploadAborted: If the upload was aborted.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.received >= n or self.status != 'receiving')
+            if self.status == 'aborted':
+                raise UploadAborted()
+            return self.received >= n
+
+    def _set_status(self, status, error=None):
+        with self._changed:
+            if self.status in ('aborted', 'failed'):
+                return
+            if status == 'aborted':
+                self.profile = None
+            self.status = status
+            self.error = error
+            self.updated_at = time.time()
+            self._changed.notify_all()
+
+    def _open(self):
+        """Opens the data as a decompressed stream that blocks for more bytes."""
+        stream = io.BufferedReader(_GrowingFileReader(self), COPY_BUFFER_SIZE)
+        self.wait_for_bytes(len(GZIP_MAGIC))
+        self.compressed = stream.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC
+        if self.compressed:
+            stream = io.BufferedReader(gzip.GzipFile(fileobj=stream, mode='rb'), COPY_BUFFER_SIZE)
+        return stream
+
+    def _head(self):
+        """Returns the first decompressed bytes, for format detection."""
+        self.wait_for_bytes(DETECT_BYTES)
+        with open(self.data_path, 'rb') as f:
+            head = f.read(min(self.received, DETECT_BYTES))
+        if head.startswith(GZIP_MAGIC):
+            head = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(head, DETECT_BYTES)
+        return head
+
+    def _parse(self):
+        try:
+            self.format = self.format or detect_format(self._head())
+            if self.format is None:
+                raise ValueError("Unrecognized file format; expected perf.data, perf script output or folded stacks.")
+
+            with self._open() as stream:
+                if self.format == FORMAT_PERF_DATA:
+                    self._write_perf_data(stream)
+                else:
+                    text = io.TextIOWrapper(stream, encoding=PERF_SCRIPT_ENCODING,
+                                            errors=PERF_SCRIPT_ERRORS, newline='\n')
+                    if self.format == FORMAT_PERF_SCRIPT:
+                        collapser = MODES[self.mode].collapser().feed_lines(text)
+                        self.profile = Profile.from_stacks(collapser.stacks)
+                        self.counters = getattr(collapser, 'functions', None)
+                    else:
+                        self.profile = Profile.from_folded(text)
+                    if not self.profile.total:
+                        raise ValueError("The uploaded file has no samples.")
+            self._set_status('parsed')
+            print(f"Parsed upload {self.id} ({self.filename}, {self.format}, {self.received} bytes).")
+        except UploadAborted:
+            pass
+        except (OSError, EOFError, ValueError, zlib.error) as e:
+            # Failing while chunks still arrive tells the client to stop early.
+            print(f"Failed to parse upload {self.id}: {e}")
+            self._set_status('failed', f"Could not read the uploaded file: {e}")
+
+    def _write_perf_data(self, stream):
+        # Uncompressed files already are the perf.data; just wait for the end.
+        if not self.compressed:
+            self.wait_for_bytes(float('inf'))
+            self.perf_data_path = self.data_path
+            return
+        self.perf_data_path = os.path.join(self.root, PERF_DATA_OUT_NAME)
+        with open(self.perf_data_path, 'wb') as out:
+            shutil.copyfileobj(stream, out, COPY_BUFFER_SIZE)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'format': self.format,
+            'mode': self.mode,
+            'compressed': self.compressed,
+            'size': self.size,
+            'offset': self.received,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+
+
+class UploadManager:
+    """
+    Keeps track of chunked uploads. Uploads that stop receiving chunks for
+    `ttl` seconds before completing are deleted.
+    """
+
+    def __init__(self, root, ttl=None):
+        self.root = root
+        self.ttl = settings.PERF_UPLOAD_TTL if ttl is None else ttl
+        os.makedirs(root, exist_ok=True)
+        self._uploads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, filename, size=None, fmt=None, mode=None):
+        """
+        Starts an upload.
+
+        Args:
+            filename (str): The name of the file being uploaded.
+            size (int): Its total size in bytes, if known.
+            fmt (str): 'perf-data', 'perf-script' or 'folded'; detected from
+                the first bytes if not given.
+            mode (str): The profiling mode the capture was recorded in, which
+                decides how `perf script` output is folded. Defaults to 'cpu'.
+
+        Returns:
+            Upload: The new upload, or an error dictionary.
+        """
+        if fmt and fmt not in UPLOAD_FORMATS:
+            return {"error": f"Unsupported format '{fmt}'; expected one of {', '.join(UPLOAD_FORMATS)}."}
+        if mode and mode not in MODES:
+            return {"error": f"Unknown profiling mode '{mode}'."}
+        if size is not None and not 0 < size <= settings.PERF_UPLOAD_MAX_BYTES:
+            return {"error": f"The file must be between 1 and {settings.PERF_UPLOAD_MAX_BYTES} bytes."}
+        self.expire()
+        upload = Upload(self.root, filename, size, fmt or None, mode or DEFAULT_MODE)
+        with self._lock:
+            self._uploads[upload.id] = upload
+        return upload
+
+    def get(self, upload_id):
+        with self._lock:
+            return self._uploads.get(upload_id)
+
+    def remove(self, upload_id):
+        """Forgets an upload and deletes its files."""
+        with self._lock:
+            upload = self._uploads.pop(upload_id, None)
+        if upload:
+            upload.abort()
+        return upload
+
+    def expire(self):
+        """Deletes uploads, finished or abandoned, that are idle for longer than `ttl`."""
+        if not self.ttl:
+            return
+        now = time.time()
+        with self._lock:
+            stale = [upload_id for upload_id, upload in self._uploads.items()
+                     if now - upload.updated_at > self.ttl and upload.status != 'complete']
+        for upload_id in stale:
+            print(f"Deleting idle upload {upload_id}.")
+            self.remove(upload_id)